@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+"""Load-test the HTTP front end against local stand-ins.
+
+The app is built with ``create_flask_app`` in a child process and served by
+a threaded WSGI server, with:
+
+- a fake raw.githubusercontent.com (``CCUTTER_TEMPLATE_RAW_BASE_URL``)
+  that answers every cookiecutter.json request after ``--github-latency``
+  seconds;
+- the in-memory Celery broker and store, so jobs are queued but never run;
+- a template registry whose TTL is ``--cache-ttl``, so the cache expires
+  during the run; and
+- the GitHub credential cache seeded with the load-test user, so the
+  credential precheck never leaves the box.
+
+Clients issue a weighted mix of ``GET /ccutter``, ``GET /ccutter/<type>``
+and ``POST /ccutter/<type>`` requests for ``--duration`` seconds.  The
+report gives throughput and latency percentiles for each kind of request,
+overall and for those requests that overlapped a template fetch (a cache
+expiry).
+
+    python loadtest.py --clients 16 --duration 30 --mix list=1,get=4,post=1
+"""
+import argparse
+import base64
+import bisect
+from collections import defaultdict
+import hashlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+from socketserver import ThreadingMixIn
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+USERNAME = "loadtest"
+TOKEN = "loadtest-token"
+ORGS = ["lsst-dm", "lsst-sims", "lsst-sqre", "lsst-sqre-testing"]
+PROJECT_TYPES = ["lsst-technote-bootstrap", "uservice-bootstrap"]
+
+TEMPLATES = {
+    "lsst-technote-bootstrap": {
+        "first_author": "First Author",
+        "series": ["SQR", "DMTN", "SMTN", "TEST"],
+        "serial_number": "000",
+        "title": "Document Title",
+        "repo_name": "{{ cookiecutter.series.lower() }}-"
+                     "{{ cookiecutter.serial_number }}",
+        "github_org": ["lsst-sqre", "lsst-dm", "lsst-sims", "lsst"],
+        "github_namespace": "{{ cookiecutter.github_org }}/"
+                            "{{ cookiecutter.repo_name }}",
+        "docushare_url": "",
+        "url": "https://{{ cookiecutter.repo_name }}.lsst.io",
+        "description": "A short description of this document",
+        "copyright_year": "2017",
+        "copyright_holder": "AURA/LSST"},
+    "uservice-bootstrap": {
+        "author_name": "Author Name",
+        "email": "author@lsst.org",
+        "svc_name": "service",
+        "github_repo": "",
+        "description": "A microservice",
+        "year": "2017"}}
+
+POST_BODIES = {
+    "lsst-technote-bootstrap": {"title": "Load test", "series": "TEST",
+                                "description": "Load test"},
+    "uservice-bootstrap": {"author_name": "Load Test",
+                           "email": "loadtest@lsst.org",
+                           "svc_name": "loadtest"}}
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeGitHub(object):
+    """Serve cookiecutter.json for every template, recording when each
+    fetch was in progress.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.fetches = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                started = time.time()
+                time.sleep(fake.latency)
+                name = self.path.strip("/").split("/")[1]
+                body = json.dumps(TEMPLATES.get(
+                    name, TEMPLATES["uservice-bootstrap"])).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                fake.fetches.append((started, time.time()))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+def serve_app(github_url, args, conn):
+    """Build the app against the stand-ins and serve it (in a child
+    process).
+    """
+    registry_file = os.path.join(tempfile.mkdtemp(), "registry.json")
+    with open(registry_file, "w") as fh:
+        json.dump([{"url": "https://github.com/lsst-sqre/" + name,
+                    "ttl": args.cache_ttl} for name in PROJECT_TYPES], fh)
+    os.environ.update({
+        "LOGLEVEL": "WARNING",
+        "REDIS_URL": "memory://",
+        "CCUTTER_RESULT_BACKEND": "cache+memory://",
+        "CCUTTER_STORE_URL": "memory://",
+        "CCUTTER_TEMPLATE_REGISTRY": registry_file,
+        "CCUTTER_TEMPLATE_RAW_BASE_URL": github_url,
+        "CCUTTER_BACKGROUND_CACHE_REFRESH":
+            "1" if args.background_refresh else "0",
+        "CCUTTER_ADMISSION_CONTROL": "1" if args.admission else "0",
+        # Nothing drains the jobs, so per-user caps would refuse the rest.
+        "CCUTTER_FAIR_SCHEDULING": "1" if args.fair_scheduling else "0"})
+    from werkzeug.serving import make_server
+    from uservice_ccutter.createapp import create_flask_app
+    from uservice_ccutter.credentialcheck import _VERDICT_KEY
+    from uservice_ccutter.store import get_store
+
+    app = create_flask_app()
+    verdict_key = _VERDICT_KEY + hashlib.sha256(
+        (USERNAME + ":" + TOKEN).encode("utf-8")).hexdigest()
+    get_store(app).set(verdict_key, json.dumps(
+        {"valid": True, "identity": {"login": USERNAME, "orgs": ORGS}}))
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    conn.send(server.server_port)
+    server.serve_forever()
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in ("list", "get", "post"):
+            raise argparse.ArgumentTypeError("Unknown request kind " + kind)
+        weights[kind] = float(weight or 1)
+    return weights
+
+
+def run_client(base_url, weights, deadline, results, seed):
+    rng = random.Random(seed)
+    kinds = sorted(weights)
+    # random.choices is Python 3.6+.
+    cumulative = list(itertools.accumulate(weights[k] for k in kinds))
+    session = requests.Session()
+    auth = "Basic " + base64.b64encode(
+        (USERNAME + ":" + TOKEN).encode("utf-8")).decode("ascii")
+    while time.time() < deadline:
+        kind = kinds[bisect.bisect(cumulative,
+                                   rng.random() * cumulative[-1])]
+        ptype = rng.choice(PROJECT_TYPES)
+        started = time.time()
+        try:
+            if kind == "list":
+                resp = session.get(base_url + "/ccutter/")
+            elif kind == "get":
+                resp = session.get(base_url + "/ccutter/" + ptype + "/")
+            else:
+                resp = session.post(base_url + "/ccutter/" + ptype + "/",
+                                    json=POST_BODIES[ptype],
+                                    headers={"Authorization": auth})
+            status = resp.status_code
+        except requests.RequestException:
+            status = None
+        results.append((kind, started, time.time(), status))
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values)))
+                                     - 1))
+    return values[index]
+
+
+def summarize(results, duration, fetches):
+    def overlaps(started, ended):
+        return any(fs < ended and started < fe for fs, fe in fetches)
+
+    groups = defaultdict(list)
+    for kind, started, ended, status in results:
+        keys = [kind, "all"]
+        if overlaps(started, ended):
+            keys += [kind + "@refresh", "all@refresh"]
+        for key in keys:
+            groups[key].append((ended - started, status))
+    summary = {}
+    for key, samples in groups.items():
+        latencies = sorted(latency * 1000 for latency, _ in samples)
+        summary[key] = {
+            "requests": len(samples),
+            "errors": sum(1 for _, status in samples
+                          if status is None or status >= 500),
+            "refused": sum(1 for _, status in samples if status == 429),
+            "throughput": len(samples) / duration,
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99)}
+    return summary
+
+
+def print_report(summary, args, fetches):
+    print("%d clients for %ss; cache TTL %ss; GitHub latency %ss; "
+          "background refresh %s; %d template fetches" %
+          (args.clients, args.duration, args.cache_ttl, args.github_latency,
+           "on" if args.background_refresh else "off", len(fetches)))
+    header = "%-14s %9s %7s %7s %9s %9s %9s %9s" % (
+        "requests", "count", "errors", "429s", "req/s", "p50 ms",
+        "p95 ms", "p99 ms")
+    print(header)
+    print("-" * len(header))
+    order = ["list", "get", "post", "all"]
+    keys = [k for k in order if k in summary] + \
+        [k + "@refresh" for k in order if k + "@refresh" in summary]
+    for key in keys:
+        row = summary[key]
+        print("%-14s %9d %7d %7d %9.1f %9.1f %9.1f %9.1f" % (
+            key, row["requests"], row["errors"], row["refused"],
+            row["throughput"], row["p50_ms"], row["p95_ms"], row["p99_ms"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load-test the uservice-ccutter HTTP front end.")
+    parser.add_argument("--clients", type=int, default=8,
+                        help="concurrent clients (default: 8)")
+    parser.add_argument("--duration", type=float, default=20,
+                        help="seconds of load (default: 20)")
+    parser.add_argument("--mix", type=parse_mix, default="list=1,get=4,post=1",
+                        help="request weights (default: list=1,get=4,post=1)")
+    parser.add_argument("--cache-ttl", type=int, default=5,
+                        help="template cache TTL in seconds (default: 5)")
+    parser.add_argument("--github-latency", type=float, default=0.2,
+                        help="fake GitHub response time (default: 0.2)")
+    parser.add_argument("--background-refresh", action="store_true",
+                        help="refresh the template cache in the background")
+    parser.add_argument("--admission", action="store_true",
+                        help="leave admission control on")
+    parser.add_argument("--fair-scheduling", action="store_true",
+                        help="leave fair scheduling (and its per-user caps) "
+                        "on")
+    parser.add_argument("--json", action="store_true",
+                        help="print the report as JSON")
+    args = parser.parse_args()
+
+    github = FakeGitHub(args.github_latency)
+    github.start()
+    parent_conn, child_conn = multiprocessing.Pipe()
+    server = multiprocessing.get_context("fork").Process(
+        target=serve_app, args=(github.url, args, child_conn))
+    server.daemon = True
+    server.start()
+    if not parent_conn.poll(60):
+        sys.exit("The app did not start")
+    base_url = "http://127.0.0.1:%d" % parent_conn.recv()
+    # Priming fetches are not part of the run.
+    del github.fetches[:]
+
+    results = []
+    started = time.time()
+    deadline = started + args.duration
+    clients = [threading.Thread(target=run_client,
+                                args=(base_url, args.mix, deadline, results,
+                                      seed))
+               for seed in range(args.clients)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.time() - started
+    server.terminate()
+
+    summary = summarize(results, elapsed, list(github.fetches))
+    if args.json:
+        print(json.dumps(summary, indent=2, sort_keys=True))
+    else:
+        print_report(summary, args, github.fetches)
+
+
+if __name__ == "__main__":
+    main()
@@ -46,12 +46,15 @@ setup(
         'sqre-codekit==2.0.2',
         'celery[redis]==4.1.0',
         'cookiecutter==1.5.0',
+        'dulwich>=0.19.11,<0.20',
+        'msgpack>=0.5.6',
         'sqre-pytravisci==0.0.4',
         'structlog>=17.2.0',
         'urllib3>=1.22',
         'uWSGI==2.0.14',
     ],
     extras_require={
+        'async': ['gevent>=1.2.2'],
         'dev': ['pytest==3.2.2',
                 'pytest-flake8==0.8.1',
                 'pytest-cov==2.5.1',
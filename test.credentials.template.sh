@@ -3,7 +3,7 @@ export LOGLEVEL=DEBUG
 export SQRBOT_KEEPER_USERNAME=""
 export SQRBOT_KEEPER_PASSWORD=""
 # Credentials to embed in project
-export SQRBOT_LTD_KEEPER_USERNAME=""
+export SQRBOT_LTD_KEEPER_USER=""
 export SQRBOT_LTD_KEEPER_PASSWORD=""
 export SQRBOT_LTD_MASON_AWS_ID=""
 export SQRBOT_LTD_MASON_AWS_SECRET=""
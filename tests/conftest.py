@@ -0,0 +1,25 @@
+"""Fixtures shared by the tests.
+"""
+import uuid
+
+import pytest
+
+
+class FakeApp(object):
+    """Just enough of a Flask app for code that only reads ``app.config``.
+    """
+
+    def __init__(self, config):
+        self.config = config
+
+
+@pytest.fixture
+def fake_app():
+    """Make fake apps: ``fake_app(**config)`` has ``config`` as its
+    configuration, with a ``STORE_URL`` of its own unless given one.
+    """
+    def make(**config):
+        settings = {"STORE_URL": "memory://test-%s" % uuid.uuid4().hex}
+        settings.update(config)
+        return FakeApp(settings)
+    return make
@@ -0,0 +1,42 @@
+"""Test queue-depth admission control.
+"""
+import pytest
+
+from uservice_ccutter import admission
+
+
+CONFIG = {"ADMISSION_CONTROL": True,
+          "ADMISSION_MAX_QUEUE_DEPTH": 100,
+          "ADMISSION_MAX_QUEUE_PER_SLOT": 10,
+          "ADMISSION_JOB_SECONDS": 60}
+
+
+def _backlog(monkeypatch, depth, slots):
+    monkeypatch.setattr(admission, "queue_depth", lambda app: depth)
+    monkeypatch.setattr(admission, "worker_slots", lambda app: slots)
+
+
+def test_admits_under_thresholds(monkeypatch, fake_app):
+    _backlog(monkeypatch, 19, 2)
+    admission.check_admission(fake_app(**CONFIG))
+    # An unreachable broker is not our call to make.
+    _backlog(monkeypatch, None, None)
+    admission.check_admission(fake_app(**CONFIG))
+
+
+def test_refuses_with_retry_after(monkeypatch, fake_app):
+    """Two slots allow 20 queued jobs; at 25 we must drain 6 jobs, at two
+    jobs a minute.
+    """
+    _backlog(monkeypatch, 25, 2)
+    with pytest.raises(admission.AdmissionError) as excinfo:
+        admission.check_admission(fake_app(**CONFIG))
+    assert excinfo.value.status_code == 429
+    assert excinfo.value.retry_after == 180
+
+
+def test_absolute_depth_limit(monkeypatch, fake_app):
+    _backlog(monkeypatch, 100, 50)
+    with pytest.raises(admission.AdmissionError) as excinfo:
+        admission.check_admission(fake_app(**CONFIG))
+    assert excinfo.value.retry_after == 2
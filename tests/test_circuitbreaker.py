@@ -0,0 +1,108 @@
+"""Test the shared circuit breakers for upstream services.
+"""
+import time
+
+from apikit import BackendError
+import github3.exceptions
+import pytest
+import requests
+
+from uservice_ccutter import circuitbreaker
+from uservice_ccutter.circuitbreaker import CircuitOpenError, get_breaker
+from uservice_ccutter.deadlines import StageTimeout
+
+
+KEEPER = dict(error_rate=0.5, min_calls=4, window=60, open_seconds=1,
+              slow_call_seconds=0.2)
+
+
+def _call(breaker, exc=None, delay=0):
+    try:
+        with breaker.guard():
+            time.sleep(delay)
+            if exc is not None:
+                raise exc
+    except Exception as caught:
+        if caught is not exc:
+            raise
+
+
+def test_trips_on_error_rate_and_recovers(fake_app):
+    app = fake_app(CIRCUIT_BREAKERS={"keeper": KEEPER})
+    breaker = get_breaker(app, "keeper")
+    _call(breaker)
+    _call(breaker)
+    _call(breaker, requests.ConnectionError("down"))
+    assert breaker.state == circuitbreaker.CLOSED
+    _call(breaker, requests.ConnectionError("down"))
+    assert breaker.state == circuitbreaker.OPEN
+
+    # Open: nothing gets through, in this process or any other.
+    with pytest.raises(CircuitOpenError) as excinfo:
+        _call(get_breaker(app, "keeper"))
+    assert excinfo.value.upstream == "keeper"
+    assert excinfo.value.retry_after >= 1
+
+    # Half open: one probe at a time; a failed probe reopens.
+    time.sleep(1.1)
+    assert breaker.state == circuitbreaker.HALF_OPEN
+    breaker.check()
+    with pytest.raises(CircuitOpenError):
+        get_breaker(app, "keeper").check()
+    breaker.record(False)
+    assert breaker.state == circuitbreaker.OPEN
+
+    # A successful probe closes it.
+    time.sleep(1.1)
+    _call(breaker)
+    assert breaker.state == circuitbreaker.CLOSED
+    _call(breaker)
+
+
+def test_slow_calls_count_and_client_errors_do_not(fake_app):
+    app = fake_app(CIRCUIT_BREAKERS={"keeper": KEEPER})
+    breaker = get_breaker(app, "keeper")
+    for _ in range(3):
+        _call(breaker, BackendError(reason="Not Found", status_code=404))
+    assert breaker.state == circuitbreaker.CLOSED
+    _call(breaker, BackendError(reason="Bad Gateway", status_code=502))
+    _call(breaker, delay=0.3)
+    assert breaker.state == circuitbreaker.CLOSED
+    _call(breaker, delay=0.3)
+    assert breaker.state == circuitbreaker.OPEN
+
+
+def test_caller_mistakes_do_not_count(fake_app):
+    app = fake_app(CIRCUIT_BREAKERS={"keeper": KEEPER})
+    breaker = get_breaker(app, "keeper")
+    response = requests.Response()
+    response.status_code = 422
+    response._content = b'{"message": "name already exists"}'
+    for exc in (RuntimeError("Git push failed: not a fast-forward"),
+                github3.exceptions.UnprocessableEntity(response),
+                BackendError(reason="Not Found", status_code=404),
+                RuntimeError("tester is not in the lsst-sqre org")):
+        _call(breaker, exc)
+    assert breaker.state == circuitbreaker.CLOSED
+
+    # A failure wrapped up as the caller's still counts.
+    try:
+        raise requests.Timeout("no answer")
+    except requests.Timeout as timeout:
+        wrapped = RuntimeError("Git push failed")
+        wrapped.__cause__ = timeout
+    _call(breaker, wrapped)
+    _call(breaker, StageTimeout("push", 120))
+    assert breaker.state == circuitbreaker.CLOSED
+    _call(breaker, requests.ConnectionError("down"))
+    _call(breaker, requests.ConnectionError("down"))
+    assert breaker.state == circuitbreaker.OPEN
+
+
+def test_settings_overrides():
+    settings = circuitbreaker.load_breaker_settings(
+        '{"travis": {"slow_call_seconds": 90}}')
+    assert settings["travis"]["slow_call_seconds"] == 90
+    assert settings["travis"]["window"] == \
+        circuitbreaker.DEFAULT_SETTINGS["window"]
+    assert settings["github"] == circuitbreaker.DEFAULT_SETTINGS
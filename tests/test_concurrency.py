@@ -0,0 +1,89 @@
+"""Test that concurrent requests never see each other's credentials.
+"""
+from collections import OrderedDict
+import base64
+import json
+import threading
+import time
+import uuid
+
+from uservice_ccutter import celeryapp, createapp
+from uservice_ccutter.routes import createproject
+
+USERS = 16
+
+
+def _basic(username, password):
+    token = base64.b64encode(
+        ("%s:%s" % (username, password)).encode("utf-8")).decode("ascii")
+    return {"Authorization": "Basic " + token}
+
+
+def test_no_cross_request_credentials(monkeypatch):
+    monkeypatch.setenv("REDIS_URL", "memory://")
+    monkeypatch.setenv("CCUTTER_STORE_URL", "memory://test-concurrency")
+    monkeypatch.setenv("CCUTTER_FAIR_SCHEDULING", "0")
+    monkeypatch.setattr(createapp, "refresh_cache", lambda app: None)
+    monkeypatch.setattr(celeryapp.celery_app.control, "broadcast",
+                        lambda *args, **kwargs: None)
+    app = createapp.create_flask_app()
+
+    def slow_validation(app, username, token):
+        # Plenty of time for the other requests to authenticate.
+        time.sleep(0.05)
+        return None
+
+    stashed = {}
+
+    def stash(app, auth):
+        ref = "ref-" + uuid.uuid4().hex
+        stashed[ref] = dict(auth)
+        return ref
+
+    queued = {}
+
+    def apply_async(args, kwargs, task_id):
+        queued[task_id] = args[1]
+
+    monkeypatch.setattr(createproject, "validate_credentials",
+                        slow_validation)
+    monkeypatch.setattr(createproject, "get_single_project_type",
+                        lambda app, ptype: OrderedDict([("title", "")]))
+    monkeypatch.setattr(createproject, "target_org",
+                        lambda ptype, auth, values: None)
+    monkeypatch.setattr(createproject, "check_admission", lambda app: None)
+    monkeypatch.setattr(createproject, "stash_credentials", stash)
+    monkeypatch.setattr(createproject.create_project_as_task,
+                        "apply_async", apply_async)
+
+    jobs = {}
+    errors = []
+    start = threading.Barrier(USERS)
+
+    def submit(n):
+        # A thread's exceptions go nowhere, so keep them for the test.
+        try:
+            client = app.test_client()
+            start.wait()
+            resp = client.post("/ccutter/test-type/",
+                               data=json.dumps({"title": "T%d" % n}),
+                               content_type="application/json",
+                               headers=_basic("user%d" % n, "token%d" % n))
+            assert resp.status_code == 200, resp.data
+            jobs[n] = json.loads(resp.data.decode("utf-8"))["job_id"]
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=submit, args=(n,))
+               for n in range(USERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(jobs) == USERS
+    for n, job_id in jobs.items():
+        assert stashed[queued[job_id]] == {"username": "user%d" % n,
+                                           "password": "token%d" % n}
+    assert app.config["AUTH"]["data"]["password"] == ""
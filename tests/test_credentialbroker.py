@@ -0,0 +1,68 @@
+"""Test the worker-side credential broker.
+"""
+import threading
+import time
+
+from uservice_ccutter import credentialbroker
+from uservice_ccutter.credentialbroker import CredentialBroker, load_bundles
+
+BUNDLE = {"KEEPER_USERNAME": "k",
+          "KEEPER_PASSWORD": "kp",
+          "LTD_KEEPER_USER": "l",
+          "LTD_KEEPER_PASSWORD": "lp",
+          "LTD_MASON_AWS_ID": "a",
+          "LTD_MASON_AWS_SECRET": "as"}
+
+
+class FakeResponse(object):
+    status_code = 200
+
+    def __init__(self, token):
+        self.token = token
+
+    def json(self):
+        return {"token": self.token}
+
+
+def test_load_bundles():
+    """Complete bundles are loaded and incomplete ones reported.
+    """
+    environ = dict(("SQRBOT_" + key, value) for key, value in BUNDLE.items())
+    environ["OTHER_KEEPER_USERNAME"] = "x"
+    environ["PATH"] = "/bin"
+    bundles, problems = load_bundles(environ)
+    assert bundles == {"SQRBOT": BUNDLE}
+    assert len(problems) == 1
+    assert problems[0].startswith("Credentials for OTHER are incomplete")
+    assert "OTHER_LTD_KEEPER_USER" in problems[0]
+
+
+def test_keeper_token_cached_and_refreshed_ahead(monkeypatch):
+    """Tokens are reused until they near expiry, then refreshed in the
+    background while the old one is still handed out.
+    """
+    requested = []
+    refreshed = threading.Event()
+
+    def fake_get(url, auth=None):
+        requested.append((url, auth))
+        if len(requested) > 1:
+            refreshed.set()
+        return FakeResponse("token%d" % len(requested))
+
+    monkeypatch.setattr(credentialbroker.requests, "get", fake_get)
+    broker = CredentialBroker({"SQRBOT": BUNDLE}, "https://keeper.example/",
+                              token_ttl=3600, refresh_ahead=300)
+    assert broker.keeper_token("sqrbot") == "token1"
+    assert broker.keeper_token("sqrbot") == "token1"
+    assert requested == [("https://keeper.example/token", ("k", "kp"))]
+
+    token, expires = broker._tokens["SQRBOT"]
+    broker._tokens["SQRBOT"] = (token, expires - 3500)
+    assert broker.keeper_token("sqrbot") == "token1"
+    assert refreshed.wait(5)
+    for _ in range(50):
+        if broker._tokens["SQRBOT"][0] == "token2":
+            break
+        time.sleep(0.1)
+    assert broker.keeper_token("sqrbot") == "token2"
@@ -0,0 +1,47 @@
+"""Test edge validation of GitHub credentials.
+"""
+from apikit import BackendError
+import pytest
+
+from uservice_ccutter import credentialcheck
+
+
+CONFIG = {"AUTH_CACHE_TTL": 60,
+          "AUTH_NEGATIVE_CACHE_TTL": 60}
+
+
+def test_verdicts_are_cached(monkeypatch, fake_app):
+    """GitHub is asked once per set of credentials, valid or not.
+    """
+    calls = []
+
+    def fake_identity(username, token):
+        calls.append(username)
+        if token != "good":
+            raise BackendError(status_code=401, reason="Bad credentials",
+                               content="GitHub login failed.")
+        return {"login": username, "orgs": ["lsst-sqre"]}
+
+    monkeypatch.setattr(credentialcheck, "get_github_identity",
+                        fake_identity)
+    app = fake_app(**CONFIG)
+    for _ in range(3):
+        identity = credentialcheck.validate_credentials(app, "alice", "good")
+        assert identity["orgs"] == ["lsst-sqre"]
+    for _ in range(3):
+        with pytest.raises(BackendError) as excinfo:
+            credentialcheck.validate_credentials(app, "mallory", "bad")
+        assert excinfo.value.status_code == 401
+    assert calls == ["alice", "mallory"]
+
+
+def test_check_org_membership():
+    """Only members of the target org get through.
+    """
+    identity = {"login": "alice", "orgs": ["lsst-sqre"]}
+    credentialcheck.check_org_membership(identity, "LSST-SQRE")
+    credentialcheck.check_org_membership(identity, None)
+    credentialcheck.check_org_membership(None, "lsst-dm")
+    with pytest.raises(BackendError) as excinfo:
+        credentialcheck.check_org_membership(identity, "lsst-dm")
+    assert excinfo.value.status_code == 403
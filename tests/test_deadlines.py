@@ -0,0 +1,69 @@
+"""Tests for uservice_ccutter.deadlines."""
+
+import multiprocessing
+import os
+import tempfile
+import time
+
+import pytest
+
+from uservice_ccutter import deadlines
+from uservice_ccutter.deadlines import (StageTimeout, cleanup_on_hard_deadline,
+                                        deadline, load_deadlines,
+                                        longest_deadline)
+
+
+def test_load_deadlines_overrides():
+    limits = load_deadlines('{"push": [5, 10], "render": null}')
+    assert limits["push"] == (5, 10)
+    assert limits["render"] == (None, None)
+    assert limits["clone"] == deadlines.DEFAULT_DEADLINES["clone"]
+    assert longest_deadline(limits) is None
+    assert longest_deadline(load_deadlines()) == \
+        deadlines.DEFAULT_DEADLINES["finalize"][1]
+
+
+def test_soft_deadline_names_the_stage():
+    started = time.time()
+    with pytest.raises(StageTimeout) as excinfo:
+        with deadline("clone", soft=0.2, hard=5):
+            time.sleep(5)
+    assert excinfo.value.stage == "clone"
+    assert time.time() - started < 2
+    assert not deadlines._active
+
+
+def test_nested_deadlines():
+    # The inner stage finishes in time; the outer one still fires.
+    with pytest.raises(StageTimeout) as excinfo:
+        with deadline("finalize", soft=0.4):
+            with deadline("finalize:keeper", soft=5):
+                time.sleep(0.1)
+            time.sleep(5)
+    assert excinfo.value.stage == "finalize"
+    # And a stage within its deadline is left alone.
+    with deadline("push", soft=5, hard=10):
+        time.sleep(0.1)
+
+
+def _stuck_job(workdir):
+    with cleanup_on_hard_deadline(workdir):
+        with deadline("push", soft=0.1, hard=0.5):
+            while True:
+                try:
+                    time.sleep(5)
+                except Exception:
+                    # A job that swallows its soft deadline.
+                    pass
+
+
+def test_hard_deadline_exits_and_cleans_up():
+    workdir = tempfile.mkdtemp()
+    with open(os.path.join(workdir, "file"), "w") as fh:
+        fh.write("data")
+    job = multiprocessing.get_context("fork").Process(target=_stuck_job,
+                                                      args=(workdir,))
+    job.start()
+    job.join(10)
+    assert job.exitcode == 1
+    assert not os.path.exists(workdir)
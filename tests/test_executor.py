@@ -0,0 +1,103 @@
+"""Test running jobs in-process, with no broker or workers.
+"""
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+import base64
+import json
+import os
+import time
+
+from uservice_ccutter import celeryapp, createapp, executor, jobs
+from uservice_ccutter.routes import createproject as createproject_route
+from uservice_ccutter.tasks import createproject
+
+HEADERS = {"Authorization": "Basic " +
+           base64.b64encode(b"tester:token").decode("ascii")}
+
+
+def test_thread_executor_runs_the_job(monkeypatch):
+    monkeypatch.setenv("REDIS_URL", "memory://")
+    monkeypatch.setenv("CCUTTER_STORE_URL", "memory://test-executor")
+    monkeypatch.setenv("CCUTTER_EXECUTOR", "thread")
+    monkeypatch.setenv("CCUTTER_AUTH_PRECHECK", "0")
+    monkeypatch.setattr(createapp, "refresh_cache", lambda app: None)
+    monkeypatch.setattr(celeryapp.celery_app.control, "broadcast",
+                        lambda *args, **kwargs: None)
+    monkeypatch.setattr(createproject_route, "get_single_project_type",
+                        lambda app, ptype: OrderedDict([("title", "")]))
+    monkeypatch.setattr(createproject_route, "target_org",
+                        lambda ptype, auth, values: None)
+    ran = []
+
+    def build_project(project_type, auth, values, workdir, done):
+        ran.append((project_type, auth["username"], values["title"]))
+        values["github_repo_url"] = "https://github.com/lsst/test.git"
+        return workdir
+
+    monkeypatch.setattr(createproject, "substitute",
+                        lambda project_type, auth, values: None)
+    monkeypatch.setattr(createproject, "_build_project", build_project)
+    monkeypatch.setattr(createproject, "finalize",
+                        lambda project_type, auth, values: None)
+    monkeypatch.setattr(executor, "_pools", {})
+
+    app = createapp.create_flask_app()
+    client = app.test_client()
+    resp = client.post("/ccutter/lsst-technote-bootstrap/",
+                       data=json.dumps({"title": "Test"}),
+                       content_type="application/json", headers=HEADERS)
+    assert resp.status_code == 200
+    job_id = json.loads(resp.data.decode("utf-8"))["job_id"]
+
+    for _ in range(100):
+        resp = client.get("/ccutter/jobs/%s/" % job_id, headers=HEADERS)
+        job = json.loads(resp.data.decode("utf-8"))
+        if job["status"] in ("done", "failed"):
+            break
+        time.sleep(0.05)
+    assert job["status"] == "done", job["error"]
+    assert job["github_repo_url"] == "https://github.com/lsst/test.git"
+    assert ran == [("lsst-technote-bootstrap", "tester", "Test")]
+    assert executor.queued_count(app) == 0
+
+
+def test_lost_task_fails_its_job(monkeypatch, fake_app):
+    app = fake_app(JOB_RETENTION=60)
+    jobs.create_job(app, "job-1", "lsst-technote-bootstrap", "tester",
+                    OrderedDict([("title", "Test")]))
+
+    def lost(*args):
+        raise BrokenProcessPool("A process in the pool was terminated")
+
+    monkeypatch.setattr(executor, "_run_task", lost)
+    pool = executor._Pool("thread", 1)
+    pool.submit(app, "create_project_as_task", (), None, "job-1", {})
+    pool._executor.shutdown(wait=True)
+    job = jobs.get_job(app, "job-1")
+    assert job["status"] == "failed"
+    assert "terminated" in job["error"]
+
+
+@celeryapp.celery_app.task
+def _record_worker(path):
+    """Write down where it ran, for test_process_pool_runs_the_task.
+    """
+    with open(path, "w") as fh:
+        json.dump({"pid": os.getpid(),
+                   "ready": executor._process_ready[0]}, fh)
+
+
+def test_process_pool_runs_the_task(monkeypatch, tmpdir):
+    monkeypatch.setenv("REDIS_URL", "memory://")
+    monkeypatch.setenv("CCUTTER_STORE_URL", "memory://test-process")
+    monkeypatch.setenv("CCUTTER_RESULT_BACKEND", "cache+memory://")
+    monkeypatch.setenv("CCUTTER_CREDENTIAL_STRICT", "0")
+    path = str(tmpdir.join("ran.json"))
+    pool = executor._Pool("process", 1)
+    pool.submit(None, _record_worker.name, (path,), None, None, {})
+    pool._executor.shutdown(wait=True)
+    with open(path) as fh:
+        ran = json.load(fh)
+    assert ran["pid"] != os.getpid()
+    # Set up as a worker first.
+    assert ran["ready"]
@@ -0,0 +1,68 @@
+"""Test fair scheduling of jobs across users.
+"""
+import pytest
+
+from uservice_ccutter import brokerstatus, fairqueue
+from uservice_ccutter.admission import AdmissionError
+
+
+CONFIG = {"FAIR_MAX_RUNNING_PER_USER": 2,
+          "FAIR_MAX_QUEUED_PER_USER": 20,
+          "FAIR_LEASE_SECONDS": 60,
+          "ADMISSION_JOB_SECONDS": 60}
+
+
+def _submit(app, user, count):
+    for n in range(count):
+        fairqueue.enqueue_job(app, user, {"job_id": "%s-%d" % (user, n)})
+
+
+def test_round_robin_with_running_cap(fake_app):
+    """A burst from one user does not hold back another user's job.
+    """
+    app = fake_app(**CONFIG)
+    _submit(app, "Burst", 5)
+    _submit(app, "other", 1)
+
+    picked = [fairqueue.next_job(app) for _ in range(3)]
+    assert [job["job_id"] for _, job in picked] == \
+        ["Burst-0", "other-0", "Burst-1"]
+    # Burst is at their cap of two running jobs.
+    assert fairqueue.running_count(app, "burst") == 2
+    assert fairqueue.next_job(app) is None
+    assert fairqueue.queued_count(app) == 3
+
+    fairqueue.finish_job(app, "Burst", "Burst-0")
+    user, job = fairqueue.next_job(app)
+    assert (user, job["job_id"]) == ("burst", "Burst-2")
+
+
+def test_expired_leases_free_the_slot(fake_app):
+    app = fake_app(**dict(CONFIG, FAIR_LEASE_SECONDS=-1,
+                          FAIR_MAX_RUNNING_PER_USER=1))
+    _submit(app, "user", 2)
+    fairqueue.next_job(app)
+    # The first job's worker died without finishing it.
+    assert fairqueue.next_job(app)[1]["job_id"] == "user-1"
+
+
+def test_queued_cap(fake_app):
+    app = fake_app(**dict(CONFIG, FAIR_MAX_QUEUED_PER_USER=3))
+    _submit(app, "user", 3)
+    fairqueue.check_user_quota(app, "other")
+    with pytest.raises(AdmissionError) as excinfo:
+        fairqueue.check_user_quota(app, "User")
+    assert excinfo.value.status_code == 429
+    assert excinfo.value.retry_after == 30
+
+
+def test_queue_depth_is_the_fair_queue(monkeypatch, fake_app):
+    """The broker only holds dispatch tokens; admission control and the
+    readiness probe count the jobs waiting in the users' queues.
+    """
+    monkeypatch.setattr(brokerstatus, "_cache", {})
+    app = fake_app(**dict(CONFIG, FAIR_SCHEDULING=True,
+                          BROKER_STATUS_CACHE_SECONDS=0))
+    _submit(app, "Burst", 5)
+    _submit(app, "other", 1)
+    assert brokerstatus.queue_depth(app) == 6
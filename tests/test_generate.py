@@ -0,0 +1,177 @@
+"""Test generating a project from a template repository, against a local
+fake of the GitHub API.
+"""
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import base64
+import json
+import os
+import threading
+import uuid
+
+import pytest
+
+from uservice_ccutter.generate import (blob_sha, can_generate, commit_project,
+                                       generate_repository)
+
+AUTH = {"username": "tester", "password": "token"}
+
+
+class FakeGitHub(object):
+    """Just enough of the repository and Git Data APIs.
+    """
+
+    def __init__(self):
+        self.repos = {}
+        self.blobs = {}
+        self.trees = {}
+        self.commits = {}
+        self.uploads = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def do_PATCH(self):
+                self._dispatch("PATCH")
+
+            def _dispatch(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"null")
+                status, reply = fake.handle(method, self.path.split("?")[0],
+                                            body)
+                data = json.dumps(reply).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def add_repo(self, full_name, files, is_template=False):
+        tree = []
+        for path, content in files.items():
+            self.blobs[blob_sha(content)] = content
+            tree.append({"path": path, "type": "blob", "mode": "100644",
+                         "sha": blob_sha(content)})
+        name = full_name.replace("/", "-")
+        self.trees["t-" + name] = tree
+        self.commits["c-" + name] = {"tree": "t-" + name, "parents": []}
+        self.repos[full_name] = {"head": "c-" + name,
+                                 "is_template": is_template}
+
+    def handle(self, method, path, body):
+        parts = path.strip("/").split("/")
+        full_name = "/".join(parts[1:3])
+        repo = self.repos.get(full_name)
+        if repo is None:
+            return 404, {"message": "Not Found"}
+        rest = parts[3:]
+        if method == "POST" and rest == ["generate"]:
+            if not repo["is_template"]:
+                return 422, {"message": "Not a template repository"}
+            new_name = body["owner"] + "/" + body["name"]
+            self.repos[new_name] = {"head": repo["head"],
+                                    "is_template": False}
+            return 201, {"full_name": new_name, "default_branch": "main",
+                         "clone_url": "https://github.com/%s.git" % new_name}
+        if rest == ["git", "ref", "heads", "main"]:
+            return 200, {"object": {"sha": repo["head"]}}
+        if method == "GET" and rest[:2] == ["git", "commits"]:
+            return 200, {"tree": {"sha": self.commits[rest[2]]["tree"]}}
+        if method == "GET" and rest[:2] == ["git", "trees"]:
+            return 200, {"tree": self.trees[rest[2]]}
+        if method == "POST" and rest == ["git", "blobs"]:
+            content = base64.b64decode(body["content"])
+            self.blobs[blob_sha(content)] = content
+            self.uploads.append(content)
+            return 201, {"sha": blob_sha(content)}
+        if method == "POST" and rest == ["git", "trees"]:
+            sha = uuid.uuid4().hex
+            self.trees[sha] = body["tree"]
+            return 201, {"sha": sha}
+        if method == "POST" and rest == ["git", "commits"]:
+            sha = uuid.uuid4().hex
+            self.commits[sha] = body
+            return 201, {"sha": sha}
+        if method == "PATCH" and rest == ["git", "refs", "heads", "main"]:
+            repo["head"] = body["sha"]
+            return 200, {"object": {"sha": body["sha"]}}
+        return 404, {"message": "Not Found"}
+
+
+TEMPLATE_FILES = OrderedDict([
+    ("cookiecutter.json", b'{"name": "demo"}\n'),
+    ("{{cookiecutter.name}}/README.md", b"# {{ cookiecutter.name }}\n"),
+    ("{{cookiecutter.name}}/LICENSE", b"MIT\n"),
+    ("{{cookiecutter.name}}/run.sh", b"#!/bin/sh\n"),
+])
+
+
+@pytest.fixture
+def template_dir(tmpdir):
+    for path, content in TEMPLATE_FILES.items():
+        full = os.path.join(str(tmpdir), path)
+        if not os.path.isdir(os.path.dirname(full)):
+            os.makedirs(os.path.dirname(full))
+        with open(full, "wb") as fh:
+            fh.write(content)
+    os.chmod(os.path.join(str(tmpdir), "{{cookiecutter.name}}", "run.sh"),
+             0o755)
+    return str(tmpdir)
+
+
+def test_generate_and_commit(template_dir, fake_app):
+    github = FakeGitHub()
+    github.add_repo("lsst-sqre/demo-template", TEMPLATE_FILES,
+                    is_template=True)
+    app = fake_app(GITHUB_API_URL=github.url)
+    values = OrderedDict([("name", "svc"),
+                          ("github_repo", "lsst-sqre/svc"),
+                          ("github_name", "Tester"),
+                          ("github_email", "tester@example.com")])
+
+    assert can_generate(template_dir)
+    url, branch = generate_repository(
+        app, AUTH, "https://github.com/lsst-sqre/demo-template", values)
+    assert url == "https://github.com/lsst-sqre/svc.git"
+    assert branch == "main"
+
+    # Only the README changes when rendered.
+    assert commit_project(app, AUTH, template_dir, values,
+                          branch=branch) == 1
+    assert github.uploads == [b"# svc\n"]
+    commit = github.commits[github.repos["lsst-sqre/svc"]["head"]]
+    assert commit["parents"] == ["c-lsst-sqre-demo-template"]
+    assert commit["author"]["name"] == "Tester"
+    tree = {entry["path"]: entry for entry in github.trees[commit["tree"]]}
+    assert sorted(tree) == ["LICENSE", "README.md", "run.sh"]
+    assert tree["run.sh"]["mode"] == "100755"
+    assert tree["LICENSE"]["sha"] == blob_sha(b"MIT\n")
+    # The template itself is untouched.
+    assert github.repos["lsst-sqre/demo-template"]["head"] == \
+        "c-lsst-sqre-demo-template"
+
+
+def test_not_a_template(template_dir, fake_app):
+    github = FakeGitHub()
+    github.add_repo("lsst-sqre/demo-template", TEMPLATE_FILES)
+    with pytest.raises(Exception) as excinfo:
+        generate_repository(fake_app(GITHUB_API_URL=github.url), AUTH,
+                            "https://github.com/lsst-sqre/demo-template",
+                            {"github_repo": "lsst-sqre/svc"})
+    assert excinfo.value.status_code == 422
+    os.mkdir(os.path.join(template_dir, "hooks"))
+    assert not can_generate(template_dir)
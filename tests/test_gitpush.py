@@ -0,0 +1,69 @@
+"""Test pushing with the in-process git client.
+"""
+import os
+
+from dulwich.repo import Repo
+import git
+import pytest
+
+from uservice_ccutter.gitpush import clone, push
+
+
+def _commit(repo, filename, message):
+    with open(os.path.join(repo.working_dir, filename), "w") as fh:
+        fh.write(message)
+    repo.index.add([filename])
+    committer = git.Actor("Tester", "tester@example.com")
+    return repo.index.commit(message, author=committer, committer=committer)
+
+
+def test_push(tmpdir):
+    """Pushes create the branch, then fast-forward it; rewinds are refused.
+    """
+    local = git.Repo.init(str(tmpdir.join("local")))
+    first = _commit(local, "README.md", "Initial commit.")
+    remote_dir = str(tmpdir.join("remote.git"))
+    Repo.init_bare(remote_dir, mkdir=True)
+    remote_url = "file://" + remote_dir
+
+    push(local.working_dir, remote_url)
+    assert Repo(remote_dir).refs[b"refs/heads/master"] == \
+        first.hexsha.encode("ascii")
+
+    second = _commit(local, ".travis.yml", "Added Travis CI configuration.")
+    push(local.working_dir, remote_url)
+    assert Repo(remote_dir).refs[b"refs/heads/master"] == \
+        second.hexsha.encode("ascii")
+
+    local.head.reset(first, index=True, working_tree=True)
+    _commit(local, "other.txt", "Diverged.")
+    with pytest.raises(RuntimeError):
+        push(local.working_dir, remote_url)
+    assert Repo(remote_dir).refs[b"refs/heads/master"] == \
+        second.hexsha.encode("ascii")
+
+
+def test_clone_then_push(tmpdir):
+    """A clone has the branch checked out, and can be pushed from.
+    """
+    origin = git.Repo.init(str(tmpdir.join("origin")))
+    _commit(origin, "README.md", "Initial commit.")
+    remote_dir = str(tmpdir.join("remote.git"))
+    Repo.init_bare(remote_dir, mkdir=True)
+    remote_url = "file://" + remote_dir
+    push(origin.working_dir, remote_url)
+
+    clone_dir = str(tmpdir.join("clone"))
+    clone(remote_url, clone_dir)
+    with open(os.path.join(clone_dir, "README.md")) as fh:
+        assert fh.read() == "Initial commit."
+    cloned = git.Repo(clone_dir)
+    assert cloned.active_branch.name == "master"
+    assert not cloned.is_dirty()
+    third = _commit(cloned, ".travis.yml", "Added Travis CI configuration.")
+    push(clone_dir, remote_url)
+    assert Repo(remote_dir).refs[b"refs/heads/master"] == \
+        third.hexsha.encode("ascii")
+
+    with pytest.raises(RuntimeError):
+        clone(remote_url, str(tmpdir.join("other")), branch="gh-pages")
@@ -0,0 +1,53 @@
+"""Test that importing the package is cheap and has no side effects.
+"""
+import json
+import os
+import subprocess
+import sys
+
+# Seconds allowed for a cold import of the worker entry point, which builds
+#  the worker app and loads every plugin.  Wall-clock time on a shared
+#  machine says little, so this is only checked when set.
+WORKER_IMPORT_BUDGET = os.getenv("CCUTTER_TEST_IMPORT_BUDGET")
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(code):
+    env = dict(os.environ,
+               REDIS_URL="memory://",
+               CCUTTER_STORE_URL="memory://",
+               # Any attempt to fetch a template would fail.
+               CCUTTER_TEMPLATE_RAW_BASE_URL="http://127.0.0.1:1")
+    output = subprocess.check_output([sys.executable, "-c", code], env=env,
+                                     cwd=REPO_DIR)
+    return json.loads(output.decode("utf-8").splitlines()[-1])
+
+
+def test_package_import_has_no_side_effects():
+    """Importing the package builds no app and loads no framework.
+    """
+    result = _run("import json, sys\n"
+                  "import uservice_ccutter\n"
+                  "print(json.dumps({'attrs': dir(uservice_ccutter),\n"
+                  "                  'modules': list(sys.modules)}))")
+    assert "flask_app" not in result["attrs"]
+    for module in ("flask", "celery", "uservice_ccutter.createapp"):
+        assert module not in result["modules"]
+
+
+def test_worker_import():
+    """The worker entry point loads plugins but no routes, fetches nothing,
+    and (if ``$CCUTTER_TEST_IMPORT_BUDGET`` is set) is quick.
+    """
+    result = _run("import json, sys, time\n"
+                  "started = time.perf_counter()\n"
+                  "import uservice_ccutter.worker\n"
+                  "elapsed = time.perf_counter() - started\n"
+                  "print(json.dumps({'elapsed': elapsed,\n"
+                  "                  'modules': list(sys.modules)}))")
+    assert "uservice_ccutter.routes" not in result["modules"]
+    assert "uservice_ccutter.plugins.projecttypes.uservice_bootstrap" in \
+        result["modules"]
+    if WORKER_IMPORT_BUDGET:
+        assert result["elapsed"] < float(WORKER_IMPORT_BUDGET)
@@ -0,0 +1,167 @@
+"""Test job checkpoints and resuming a job where it stopped.
+"""
+from collections import OrderedDict
+
+import pytest
+
+from uservice_ccutter import jobs
+from uservice_ccutter.circuitbreaker import CircuitOpenError
+from uservice_ccutter.createapp import create_worker_app
+from uservice_ccutter.tasks import createproject
+
+AUTH = {"username": "tester", "password": "token"}
+
+
+class FakeTask(object):
+    def __init__(self):
+        self.queued = []
+
+    def apply_async(self, args, **kwargs):
+        self.queued.append((args, kwargs))
+
+
+def _pipeline(monkeypatch, calls, finalize_results):
+    """Replace the stages that talk to the world with ones that record what
+    ran.
+    """
+    def substitute(project_type, auth, values):
+        calls.append("substitute")
+        values["serial_number"] = "042"
+
+    def build_project(project_type, auth, values, workdir, done):
+        calls.append("build")
+        values["github_repo_url"] = "https://github.com/lsst/test-042.git"
+        jobs.checkpoint("create_repo", values)
+        jobs.checkpoint("push", values)
+        return workdir
+
+    def clone(url, project_dir, username, password):
+        calls.append("clone " + url)
+
+    def finalize(project_type, auth, values):
+        calls.append("finalize")
+        result = finalize_results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(createproject, "substitute", substitute)
+    monkeypatch.setattr(createproject, "_build_project", build_project)
+    monkeypatch.setattr(createproject, "clone", clone)
+    monkeypatch.setattr(createproject, "finalize", finalize)
+
+
+def test_resume_runs_only_incomplete_stages(monkeypatch):
+    monkeypatch.setenv("REDIS_URL", "memory://")
+    monkeypatch.setenv("CCUTTER_STORE_URL", "memory://test-jobs")
+    monkeypatch.setenv("CCUTTER_CREDENTIAL_STRICT", "0")
+    app = create_worker_app()
+    resume_task = FakeTask()
+    monkeypatch.setattr(createproject, "resume_project_as_task", resume_task)
+    calls = []
+    _pipeline(monkeypatch, calls,
+              [CircuitOpenError("keeper", 30), "Keeper said no", None])
+
+    with app.app_context():
+        jobs.create_job(app, "job-1", "lsst-technote-bootstrap", "tester",
+                        OrderedDict([("title", "Test")]))
+
+        # Keeper is down: the job is deferred after pushing.
+        createproject._run_job("job-1", "lsst-technote-bootstrap", AUTH,
+                               jobs.get_job(app, "job-1")["values"])
+        job = jobs.get_job(app, "job-1")
+        assert calls == ["substitute", "build", "finalize"]
+        assert job["status"] == "deferred"
+        assert job["stages"] == ["substitute", "create_repo", "push"]
+        assert job["values"]["serial_number"] == "042"
+        (args, kwargs), = resume_task.queued
+        assert args[0] == "job-1"
+        assert kwargs["countdown"] == 30
+
+        # The deferred run clones the pushed repository instead of
+        #  rebuilding it, and this time finalization fails.
+        del calls[:]
+        createproject._run_job("job-1", job["project_type"], AUTH,
+                               job["values"], job["stages"])
+        job = jobs.get_job(app, "job-1")
+        assert calls == ["clone https://github.com/lsst/test-042.git",
+                         "finalize"]
+        assert job["status"] == "incomplete"
+        assert job["error"] == "Keeper said no"
+
+        # Only a resumable job can be claimed, and only once.
+        assert jobs.claim_for_resume(app, "job-1")["status"] == "queued"
+        assert jobs.claim_for_resume(app, "job-1") is None
+        del calls[:]
+        createproject._run_job("job-1", job["project_type"], AUTH,
+                               job["values"], job["stages"])
+        job = jobs.get_job(app, "job-1")
+        assert calls == ["clone https://github.com/lsst/test-042.git",
+                         "finalize"]
+        assert job["status"] == "done"
+        assert job["stages"][-1] == "finalize"
+
+
+def test_expired_credentials_fail_the_job(monkeypatch):
+    monkeypatch.setenv("REDIS_URL", "memory://")
+    monkeypatch.setenv("CCUTTER_STORE_URL", "memory://test-jobs-expired")
+    monkeypatch.setenv("CCUTTER_CREDENTIAL_STRICT", "0")
+    app = create_worker_app()
+    with app.app_context():
+        jobs.create_job(app, "job-2", "lsst-technote-bootstrap", "tester",
+                        OrderedDict([("title", "Test")]))
+        with pytest.raises(RuntimeError):
+            createproject._start_job("job-2", "lsst-technote-bootstrap",
+                                     "no-such-ref", b"", None)
+        job = jobs.get_job(app, "job-2")
+        assert job["status"] == "failed"
+        assert "expired" in job["error"]
+
+
+def test_stale_running_job_can_be_resumed(monkeypatch):
+    monkeypatch.setenv("REDIS_URL", "memory://")
+    monkeypatch.setenv("CCUTTER_STORE_URL", "memory://test-jobs-stale")
+    monkeypatch.setenv("CCUTTER_JOB_STALE_SECONDS", "60")
+    app = create_worker_app()
+    now = [1000.0]
+    monkeypatch.setattr(jobs.time, "time", lambda: now[0])
+    with app.app_context():
+        jobs.create_job(app, "job-3", "lsst-technote-bootstrap", "tester",
+                        OrderedDict([("title", "Test")]))
+        jobs.update_job(app, "job-3", status="running")
+        assert jobs.claim_for_resume(app, "job-3") is None
+        now[0] += 61
+        assert jobs.claim_for_resume(app, "job-3")["status"] == "queued"
+
+
+def test_long_stage_is_not_stale(monkeypatch):
+    """A job still within its longest stage deadline cannot be resumed.
+    """
+    monkeypatch.setenv("REDIS_URL", "memory://")
+    monkeypatch.setenv("CCUTTER_STORE_URL", "memory://test-jobs-long")
+    app = create_worker_app()
+    now = [1000.0]
+    monkeypatch.setattr(jobs.time, "time", lambda: now[0])
+    with app.app_context():
+        jobs.create_job(app, "job-4", "lsst-technote-bootstrap", "tester",
+                        OrderedDict([("title", "Test")]))
+        jobs.update_job(app, "job-4", status="running")
+        now[0] += app.config["STAGE_DEADLINES"]["finalize"][1]
+        assert jobs.claim_for_resume(app, "job-4") is None
+
+
+def test_expired_credentials_fail_the_resume(monkeypatch):
+    monkeypatch.setenv("REDIS_URL", "memory://")
+    monkeypatch.setenv("CCUTTER_STORE_URL", "memory://test-jobs-resume")
+    monkeypatch.setenv("CCUTTER_CREDENTIAL_STRICT", "0")
+    app = create_worker_app()
+    with app.app_context():
+        jobs.create_job(app, "job-5", "lsst-technote-bootstrap", "tester",
+                        OrderedDict([("title", "Test")]))
+        jobs.update_job(app, "job-5", status="failed")
+        assert jobs.claim_for_resume(app, "job-5")["status"] == "queued"
+        with pytest.raises(RuntimeError):
+            createproject.resume_project_as_task.run("job-5", "no-such-ref")
+        assert jobs.get_job(app, "job-5")["status"] == "failed"
+        # And so it can be resumed again.
+        assert jobs.claim_for_resume(app, "job-5") is not None
@@ -0,0 +1,24 @@
+"""Test the broker payload encoding of template values.
+"""
+from collections import OrderedDict
+
+from uservice_ccutter.payload import decode_values, encode_values
+
+VALUES = OrderedDict([
+    ("series", "SQR"),
+    ("title", "Document Title"),
+    ("github_org", ["lsst-sqre", "lsst-dm"]),
+    ("_copy_without_render", ["*.bib"]),
+    ("description", "A short description of this document " * 40)])
+
+
+def test_round_trip_keeps_order():
+    """Values come back equal and in the same order, compressed or not.
+    """
+    plain = encode_values(VALUES)
+    compressed = encode_values(VALUES, compress_threshold=256)
+    assert len(compressed) < len(plain)
+    for payload in (plain, compressed):
+        decoded = decode_values(payload)
+        assert list(decoded.keys()) == list(VALUES.keys())
+        assert decoded == VALUES
@@ -0,0 +1,29 @@
+"""Test profiling report capture and retention.
+"""
+import time
+
+from uservice_ccutter.profiling import get_report, list_reports, profiled
+
+
+CONFIG = {"PROFILE_SAMPLE_RATE": 0.0,
+          "PROFILE_MAX_REPORTS": 2,
+          "PROFILE_RETENTION": 60}
+
+
+def test_profiled_reports_and_retention(fake_app):
+    """Reports are stored under their ID, and only the newest are kept.
+    """
+    app = fake_app(**CONFIG)
+    with profiled(app, "job", "nothing", False) as profile:
+        assert profile is None
+    for report_id in ("first", "second", "third"):
+        with profiled(app, "job", "sleep", True, report_id=report_id):
+            time.sleep(0.01)
+    assert [r["id"] for r in list_reports(app)] == ["third", "second"]
+    # The report dropped from the list is gone too.
+    assert get_report(app, "first") is None
+    report = get_report(app, "third")
+    assert report["wall_seconds"] >= 0.01
+    assert "sleep" in report["stats"]
+    assert set(report["areas"]) == {"git", "cookiecutter", "plugins",
+                                    "github"}
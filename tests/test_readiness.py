@@ -0,0 +1,62 @@
+"""Test the readiness report.
+"""
+import time
+
+from uservice_ccutter import readiness
+
+
+CONFIG = {"READINESS_CACHE_SECONDS": 60,
+          "ADMISSION_JOB_SECONDS": 60,
+          "TEMPLATE_REGISTRY": {
+              "preloaded": {"preload": True, "ttl": 100},
+              "lazy": {"preload": False, "ttl": 100}}}
+
+
+def _broker(monkeypatch, depth, workers):
+    monkeypatch.setattr(readiness, "queue_depth", lambda app: depth)
+    monkeypatch.setattr(readiness, "live_workers",
+                        lambda app: None if workers is None else
+                        len(workers))
+    monkeypatch.setattr(readiness, "worker_slots",
+                        lambda app: None if workers is None else
+                        sum(workers))
+    readiness._cache.clear()
+
+
+def test_ready_with_stale_template(monkeypatch, fake_app):
+    app = fake_app(PROJECTTYPE={}, **CONFIG)
+    _broker(monkeypatch, 6, [2, 1])
+    report = readiness.check_readiness(app)
+    assert not report["ready"]
+    assert report["checks"]["templates"]["missing"] == ["preloaded"]
+
+    # A failed refresh still leaves a template to serve.
+    app.config["PROJECTTYPE"]["preloaded"] = {
+        "template": {}, "fetched": time.time() - 200,
+        "last_error": "502 Bad Gateway"}
+    _broker(monkeypatch, 6, [2, 1])
+    report = readiness.check_readiness(app)
+    assert report["ready"]
+    templates = report["checks"]["templates"]["types"]
+    assert templates["preloaded"]["stale"]
+    assert templates["preloaded"]["last_error"] == "502 Bad Gateway"
+    assert report["checks"]["broker"]["estimated_wait_seconds"] == 120
+    assert report["checks"]["workers"]["live"] == 2
+
+
+def test_not_ready_without_broker_or_workers(monkeypatch, fake_app):
+    app = fake_app(PROJECTTYPE={}, **CONFIG)
+    app.config["PROJECTTYPE"]["preloaded"] = {"template": {},
+                                              "fetched": time.time()}
+    _broker(monkeypatch, None, None)
+    report = readiness.check_readiness(app)
+    assert not report["ready"]
+    assert not report["checks"]["broker"]["ok"]
+
+    _broker(monkeypatch, 0, [])
+    report = readiness.check_readiness(app)
+    assert report["checks"]["broker"]["ok"]
+    assert not report["checks"]["workers"]["ok"]
+    # The report is cached.
+    monkeypatch.setattr(readiness, "live_workers", lambda app: 4)
+    assert readiness.check_readiness(app) is report
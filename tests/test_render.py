@@ -0,0 +1,48 @@
+"""Test in-memory template rendering.
+"""
+from collections import OrderedDict
+import os
+
+from uservice_ccutter.render import render_template
+
+
+def _write(path, content):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as fh:
+        fh.write(content)
+
+
+def _make_template(tmpdir):
+    repo_dir = str(tmpdir)
+    template_dir = os.path.join(repo_dir, "{{cookiecutter.repo_name}}")
+    _write(os.path.join(repo_dir, "cookiecutter.json"), "{}")
+    _write(os.path.join(template_dir, "README.rst"),
+           "{{ cookiecutter.title }}\n")
+    _write(os.path.join(template_dir, "{{cookiecutter.series}}.txt"),
+           "Series {{ cookiecutter.series }}\n")
+    _write(os.path.join(template_dir, "refs.bib"), "{{ not rendered }}\n")
+    return repo_dir
+
+
+def test_render_template(tmpdir):
+    """Rendered paths and contents match what cookiecutter would write.
+    """
+    repo_dir = _make_template(tmpdir)
+    values = OrderedDict([
+        ("series", "SQR"),
+        ("serial_number", "000"),
+        ("title", "Document Title"),
+        ("repo_name", "{{ cookiecutter.series.lower() }}-"
+                      "{{ cookiecutter.serial_number }}"),
+        ("_copy_without_render", ["*.bib"])])
+    files = {rfile.path: rfile.content
+             for rfile in render_template(repo_dir, values)}
+    assert files == {
+        "sqr-000/README.rst": b"Document Title\n",
+        "sqr-000/SQR.txt": b"Series SQR\n",
+        "sqr-000/refs.bib": b"{{ not rendered }}\n",
+    }
+    # Rendering doesn't touch the template checkout.
+    assert sorted(os.listdir(repo_dir)) == ["cookiecutter.json",
+                                            "{{cookiecutter.repo_name}}"]
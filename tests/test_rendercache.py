@@ -0,0 +1,125 @@
+"""Test caching rendered projects.
+"""
+from collections import OrderedDict
+import os
+
+import git
+
+from uservice_ccutter import rendercache
+from uservice_ccutter.tasks.createproject import (clone_template_repo,
+                                                  replace_cookiecutter_json,
+                                                  run_cookiecutter)
+
+
+def _write(path, content):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as fh:
+        fh.write(content)
+
+
+def _make_template(tmpdir):
+    repo_dir = str(tmpdir.join("template"))
+    template_dir = os.path.join(repo_dir, "{{cookiecutter.repo_name}}")
+    _write(os.path.join(repo_dir, "cookiecutter.json"), "{}")
+    _write(os.path.join(template_dir, "README.rst"),
+           "{{ cookiecutter.title }}\n")
+    _write(os.path.join(template_dir, "docs", "{{cookiecutter.series}}.txt"),
+           "Series {{ cookiecutter.series }}\n")
+    repo = git.Repo.init(repo_dir)
+    repo.index.add(["cookiecutter.json",
+                    "{{cookiecutter.repo_name}}/README.rst",
+                    "{{cookiecutter.repo_name}}/docs/"
+                    "{{cookiecutter.series}}.txt"])
+    actor = git.Actor("Tester", "tester@example.com")
+    repo.index.commit("Template", author=actor, committer=actor)
+    return repo_dir
+
+
+def _values(title="Document Title"):
+    return OrderedDict([("series", "SQR"),
+                        ("title", title),
+                        ("repo_name", "sqr-000")])
+
+
+def test_render_cached(monkeypatch, tmpdir, fake_app):
+    rendercache._cache.clear()
+    rendercache._cache_size[0] = 0
+    app = fake_app(RENDER_CACHE_BYTES=1024 * 1024)
+    repo_dir = _make_template(tmpdir)
+    first = list(rendercache.render_cached(app, repo_dir, _values()))
+    assert len(first) == 2
+
+    def no_render(*args):
+        raise AssertionError("rendered again")
+
+    monkeypatch.setattr(rendercache, "render_template", no_render)
+    # Values set after rendering don't matter.
+    values = _values()
+    values["github_repo_url"] = "https://github.com/lsst-sqre/sqr-000.git"
+    assert list(rendercache.render_cached(app, repo_dir, values)) == first
+
+    # A new commit is a new template.
+    _write(os.path.join(repo_dir, "cookiecutter.json"), '{"x": 1}')
+    repo = git.Repo(repo_dir)
+    repo.index.add(["cookiecutter.json"])
+    actor = git.Actor("Tester", "tester@example.com")
+    repo.index.commit("Change", author=actor, committer=actor)
+    assert rendercache.get_render(
+        app, rendercache.render_key(repo_dir, _values())) is None
+
+
+def test_cookiecutter_build_matches(tmpdir):
+    """A build cached from disk is what rendering in memory produces.
+    """
+    repo_dir = _make_template(tmpdir)
+    clone_dir = str(tmpdir.join("clone"))
+    clone_template_repo(repo_dir, clone_dir)
+    replace_cookiecutter_json(clone_dir, _values())
+    project_dir = run_cookiecutter(clone_dir, str(tmpdir.join("build")))
+    built = rendercache.read_project(project_dir)
+    rendered = list(rendercache.render_template(repo_dir, _values()))
+    assert sorted(built) == sorted(rendered)
+    assert rendercache.render_key(clone_dir, _values()) == \
+        rendercache.render_key(repo_dir, _values())
+
+    written = rendercache.write_project(built, str(tmpdir.join("out")))
+    assert rendercache.read_project(written) == built
+
+
+def test_eviction(tmpdir, fake_app):
+    rendercache._cache.clear()
+    rendercache._cache_size[0] = 0
+    repo_dir = _make_template(tmpdir)
+    app = fake_app(RENDER_CACHE_BYTES=1024 * 1024)
+    size = rendercache._size(
+        list(rendercache.render_template(repo_dir, _values("A"))))
+    app.config["RENDER_CACHE_BYTES"] = 2 * size + 1
+    keys = []
+    for title in ("A", "B", "C"):
+        keys.append(rendercache.render_key(repo_dir, _values(title)))
+        list(rendercache.render_cached(app, repo_dir, _values(title)))
+        if title == "B":
+            # Used since, so "B" goes first.
+            assert rendercache.get_render(app, keys[0]) is not None
+    assert rendercache.get_render(app, keys[0]) is not None
+    assert rendercache.get_render(app, keys[1]) is None
+    assert rendercache.get_render(app, keys[2]) is not None
+    assert rendercache._cache_size[0] <= app.config["RENDER_CACHE_BYTES"]
+
+
+def test_reuse_render(tmpdir, fake_app):
+    rendercache._cache.clear()
+    rendercache._cache_size[0] = 0
+    app = fake_app(RENDER_CACHE_BYTES=1024 * 1024)
+    repo_dir = _make_template(tmpdir)
+    assert rendercache.reuse_render(app, repo_dir, _values()) is None
+    list(rendercache.render_cached(app, repo_dir, _values()))
+
+    # Made from the rendering of the same commit, and cached.
+    files = rendercache.reuse_render(app, repo_dir, _values("New Title"))
+    assert sorted(files) == sorted(
+        rendercache.render_template(repo_dir, _values("New Title")))
+    assert rendercache.get_render(
+        app, rendercache.render_key(repo_dir, _values("New Title"))) == \
+        tuple(files)
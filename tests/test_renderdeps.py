@@ -0,0 +1,93 @@
+"""Test the field index of templates, and rendering again from it.
+"""
+from collections import OrderedDict
+import os
+
+from uservice_ccutter.render import (RenderedFile, render_context,
+                                     render_template)
+from uservice_ccutter.renderdeps import FileFields, field_index
+
+
+def _write(path, content):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as fh:
+        fh.write(content)
+
+
+def _make_template(tmpdir, extra=None):
+    repo_dir = str(tmpdir)
+    template_dir = os.path.join(repo_dir, "{{cookiecutter.repo_name}}")
+    _write(os.path.join(repo_dir, "cookiecutter.json"), "{}")
+    files = {"README.rst": "{{ cookiecutter.title }}\n",
+             "setup.cfg": "name = {{ cookiecutter['repo_name'] }}\n",
+             "{{cookiecutter.series}}.txt": "Series\n",
+             "LICENSE": "{% if true %}MIT{% endif %}\n",
+             "index.rst": "{% include 'README.rst' %}\n"}
+    files.update(extra or {})
+    for path, content in files.items():
+        _write(os.path.join(template_dir, path), content)
+    return repo_dir
+
+
+def _values(serial_number="000", title="Document Title"):
+    return OrderedDict([
+        ("series", "SQR"),
+        ("serial_number", serial_number),
+        ("title", title),
+        ("repo_name", "{{ cookiecutter.series.lower() }}-"
+                      "{{ cookiecutter.serial_number }}")])
+
+
+def test_field_index(tmpdir):
+    index = field_index(_make_template(tmpdir), _values())
+    assert not index.volatile
+    assert index.files == {
+        "README.rst": FileFields(frozenset(), frozenset(["title"])),
+        "setup.cfg": FileFields(frozenset(), frozenset(["repo_name"])),
+        "{{cookiecutter.series}}.txt": FileFields(frozenset(["series"]),
+                                                  frozenset()),
+        "LICENSE": FileFields(frozenset(), frozenset()),
+        "index.rst": FileFields(frozenset(), None)}
+
+
+def test_dict_methods_read_every_field(tmpdir):
+    repo_dir = _make_template(tmpdir, {
+        "get.txt": "{{ cookiecutter.get('title') }}\n",
+        "items.txt": "{% for k, v in cookiecutter.items() %}{{ v }}"
+                     "{% endfor %}\n",
+        "keys.txt": "{{ cookiecutter.keys|list }}\n"})
+    files = field_index(repo_dir, _values()).files
+    for name in ("get.txt", "items.txt", "keys.txt"):
+        assert files[name].body is None
+
+
+def test_volatile(tmpdir):
+    repo_dir = _make_template(tmpdir, {"NOTES": "{% now 'utc' %}\n"})
+    assert field_index(repo_dir, _values()).volatile
+
+
+def test_render_again(tmpdir):
+    """Only the files the changed values affect are rendered again.
+    """
+    repo_dir = _make_template(tmpdir)
+    first = list(render_template(repo_dir, _values()))
+    # Mark the earlier rendering, to see what is taken from it.
+    previous = (render_context(_values()),
+                [RenderedFile(rfile.path, rfile.mode, b"reused")
+                 for rfile in first])
+
+    again = dict((rfile.path, rfile.content) for rfile in
+                 render_template(repo_dir, _values(serial_number="001"),
+                                 previous=previous))
+    assert again == {"sqr-001/README.rst": b"reused",
+                     "sqr-001/setup.cfg": b"name = sqr-001\n",
+                     "sqr-001/SQR.txt": b"reused",
+                     "sqr-001/LICENSE": b"reused",
+                     "sqr-001/index.rst": b"Document Title\n\n"}
+
+    again = dict((rfile.path, rfile.content) for rfile in
+                 render_template(repo_dir, _values(title="New Title"),
+                                 previous=previous))
+    assert again["sqr-000/README.rst"] == b"New Title\n"
+    assert again["sqr-000/setup.cfg"] == b"reused"
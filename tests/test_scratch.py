@@ -0,0 +1,80 @@
+"""Test placing job workspaces in scratch space.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from uservice_ccutter import scratch
+
+
+CONFIG = {"SCRATCH_JOB_QUOTA": 1000,
+          "SCRATCH_TOTAL_QUOTA": 2000,
+          "SCRATCH_ORPHAN_AGE": 3600}
+
+
+def _template(path, size):
+    path.join("cookiecutter.json").write("x" * size, ensure=True)
+    return str(path)
+
+
+def _disk(monkeypatch, tmpdir):
+    disk = tmpdir.mkdir("disk")
+    monkeypatch.setattr(tempfile, "tempdir", str(disk))
+    return str(disk)
+
+
+def test_workspace_in_scratch(monkeypatch, tmpdir, fake_app):
+    disk = _disk(monkeypatch, tmpdir)
+    app = fake_app(SCRATCH_DIR=str(tmpdir.join("scratch")), **CONFIG)
+    template = _template(tmpdir.join("small"), 100)
+    with scratch.workspace(app, template) as workdir:
+        assert os.path.dirname(workdir) == app.config["SCRATCH_DIR"]
+        with open(os.path.join(workdir, ".ccutter-scratch.json")) as f:
+            assert json.load(f)["reserved"] == 300
+    assert not os.path.exists(workdir)
+    assert os.listdir(disk) == []
+
+    # Too big for one job's quota.
+    template = _template(tmpdir.join("large"), 400)
+    with scratch.workspace(app, template) as workdir:
+        assert os.path.dirname(workdir) == disk
+
+
+def test_total_quota(monkeypatch, tmpdir, fake_app):
+    disk = _disk(monkeypatch, tmpdir)
+    app = fake_app(SCRATCH_DIR=str(tmpdir.join("scratch")), **CONFIG)
+    template = _template(tmpdir.join("template"), 300)
+    with scratch.workspace(app, template) as first, \
+            scratch.workspace(app, template) as second, \
+            scratch.workspace(app, template) as third:
+        assert os.path.dirname(first) == app.config["SCRATCH_DIR"]
+        assert os.path.dirname(second) == app.config["SCRATCH_DIR"]
+        assert os.path.dirname(third) == disk
+    with scratch.workspace(app, template) as fourth:
+        assert os.path.dirname(fourth) == app.config["SCRATCH_DIR"]
+
+
+def test_cleanup_orphans(monkeypatch, tmpdir, fake_app):
+    _disk(monkeypatch, tmpdir)
+    app = fake_app(SCRATCH_DIR=str(tmpdir.join("scratch")), **CONFIG)
+    template = _template(tmpdir.join("template"), 300)
+    gone = subprocess.Popen([sys.executable, "-c", "pass"])
+    gone.wait()
+
+    with scratch.workspace(app, template) as live:
+        orphan = scratch._reserve(app, 600)
+        marker = os.path.join(orphan, ".ccutter-scratch.json")
+        with open(marker) as f:
+            record = json.load(f)
+        record["pid"] = gone.pid
+        with open(marker, "w") as f:
+            json.dump(record, f)
+
+        # Full until the crashed worker's workspace is cleaned up.
+        with scratch.workspace(app, template) as workdir:
+            assert os.path.dirname(workdir) == app.config["SCRATCH_DIR"]
+        assert not os.path.exists(orphan)
+        assert os.path.exists(live)
+        assert scratch.cleanup_orphans(app) == 0
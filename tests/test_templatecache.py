@@ -0,0 +1,168 @@
+"""Test template cache refreshing.
+"""
+import json
+import threading
+
+from flask import Flask
+
+from uservice_ccutter import templatecache
+from uservice_ccutter.projecturls import PROJECTURLS, load_registry
+from uservice_ccutter.routes.projectlist import display_project_types
+
+
+RAW_BASE_URL = "https://raw.example.com"
+
+
+class FakeResponse(object):
+    status_code = 200
+    reason = "OK"
+
+    def __init__(self, text):
+        self.text = text
+
+
+def test_background_refresh_serves_stale_cache(monkeypatch, fake_app):
+    """A stale cache is refreshed off the request path.
+    """
+    release = threading.Event()
+    fetched = []
+
+    def slow_get(url):
+        fetched.append(url)
+        if len(fetched) > len(PROJECTURLS):
+            release.wait(5)
+        return FakeResponse('{"version": "%d"}' % len(fetched))
+
+    monkeypatch.setattr(templatecache.requests, "get", slow_get)
+    app = fake_app(PROJECTTYPE={},
+                   TEMPLATE_REGISTRY=load_registry(default_ttl=60),
+                   TEMPLATE_RAW_BASE_URL=RAW_BASE_URL,
+                   BACKGROUND_CACHE_REFRESH=True)
+    # Priming is always synchronous.
+    templatecache.refresh_cache(app)
+    first = app.config["PROJECTTYPE"]["uservice-bootstrap"]["template"]
+
+    for entry in app.config["PROJECTTYPE"].values():
+        entry["fetched"] -= 120
+    templatecache.refresh_cache(app)
+    # We got back before the refresh finished, with the stale template.
+    assert app.config["PROJECTTYPE"]["uservice-bootstrap"]["template"] \
+        == first
+    release.set()
+    # The refresher holds the lock until it is done.
+    assert templatecache._refresh_lock.acquire(timeout=5)
+    templatecache._refresh_lock.release()
+    assert app.config["PROJECTTYPE"]["uservice-bootstrap"]["template"] \
+        != first
+
+
+def test_lazy_types_load_on_use_and_evict_when_idle(monkeypatch, tmpdir,
+                                                    fake_app):
+    """Types that aren't preloaded are fetched on first use only, and
+    dropped once idle.
+    """
+    registry_file = str(tmpdir.join("registry.json"))
+    with open(registry_file, "w") as fh:
+        json.dump([{"url": "https://github.com/lsst-sqre/hot"},
+                   {"url": "https://github.com/lsst-sqre/cold",
+                    "preload": False, "ttl": 600, "idle_ttl": 60}], fh)
+    fetched = []
+
+    def fake_get(url):
+        fetched.append(url)
+        return FakeResponse('{"name": "x"}')
+
+    monkeypatch.setattr(templatecache.requests, "get", fake_get)
+    app = fake_app(PROJECTTYPE={},
+                   TEMPLATE_REGISTRY=load_registry(registry_file,
+                                                   default_ttl=3600),
+                   TEMPLATE_RAW_BASE_URL=RAW_BASE_URL)
+    templatecache.refresh_cache(app)
+    assert fetched == [
+        "https://raw.example.com/lsst-sqre/hot/master/cookiecutter.json"]
+    assert list(app.config["PROJECTTYPE"]) == ["hot"]
+
+    templatecache.get_single_project_type(app, "cold")
+    templatecache.get_single_project_type(app, "cold")
+    assert len(fetched) == 2
+    assert sorted(app.config["PROJECTTYPE"]) == ["cold", "hot"]
+
+    app.config["PROJECTTYPE"]["cold"]["accessed"] -= 120
+    templatecache.refresh_cache(app)
+    assert list(app.config["PROJECTTYPE"]) == ["hot"]
+
+
+def test_listing_does_not_load_lazy_types(monkeypatch, tmpdir):
+    registry_file = str(tmpdir.join("registry.json"))
+    with open(registry_file, "w") as fh:
+        json.dump([{"url": "https://github.com/lsst-sqre/hot"},
+                   {"url": "https://github.com/lsst-sqre/cold",
+                    "preload": False, "ttl": 600, "idle_ttl": 60}], fh)
+    fetched = []
+
+    def fake_get(url):
+        fetched.append(url)
+        return FakeResponse('{"name": "x"}')
+
+    monkeypatch.setattr(templatecache.requests, "get", fake_get)
+    app = Flask("uservice_ccutter")
+    app.config.update(PROJECTTYPE={},
+                      TEMPLATE_REGISTRY=load_registry(registry_file,
+                                                      default_ttl=3600),
+                      TEMPLATE_RAW_BASE_URL=RAW_BASE_URL,
+                      STORE_URL="memory://test-listing")
+
+    def listing():
+        with app.test_request_context("/ccutter"):
+            return json.loads(display_project_types().data.decode("utf-8"))
+
+    templatecache.refresh_cache(app)
+    assert listing() == {
+        "hot": {"name": "x"},
+        "cold": {"_url": "https://github.com/lsst-sqre/cold",
+                 "_branch": "master", "_loaded": False}}
+    assert len(fetched) == 1
+
+    # Once loaded, it is listed, but listing it does not keep it.
+    templatecache.get_single_project_type(app, "cold")
+    accessed = app.config["PROJECTTYPE"]["cold"]["accessed"]
+    assert listing()["cold"] == {"name": "x"}
+    assert app.config["PROJECTTYPE"]["cold"]["accessed"] == accessed
+    app.config["PROJECTTYPE"]["cold"]["accessed"] -= 120
+    templatecache.refresh_cache(app)
+    assert list(app.config["PROJECTTYPE"]) == ["hot"]
+    assert len(fetched) == 2
+
+
+def test_announced_changes_reach_other_processes(monkeypatch, fake_app):
+    """A type announced as changed by one process is refetched, at the
+    announced commit, by another.
+    """
+    fetched = []
+
+    def fake_get(url):
+        fetched.append(url)
+        return FakeResponse('{"fetch": %d}' % len(fetched))
+
+    monkeypatch.setattr(templatecache.requests, "get", fake_get)
+    config = {"STORE_URL": "memory://test-announce",
+              "TEMPLATE_ANNOUNCE_CHECK_SECONDS": 0,
+              "TEMPLATE_RAW_BASE_URL": RAW_BASE_URL}
+    here = fake_app(PROJECTTYPE={},
+                    TEMPLATE_REGISTRY=load_registry(default_ttl=3600),
+                    **config)
+    there = fake_app(PROJECTTYPE={},
+                     TEMPLATE_REGISTRY=load_registry(default_ttl=3600),
+                     **config)
+    templatecache.refresh_cache(here)
+    templatecache.refresh_cache(there)
+    del fetched[:]
+
+    templatecache.announce_template_change(here, "uservice-bootstrap", "f00")
+    templatecache.refresh_cache(there)
+    templatecache.refresh_cache(there)
+    assert fetched == [
+        "https://raw.example.com/lsst-sqre/uservice-bootstrap/f00/"
+        "cookiecutter.json"] * 2
+    assert there.config["PROJECTTYPE"]["uservice-bootstrap"]["template"] == \
+        {"fetch": 2}
@@ -0,0 +1,56 @@
+"""Test the local checkouts of template repositories.
+"""
+import os
+
+import git
+from git.exc import GitCommandError
+import pytest
+
+from uservice_ccutter.store import get_store
+from uservice_ccutter.templatecache import _ANNOUNCED_KEY
+from uservice_ccutter.templatecheckout import (get_template_checkout,
+                                               update_checkout,
+                                               update_template_checkout)
+
+
+def test_failed_clone_leaves_nothing(tmpdir):
+    parent = tmpdir.join("checkouts")
+    checkout_dir = str(parent.join("missing"))
+    with pytest.raises(GitCommandError):
+        update_checkout(str(tmpdir.join("no-such-repo")), checkout_dir)
+    assert os.listdir(str(parent)) == []
+
+
+def _commit(repo, message):
+    actor = git.Actor("Tester", "tester@example.com")
+    with open(os.path.join(repo.working_dir, "cookiecutter.json"), "w") as fh:
+        fh.write('{"message": "%s"}' % message)
+    repo.index.add(["cookiecutter.json"])
+    return repo.index.commit(message, author=actor,
+                             committer=actor).hexsha
+
+
+def test_failed_fetch_is_not_caught_up(fake_app, tmpdir):
+    """A checkout that could not fetch an announced commit fetches again
+    on its next use.
+    """
+    origin = git.Repo.init(str(tmpdir.join("origin")))
+    first = _commit(origin, "first")
+    app = fake_app(TEMPLATE_CHECKOUT_DIR=str(tmpdir.join("checkouts")),
+                   TEMPLATE_ANNOUNCE_CHECK_SECONDS=0,
+                   TEMPLATE_REGISTRY={"demo": {"url": origin.working_dir,
+                                               "branch": "master",
+                                               "ttl": 3600}})
+    checkout_dir = get_template_checkout(app, "demo")
+    assert git.Repo(checkout_dir).head.commit.hexsha == first
+
+    second = _commit(origin, "second")
+    get_store(app).set(_ANNOUNCED_KEY + "demo", second)
+    moved = str(tmpdir.join("moved"))
+    os.rename(origin.working_dir, moved)
+    update_template_checkout(app, "demo", second)
+    assert git.Repo(checkout_dir).head.commit.hexsha == first
+
+    os.rename(moved, origin.working_dir)
+    get_template_checkout(app, "demo")
+    assert git.Repo(checkout_dir).head.commit.hexsha == second
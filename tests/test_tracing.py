@@ -0,0 +1,149 @@
+"""Test trace propagation from requests to tasks, stages and upstream calls.
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import threading
+
+from celery.signals import before_task_publish, task_postrun, task_prerun
+import requests
+
+from uservice_ccutter import celeryapp, createapp, tracing
+from uservice_ccutter.deadlines import stage
+
+PARENT = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+
+CONFIG = {"TRACE_EXPORT_URL": "http://collector/api/v2/spans",
+          "TRACE_SERVICE_NAME": "test",
+          "STAGE_DEADLINES": {}}
+
+
+class FakeRequest(object):
+    pass
+
+
+class FakeTask(object):
+    name = "create_project_as_task"
+
+    def __init__(self, headers):
+        self.request = FakeRequest()
+        for key, value in headers.items():
+            setattr(self.request, key, value)
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def _exported(monkeypatch):
+    exports = []
+    monkeypatch.setattr(tracing, "_export",
+                        lambda app, spans: exports.append(
+                            [s.to_zipkin("test") for s in spans]))
+    return exports
+
+
+def test_task_continues_the_trace(monkeypatch, fake_app):
+    """A queued task's stages and upstream calls are spans of the trace
+    that queued it, exported when the task is done.
+    """
+    exports = _exported(monkeypatch)
+    app = fake_app(**CONFIG)
+    tracing.instrument_requests()
+    tracing.instrument_celery(app)
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.handle_request)
+    thread.daemon = True
+    thread.start()
+
+    headers = {}
+    with tracing.span("POST /ccutter/<project_type>", parent=PARENT):
+        before_task_publish.send(sender="create_project_as_task",
+                                 headers=headers)
+    assert headers["traceparent"].startswith("00-0af7651916cd43dd")
+    # Only a span with somewhere to export to keeps its children.
+    assert exports == []
+
+    task = FakeTask(headers)
+    task_prerun.send(sender=task, task_id="job-1", task=task)
+    with stage(app, "push"):
+        requests.get("http://127.0.0.1:%d/repos?token=secret" %
+                     server.server_address[1])
+    task_postrun.send(sender=task, task_id="job-1", task=task,
+                      state="SUCCESS")
+    assert tracing.current_span() is None
+
+    (spans,) = exports
+    client, push, job = spans
+    assert set(s["traceId"] for s in spans) == \
+        {"0af7651916cd43dd8448eb211c80319c"}
+    assert job["parentId"] == headers["traceparent"].split("-")[2]
+    assert push["parentId"] == job["id"]
+    assert push["name"] == "push"
+    assert client["parentId"] == push["id"]
+    assert client["kind"] == "CLIENT"
+    assert client["tags"]["http.status_code"] == "204"
+    assert "secret" not in client["tags"]["http.url"]
+
+
+def test_request_reports_its_trace(monkeypatch):
+    monkeypatch.setenv("REDIS_URL", "memory://")
+    monkeypatch.setenv("CCUTTER_STORE_URL", "memory://test-tracing")
+    monkeypatch.setattr(createapp, "refresh_cache", lambda app: None)
+    monkeypatch.setattr(celeryapp.celery_app.control, "broadcast",
+                        lambda *args, **kwargs: None)
+    app = createapp.create_flask_app()
+    client = app.test_client()
+
+    resp = client.get("/", headers={"traceparent": PARENT})
+    assert resp.headers["X-Ccutter-Trace-Id"] == \
+        "0af7651916cd43dd8448eb211c80319c"
+    resp = client.get("/", headers={"traceparent": "garbage"})
+    assert len(resp.headers["X-Ccutter-Trace-Id"]) == 32
+    assert resp.headers["X-Ccutter-Trace-Id"] != \
+        "0af7651916cd43dd8448eb211c80319c"
+
+
+class FakeSpan(object):
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+
+    def to_zipkin(self, service_name):
+        return {"traceId": self.trace_id}
+
+
+class FakeResponse(object):
+    def raise_for_status(self):
+        pass
+
+
+def test_export_queue_is_bounded(monkeypatch, fake_app):
+    """One thread exports; traces that do not fit in the queue are dropped.
+    """
+    monkeypatch.setattr(tracing, "_export_queue", tracing.queue.Queue(2))
+    monkeypatch.setattr(tracing, "_exporter", [None])
+    posting = threading.Event()
+    release = threading.Event()
+    posted = []
+
+    def post(url, json, timeout):
+        posting.set()
+        release.wait()
+        posted.append(json[0]["traceId"])
+        return FakeResponse()
+
+    monkeypatch.setattr(tracing.requests, "post", post)
+    app = fake_app(**CONFIG)
+    tracing._export(app, [FakeSpan("t0")])
+    exporter = tracing._exporter[0]
+    assert posting.wait(5)
+    for n in range(1, 5):
+        tracing._export(app, [FakeSpan("t%d" % n)])
+    assert tracing._exporter[0] is exporter
+    release.set()
+    tracing._export_queue.join()
+    assert posted == ["t0", "t1", "t2"]
@@ -0,0 +1,34 @@
+"""Test encryption of Travis CI secrets for technotes.
+"""
+from collections import OrderedDict
+
+from uservice_ccutter.plugins.projecttypes import lsst_technote_bootstrap
+
+
+class FakeTravisCI(object):
+    def __init__(self, pubkey):
+        self.pubkey = pubkey
+        self.key_requests = []
+
+    def get_public_key(self, repo):
+        self.key_requests.append(repo)
+        return self.pubkey
+
+    def create_travis_secure_string(self, public_key, data):
+        return 'secure: "%s:%s"' % (public_key, data)
+
+
+def test_secrets_fetch_key_once():
+    """All secrets are encrypted against one fetch of the repository key.
+    """
+    tcli = FakeTravisCI("KEY")
+    env = OrderedDict([("LTD_KEEPER_USER", "u"),
+                       ("LTD_KEEPER_PASSWORD", "p"),
+                       ("LTD_KEEPER_URL", "https://keeper.lsst.codes")])
+    secure_env = lsst_technote_bootstrap._encrypt_travis_env(
+        tcli, "lsst-sqre/sqr-000", env)
+    assert tcli.key_requests == ["lsst-sqre/sqr-000"]
+    assert secure_env.splitlines() == [
+        '    - secure: "KEY:LTD_KEEPER_USER=u"',
+        '    - secure: "KEY:LTD_KEEPER_PASSWORD=p"',
+        '    - secure: "KEY:LTD_KEEPER_URL=https://keeper.lsst.codes"']
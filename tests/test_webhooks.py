@@ -0,0 +1,71 @@
+"""Test the GitHub push webhook.
+"""
+import hashlib
+import hmac
+import json
+
+from uservice_ccutter import celeryapp, templatecache
+from uservice_ccutter.createapp import create_flask_app
+
+SECRET = "webhook-secret"
+
+
+class FakeResponse(object):
+    status_code = 200
+    reason = "OK"
+
+    def __init__(self, text):
+        self.text = text
+
+
+def _sign(body):
+    return "sha256=" + hmac.new(SECRET.encode("utf-8"), body,
+                                hashlib.sha256).hexdigest()
+
+
+def test_push_refreshes_only_the_pushed_type(monkeypatch, tmpdir):
+    """A signed push to a template branch refetches that type at the pushed
+    commit and tells the workers.
+    """
+    monkeypatch.setenv("REDIS_URL", "memory://")
+    monkeypatch.setenv("CCUTTER_STORE_URL", "memory://test-webhooks")
+    monkeypatch.setenv("CCUTTER_WEBHOOK_SECRET", SECRET)
+    monkeypatch.setenv("CCUTTER_TEMPLATE_CHECKOUT_DIR", str(tmpdir))
+    fetched = []
+
+    def fake_get(url):
+        fetched.append(url)
+        return FakeResponse(json.dumps({"fetch": len(fetched)}))
+
+    broadcasts = []
+    monkeypatch.setattr(templatecache.requests, "get", fake_get)
+    monkeypatch.setattr(celeryapp.celery_app.control, "broadcast",
+                        lambda *args, **kwargs: broadcasts.append(
+                            (args, kwargs)))
+    app = create_flask_app()
+    client = app.test_client()
+    del fetched[:]
+
+    body = json.dumps({
+        "ref": "refs/heads/master",
+        "after": "abc123",
+        "repository": {"full_name": "lsst-sqre/uservice-bootstrap"}
+    }).encode("utf-8")
+    resp = client.post("/ccutter/hooks/github/", data=body,
+                       headers={"X-GitHub-Event": "push",
+                                "X-Hub-Signature-256": "sha256=bad"})
+    assert resp.status_code == 401
+    assert fetched == []
+
+    resp = client.post("/ccutter/hooks/github/", data=body,
+                       headers={"X-GitHub-Event": "push",
+                                "X-Hub-Signature-256": _sign(body)})
+    assert resp.status_code == 200
+    assert json.loads(resp.data.decode("utf-8"))["updated"] == \
+        ["uservice-bootstrap"]
+    assert fetched == ["https://raw.githubusercontent.com/lsst-sqre/"
+                       "uservice-bootstrap/abc123/cookiecutter.json"]
+    assert broadcasts[0][1]["arguments"] == {"ptype": "uservice-bootstrap",
+                                             "generation": "abc123"}
+    resp = client.get("/ccutter/uservice-bootstrap/")
+    assert json.loads(resp.data.decode("utf-8")) == {"fetch": 1}
@@ -1,4 +1,8 @@
 """SQuaRE cookiecutter service (api.lsst.codes-compliant).
+
+Importing the package has no side effects.  The web service is
+`uservice_ccutter.wsgi.flask_app`; Celery workers use
+`uservice_ccutter.worker.celery_app`.
 """
 
 from pkg_resources import get_distribution, DistributionNotFound
@@ -8,10 +12,4 @@ try:
 except DistributionNotFound:
     __version__ = 'unknown'
 
-__all__ = ['flask_app', 'celery_app']
-
-from .createapp import create_flask_app
-
-flask_app = create_flask_app()
-
-from .celeryapp import celery_app
+__all__ = ['__version__']
@@ -0,0 +1,62 @@
+"""Admission control: turn away new jobs when the backlog is too deep.
+
+A job is refused with a ``429 Too Many Requests`` when the queue (see
+`uservice_ccutter.brokerstatus.queue_depth`) holds at least
+``ADMISSION_MAX_QUEUE_DEPTH`` jobs, or at least
+``ADMISSION_MAX_QUEUE_PER_SLOT`` jobs per worker slot (a zero threshold is
+not checked).  ``Retry-After`` is how long the workers should take to
+work the backlog back under the thresholds, assuming a job takes
+``ADMISSION_JOB_SECONDS``.
+"""
+
+__all__ = ['AdmissionError', 'check_admission']
+
+import math
+
+from apikit import BackendError
+from structlog import get_logger
+
+from .brokerstatus import queue_depth, worker_slots
+
+
+class AdmissionError(BackendError):
+    """A `apikit.BackendError` for a refused job, with the number of seconds
+    after which the client may try again.
+    """
+
+    def __init__(self, retry_after, content):
+        super(AdmissionError, self).__init__(reason="Too Many Requests",
+                                             status_code=429,
+                                             content=content)
+        self.retry_after = retry_after
+
+
+def check_admission(app):
+    """Raise `AdmissionError` if the backlog is over the thresholds.
+
+    If the broker cannot be reached we let the job through: enqueueing it
+    will fail and say so.
+    """
+    if not app.config["ADMISSION_CONTROL"]:
+        return
+    depth = queue_depth(app)
+    if depth is None:
+        return
+    slots = worker_slots(app) or 0
+    allowed = []
+    if app.config["ADMISSION_MAX_QUEUE_DEPTH"]:
+        allowed.append(app.config["ADMISSION_MAX_QUEUE_DEPTH"])
+    if app.config["ADMISSION_MAX_QUEUE_PER_SLOT"]:
+        allowed.append(app.config["ADMISSION_MAX_QUEUE_PER_SLOT"] *
+                       max(slots, 1))
+    if not allowed or depth < min(allowed):
+        return
+    excess = depth - min(allowed) + 1
+    retry_after = int(math.ceil(
+        excess * app.config["ADMISSION_JOB_SECONDS"] / float(max(slots, 1))))
+    get_logger().warning("Refusing job", queue_depth=depth,
+                         worker_slots=slots, retry_after=retry_after)
+    raise AdmissionError(retry_after,
+                         "%d jobs are already waiting for %d workers; "
+                         "try again in %d seconds." %
+                         (depth, slots, retry_after))
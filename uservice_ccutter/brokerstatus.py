@@ -0,0 +1,101 @@
+"""Cheap, cached views of the Celery broker and workers.
+
+Asking the broker for its queue length is quick, but asking the workers
+how many of them there are is a broadcast that waits for replies, so both
+answers are cached per process for ``BROKER_STATUS_CACHE_SECONDS``.
+
+With an in-process executor (see `uservice_ccutter.executor`), its pool is
+the queue and the workers.  With fair scheduling (see
+`uservice_ccutter.fairqueue`), jobs wait in the users' queues instead, and
+the broker only holds dispatch tokens (some of them held back by the
+workers to retry later), so the queue depth is that of the users' queues.
+"""
+
+__all__ = ['queue_depth', 'worker_slots', 'live_workers']
+
+import threading
+import time
+
+from kombu.exceptions import ChannelError
+from structlog import get_logger
+
+from . import celeryapp, executor
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def queue_depth(app):
+    """Return the number of jobs waiting (in the Celery queue, or the fair
+    queue), or None if the broker (or the store) cannot be reached.
+    """
+    return _cached(app, "queue_depth", _probe_queue_depth)
+
+
+def worker_slots(app):
+    """Return the total concurrency of the live workers (0 if none answer),
+    or None if the broker cannot be reached.
+    """
+    workers = _cached(app, "workers", _probe_workers)
+    return None if workers is None else sum(workers.values())
+
+
+def live_workers(app):
+    """Return the number of workers that answer (0 if none do), or None if
+    the broker cannot be reached.
+    """
+    workers = _cached(app, "workers", _probe_workers)
+    return None if workers is None else len(workers)
+
+
+def _cached(app, name, probe):
+    interval = app.config["BROKER_STATUS_CACHE_SECONDS"]
+    now = time.time()
+    with _cache_lock:
+        hit = _cache.get(name)
+        if hit is not None and now - hit[0] < interval:
+            return hit[1]
+    value = probe(app)
+    with _cache_lock:
+        _cache[name] = (now, value)
+    return value
+
+
+def _probe_queue_depth(app):
+    if app.config.get("FAIR_SCHEDULING"):
+        # Imported here, as fairqueue needs admission, which needs us.
+        from .fairqueue import queued_count
+        try:
+            return queued_count(app)
+        except Exception as exc:
+            get_logger().warning("Store unreachable", error=str(exc))
+            return None
+    if app.config.get("EXECUTOR", "celery") != "celery":
+        return executor.queued_count(app)
+    queue = app.config.get("CELERY_DEFAULT_QUEUE", "celery")
+    try:
+        with celeryapp.celery_app.connection_or_acquire() as conn:
+            return conn.default_channel.queue_declare(
+                queue=queue, passive=True).message_count
+    except ChannelError:
+        # Redis drops the list when it empties, so no queue means no jobs.
+        return 0
+    except Exception as exc:
+        get_logger().warning("Broker unreachable", error=str(exc))
+        return None
+
+
+def _probe_workers(app):
+    """Return the concurrency of each live worker, by name.
+    """
+    if app.config.get("EXECUTOR", "celery") != "celery":
+        return {"local": executor.worker_count(app)}
+    try:
+        inspector = celeryapp.celery_app.control.inspect(
+            timeout=app.config["BROKER_INSPECT_TIMEOUT"])
+        stats = inspector.stats() or {}
+    except Exception as exc:
+        get_logger().warning("Could not inspect workers", error=str(exc))
+        return None
+    return dict((name, worker_stats.get("pool", {}).get("max-concurrency", 1))
+                for name, worker_stats in stats.items())
@@ -1,35 +1,96 @@
 """Create and store the celery app instance.
 """
 
-__all__ = ['create_celery_app', 'celery_app']
+__all__ = ['create_celery_app', 'celery_app', 'UPDATE_TEMPLATE_COMMAND']
+
+import threading
 
 from celery import Celery
+from celery.signals import worker_init, worker_process_init
+from celery.worker.control import control_command
+
+from .credentialbroker import get_broker, init_broker
+from .scratch import cleanup_orphans
+from .templatecheckout import update_template_checkout
+from .tracing import instrument_celery
 
+# Remote control command telling workers a template repository has changed
+UPDATE_TEMPLATE_COMMAND = "ccutter_update_template"
 
-# This is installed by create_celery_app via create_flask_app so it's
-# available to route blueprints.
-celery_app = None
+
+# Tasks are declared against this at import time; create_celery_app (via
+# create_flask_app or create_worker_app) configures it.  Creating it does
+# not connect to anything.
+celery_app = Celery("uservice_ccutter")
 
 
 def create_celery_app(flask_app):
-    """Create the Celery app.
+    """Configure the Celery app.
 
     This implementation is based on
     http://flask.pocoo.org/docs/0.12/patterns/celery/ to leverage the
     Flask config to also configure Celery.
     """
-    global celery_app
-    celery_app = Celery(flask_app.import_name,
-                        backend=flask_app.config['CELERY_RESULT_BACKEND'],
-                        broker=flask_app.config['CELERY_BROKER_URL'])
-    celery_app.conf.update(flask_app.config)
+    # CELERY_BROKER_URL is not a Celery setting itself (that is BROKER_URL)
+    celery_app.conf.update(flask_app.config,
+                           BROKER_URL=flask_app.config['CELERY_BROKER_URL'])
+    # Tasks keep the Task class they were first built with, so it looks the
+    #  Flask app up when called, and is only installed once.
+    celery_app.flask_app = flask_app
     TaskBase = celery_app.Task
 
-    class ContextTask(TaskBase):
-        abstract = True
+    if not getattr(TaskBase, "with_flask_app", False):
+        class ContextTask(TaskBase):
+            abstract = True
+            with_flask_app = True
+
+            def __call__(self, *args, **kwargs):
+                with celery_app.flask_app.app_context():
+                    return TaskBase.__call__(self, *args, **kwargs)
+
+        celery_app.Task = ContextTask
+
+    def load_worker_credentials(**kwargs):
+        """Check every user's secrets once, as the worker starts.
+        """
+        try:
+            init_broker(flask_app, strict=flask_app.config[
+                "CREDENTIAL_STRICT"])
+        except RuntimeError as exc:
+            raise SystemExit("Refusing to start: " + str(exc))
+
+    def clean_worker_scratch(**kwargs):
+        """Remove the workspaces of workers that crashed before this one
+        started.
+        """
+        cleanup_orphans(flask_app)
+
+    def warm_worker_credentials(**kwargs):
+        """Fetch Keeper tokens in each pool process before any job needs
+        them.
+        """
+        get_broker(flask_app).warm()
 
-        def __call__(self, *args, **kwargs):
-            with flask_app.app_context():
-                return TaskBase.__call__(self, *args, **kwargs)
+    @control_command(name=UPDATE_TEMPLATE_COMMAND,
+                     args=[("ptype", str), ("generation", str)],
+                     signature="<ptype> [generation]")
+    def update_template(state, ptype, generation=None):
+        """Update the local checkout of a project type's template, which
+        every pool process clones from.
+        """
+        # Don't hold up the consumer while git fetches.
+        updater = threading.Thread(target=update_template_checkout,
+                                   args=(flask_app, ptype, generation))
+        updater.daemon = True
+        updater.start()
+        return {"ok": "updating " + ptype}
 
-    celery_app.Task = ContextTask
+    # Signal handlers are weakly referenced by default, and these would
+    #  not outlive this function.
+    worker_init.connect(load_worker_credentials, weak=False,
+                        dispatch_uid="ccutter.load_worker_credentials")
+    worker_init.connect(clean_worker_scratch, weak=False,
+                        dispatch_uid="ccutter.clean_worker_scratch")
+    worker_process_init.connect(warm_worker_credentials, weak=False,
+                                dispatch_uid="ccutter.warm_worker_credentials")
+    instrument_celery(flask_app)
@@ -0,0 +1,211 @@
+"""Circuit breakers for the upstream services that jobs depend on.
+
+Calls to GitHub, LTD Keeper and Travis CI go through a breaker per
+upstream (`upstream`).  Every web and worker process sees the same breaker
+state, which lives in the shared store:
+
+- *closed*: calls go through.  Calls that fail, or that take longer than
+  ``slow_call_seconds``, count as errors; once at least ``min_calls`` calls
+  have been made within a ``window``-second window and at least
+  ``error_rate`` of them were errors, the breaker opens.
+- *open*: calls fail at once with `CircuitOpenError` for ``open_seconds``.
+- *half open*: after that, one call is let through as a probe.  If it
+  succeeds the breaker closes; if not, it opens again.
+
+Settings are per upstream; see `DEFAULT_SETTINGS`.  Only the upstream's
+own failures count as errors: a connection that fails or times out, a 5xx
+answer (a `BackendError` of 500 or more, or github3's ``ServerError``) or
+a stage that runs past its deadline.  Anything else (a 4xx answer, a
+repository that already exists, a push that is not a fast-forward) is the
+caller's problem, and counts as a call that went through.
+"""
+
+__all__ = ['DEFAULT_SETTINGS', 'CircuitOpenError', 'CircuitBreaker',
+           'load_breaker_settings', 'get_breaker', 'upstream',
+           'upstream_failed']
+
+import contextlib
+import json
+import socket
+import time
+
+from apikit import BackendError
+from dulwich.errors import HangupException
+import github3.exceptions
+import requests
+from structlog import get_logger
+import urllib3.exceptions
+
+from .deadlines import StageTimeout
+from .store import get_store
+
+DEFAULT_SETTINGS = {
+    "error_rate": 0.5,
+    "min_calls": 5,
+    "window": 60,
+    "open_seconds": 60,
+    "slow_call_seconds": 30,
+}
+UPSTREAMS = ["github", "keeper", "travis"]
+
+# The upstream's failures, rather than the caller's.
+_UPSTREAM_ERRORS = (requests.ConnectionError, requests.Timeout,
+                    github3.exceptions.ServerError,
+                    github3.exceptions.TransportError,
+                    urllib3.exceptions.HTTPError, HangupException,
+                    ConnectionError, socket.timeout, StageTimeout)
+
+_BREAKER_KEY = "ccutter:breaker:"
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """An upstream's breaker is open, so the call was not made.
+    """
+
+    def __init__(self, upstream_name, retry_after):
+        super().__init__("%s is unavailable; retry in %ds" %
+                         (upstream_name, retry_after))
+        self.upstream = upstream_name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker(object):
+    """The breaker for one upstream.
+
+    Parameters
+    ----------
+    store
+        Shared store client (see `uservice_ccutter.store`).
+    name : `str`
+        Upstream name.
+    error_rate, min_calls, window, open_seconds, slow_call_seconds
+        See the module documentation.
+    """
+
+    def __init__(self, store, name, error_rate, min_calls, window,
+                 open_seconds, slow_call_seconds):
+        self._store = store
+        self.name = name
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.slow_call_seconds = slow_call_seconds
+        prefix = _BREAKER_KEY + name + ":"
+        # While the open key exists the breaker is open; once it expires,
+        #  the tripped key (which does not expire) makes it half open.
+        self._open_key = prefix + "open"
+        self._tripped_key = prefix + "tripped"
+        self._probe_key = prefix + "probe"
+        self._counts_key = prefix + "counts:"
+
+    @property
+    def state(self):
+        if self._store.exists(self._open_key):
+            return OPEN
+        if self._store.exists(self._tripped_key):
+            return HALF_OPEN
+        return CLOSED
+
+    def retry_after(self):
+        """Seconds until the breaker lets a call through again.
+        """
+        return max(self._store.ttl(self._open_key), 1)
+
+    def check(self):
+        """Raise `CircuitOpenError` unless a call may be made now.
+
+        In the half-open state only one caller at a time is let through.
+        """
+        if self._store.exists(self._open_key):
+            raise CircuitOpenError(self.name, self.retry_after())
+        if self._store.exists(self._tripped_key) and not self._store.set(
+                self._probe_key, "1", ex=self.open_seconds, nx=True):
+            raise CircuitOpenError(self.name, self.open_seconds)
+
+    def record(self, ok, elapsed=0):
+        """Record the outcome of a call that `check` let through.
+        """
+        ok = ok and elapsed <= self.slow_call_seconds
+        if self._store.exists(self._tripped_key):
+            # This was the probe.
+            if ok:
+                self._store.delete(self._tripped_key, self._probe_key)
+                get_logger().info("Circuit closed", upstream=self.name)
+            else:
+                self._trip()
+            return
+        bucket = "%s%d:" % (self._counts_key, int(time.time() // self.window))
+        calls = self._store.incr(bucket + "calls")
+        self._store.expire(bucket + "calls", self.window * 2)
+        if ok:
+            errors = int(self._store.get(bucket + "errors") or 0)
+        else:
+            errors = self._store.incr(bucket + "errors")
+            self._store.expire(bucket + "errors", self.window * 2)
+        if calls >= self.min_calls and errors >= self.error_rate * calls:
+            self._trip(calls=calls, errors=errors)
+
+    def _trip(self, **counts):
+        self._store.set(self._open_key, "1", ex=self.open_seconds)
+        self._store.set(self._tripped_key, "1")
+        self._store.delete(self._probe_key)
+        get_logger().warning("Circuit opened", upstream=self.name,
+                             open_seconds=self.open_seconds, **counts)
+
+    @contextlib.contextmanager
+    def guard(self):
+        """Check the breaker, then record how the body of the ``with``
+        statement went.
+        """
+        self.check()
+        started = time.time()
+        try:
+            yield
+        except Exception as exc:
+            if upstream_failed(exc):
+                self.record(False)
+            else:
+                self.record(True, time.time() - started)
+            raise
+        self.record(True, time.time() - started)
+
+
+def upstream_failed(exc):
+    """Whether exception ``exc`` is the upstream's failure (see the module
+    docstring), looking through the exceptions it was raised from.
+    """
+    if isinstance(exc, BackendError):
+        return exc.status_code >= 500
+    if isinstance(exc, _UPSTREAM_ERRORS):
+        return True
+    cause = exc.__cause__ or exc.__context__
+    return cause is not None and upstream_failed(cause)
+
+
+def load_breaker_settings(overrides=None):
+    """Return the settings for each upstream: `DEFAULT_SETTINGS` updated
+    from a JSON string such as ``{"travis": {"slow_call_seconds": 60}}``.
+    """
+    settings = {name: dict(DEFAULT_SETTINGS) for name in UPSTREAMS}
+    for name, values in json.loads(overrides or "{}").items():
+        settings.setdefault(name, dict(DEFAULT_SETTINGS)).update(values)
+    return settings
+
+
+def get_breaker(app, name):
+    """Return the breaker for upstream ``name``.
+    """
+    settings = app.config["CIRCUIT_BREAKERS"].get(name, DEFAULT_SETTINGS)
+    return CircuitBreaker(get_store(app), name, **settings)
+
+
+def upstream(app, name):
+    """Call upstream ``name`` in the body of the ``with`` statement, through
+    its breaker.
+    """
+    return get_breaker(app, name).guard()
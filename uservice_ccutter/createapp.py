@@ -1,19 +1,65 @@
-"""Create the Flask application.
+"""Create the Flask application, for the web service or for the workers.
+
+Nothing here runs at import time; the entry points are
+`uservice_ccutter.wsgi` and `uservice_ccutter.worker`.
 """
 
-__all__ = ['create_flask_app']
+__all__ = ['create_flask_app', 'create_worker_app']
 
 import os
+import tempfile
 
 from apikit import APIFlask
 
+from .circuitbreaker import load_breaker_settings
+from .deadlines import load_deadlines, longest_deadline
+from .executor import EXECUTORS
+from .projecturls import load_registry
 from .templatecache import refresh_cache
+from .tracing import instrument_requests
 from .celeryapp import create_celery_app
+from .plugins import preload_plugins
 
 
 def create_flask_app():
     """Create the Flask app with /ccutter routes behind api.lsst.codes.
     """
+    app = _create_app()
+
+    # Create the Celery app so it's available for the routes
+    create_celery_app(app)
+
+    # register blueprints with the routes
+    from .routes import api as api_blueprint
+    app.register_blueprint(api_blueprint, url_prefix=None)
+
+    # Prime cache with the preloaded types at start and then check it on
+    #  each GET
+    refresh_cache(app)
+
+    return app
+
+
+def create_worker_app():
+    """Create the Flask app for Celery workers.
+
+    Workers need the configuration, an app context for their tasks, and
+    the Celery app, but not the routes or the template cache.  The project
+    type plugins are imported now rather than on the first job, so that
+    with a prefork pool they are loaded once, before the pool processes are
+    forked.
+    """
+    app = _create_app()
+    create_celery_app(app)
+    # Register the tasks
+    from .tasks import createproject  # noqa: F401
+    preload_plugins(app.config["TEMPLATE_REGISTRY"])
+    return app
+
+
+def _create_app():
+    """Create the Flask app and its configuration.
+    """
     app = APIFlask(name="uservice-ccutter",
                    version="0.0.9",
                    repository="https://github.com/sqre-lsst/uservice-ccutter",
@@ -23,7 +69,27 @@ def create_flask_app():
                          "data": {"username": "",
                                   "password": ""}})
     app.config['max_cache_age'] = 60 * 60 * 8  # 8 hours
+    # Project types and their template repos; see projecturls.py for the
+    #  format of $CCUTTER_TEMPLATE_REGISTRY.  max_cache_age is the default
+    #  per-type TTL.
+    app.config["TEMPLATE_REGISTRY"] = load_registry(
+        os.getenv('CCUTTER_TEMPLATE_REGISTRY'),
+        default_ttl=app.config['max_cache_age'])
+    app.config["TEMPLATE_RAW_BASE_URL"] = os.getenv(
+        'CCUTTER_TEMPLATE_RAW_BASE_URL', 'https://raw.githubusercontent.com')
     app.config["PROJECTTYPE"] = {}
+    # GitHub REST API, for the calls that do not go through github3
+    app.config["GITHUB_API_URL"] = os.getenv(
+        'CCUTTER_GITHUB_API_URL', 'https://api.github.com')
+    # Refresh a stale cache off the request path.  Only useful when Python
+    #  threads actually run (gevent or threaded uwsgi), so uwsgi-async.ini
+    #  turns it on.
+    app.config['BACKGROUND_CACHE_REFRESH'] = os.getenv(
+        'CCUTTER_BACKGROUND_CACHE_REFRESH', '') not in ('', '0')
+    # Local clones of the template repositories, used for previews
+    app.config["TEMPLATE_CHECKOUT_DIR"] = os.getenv(
+        'CCUTTER_TEMPLATE_CHECKOUT_DIR',
+        os.path.join(tempfile.gettempdir(), 'ccutter-templates'))
     # Cookiecutter requires the order be preserved.
     app.config["JSON_SORT_KEYS"] = False
 
@@ -33,15 +99,149 @@ def create_flask_app():
                                                     default_redis_url)
     app.config['CELERY_BROKER_URL'] = os.getenv('REDIS_URL',
                                                 default_redis_url)
+    # Results can live somewhere other than the broker, and they expire so
+    #  that Redis memory stays flat.
+    app.config['CELERY_RESULT_BACKEND'] = os.getenv(
+        'CCUTTER_RESULT_BACKEND', app.config['CELERY_RESULT_BACKEND'])
+    app.config['CELERY_TASK_RESULT_EXPIRES'] = int(
+        os.getenv('CCUTTER_RESULT_EXPIRES', '3600'))
+    # Template values travel as compact msgpack (see payload.py)
+    app.config['CELERY_TASK_SERIALIZER'] = 'msgpack'
+    app.config['CELERY_RESULT_SERIALIZER'] = 'msgpack'
+    app.config['CELERY_ACCEPT_CONTENT'] = ['msgpack']
+    app.config['PAYLOAD_COMPRESS_THRESHOLD'] = int(
+        os.getenv('CCUTTER_PAYLOAD_COMPRESS_THRESHOLD', '1024'))
+    # Where jobs run (executor.py): "celery", or an in-process "thread" or
+    #  "process" pool of EXECUTOR_WORKERS
+    app.config['EXECUTOR'] = os.getenv('CCUTTER_EXECUTOR', 'celery')
+    if app.config['EXECUTOR'] not in EXECUTORS:
+        raise ValueError("CCUTTER_EXECUTOR must be one of %s" %
+                         ", ".join(EXECUTORS))
+    app.config['EXECUTOR_WORKERS'] = int(
+        os.getenv('CCUTTER_EXECUTOR_WORKERS', '2'))
+    if app.config['EXECUTOR'] != 'celery':
+        # In-process jobs report through their records (jobs.py) alone.
+        app.config['CELERY_RESULT_BACKEND'] = 'disabled'
+    # Job workspaces (scratch.py) go in SCRATCH_DIR, ideally a tmpfs, within
+    #  per-job and total quotas; otherwise, or if unset, on disk
+    app.config['SCRATCH_DIR'] = os.getenv('CCUTTER_SCRATCH_DIR', '')
+    app.config['SCRATCH_JOB_QUOTA'] = 1024 * 1024 * int(
+        os.getenv('CCUTTER_SCRATCH_JOB_QUOTA_MB', '256'))
+    app.config['SCRATCH_TOTAL_QUOTA'] = 1024 * 1024 * int(
+        os.getenv('CCUTTER_SCRATCH_TOTAL_QUOTA_MB', '1024'))
+    app.config['SCRATCH_ORPHAN_AGE'] = int(
+        os.getenv('CCUTTER_SCRATCH_ORPHAN_AGE', str(60 * 60 * 3)))
+    # Rendered projects are cached per process (rendercache.py), up to this
+    #  much file content
+    app.config['RENDER_CACHE_BYTES'] = 1024 * 1024 * int(
+        os.getenv('CCUTTER_RENDER_CACHE_MB', '64'))
+    # How long a queued job's credentials stay available to it
+    app.config['CREDENTIAL_TTL'] = int(
+        os.getenv('CCUTTER_CREDENTIAL_TTL', '3600'))
 
-    # Create the Celery app so it's available for the routes
-    create_celery_app(app)
+    # Shared state (profiling reports, ...) lives with the broker by default
+    app.config['STORE_URL'] = os.getenv('CCUTTER_STORE_URL',
+                                        app.config['CELERY_BROKER_URL'])
 
-    # register blueprints with the routes
-    from .routes import api as api_blueprint
-    app.register_blueprint(api_blueprint, url_prefix=None)
+    # Opt-in profiling of jobs and requests (see profiling.py)
+    app.config['PROFILE_SAMPLE_RATE'] = float(
+        os.getenv('CCUTTER_PROFILE_SAMPLE_RATE', '0'))
+    app.config['PROFILE_MAX_REPORTS'] = int(
+        os.getenv('CCUTTER_PROFILE_MAX_REPORTS', '100'))
+    app.config['PROFILE_RETENTION'] = int(
+        os.getenv('CCUTTER_PROFILE_RETENTION', str(60 * 60 * 24 * 7)))
+    # Basic auth password for /ccutter/admin; admin routes are off if unset
+    app.config['ADMIN_TOKEN'] = os.getenv('CCUTTER_ADMIN_TOKEN')
+
+    # Validate GitHub credentials before queueing, caching the verdicts
+    app.config['AUTH_PRECHECK'] = os.getenv(
+        'CCUTTER_AUTH_PRECHECK', '1') not in ('', '0')
+    app.config['AUTH_CACHE_TTL'] = int(
+        os.getenv('CCUTTER_AUTH_CACHE_TTL', '600'))
+    app.config['AUTH_NEGATIVE_CACHE_TTL'] = int(
+        os.getenv('CCUTTER_AUTH_NEGATIVE_CACHE_TTL', '60'))
+
+    # Queue and worker probes (brokerstatus.py) are cached this long
+    app.config['BROKER_STATUS_CACHE_SECONDS'] = float(
+        os.getenv('CCUTTER_BROKER_STATUS_CACHE_SECONDS', '5'))
+    app.config['BROKER_INSPECT_TIMEOUT'] = float(
+        os.getenv('CCUTTER_BROKER_INSPECT_TIMEOUT', '0.5'))
+    # ... and the readiness report (readiness.py) this long
+    app.config['READINESS_CACHE_SECONDS'] = float(
+        os.getenv('CCUTTER_READINESS_CACHE_SECONDS', '5'))
+    # Admission control (admission.py); a zero threshold is not checked
+    app.config['ADMISSION_CONTROL'] = os.getenv(
+        'CCUTTER_ADMISSION_CONTROL', '1') not in ('', '0')
+    app.config['ADMISSION_MAX_QUEUE_DEPTH'] = int(
+        os.getenv('CCUTTER_ADMISSION_MAX_QUEUE_DEPTH', '100'))
+    app.config['ADMISSION_MAX_QUEUE_PER_SLOT'] = int(
+        os.getenv('CCUTTER_ADMISSION_MAX_QUEUE_PER_SLOT', '10'))
+    app.config['ADMISSION_JOB_SECONDS'] = float(
+        os.getenv('CCUTTER_ADMISSION_JOB_SECONDS', '60'))
+    # Fair scheduling across submitters (fairqueue.py).  A zero cap is not
+    #  checked.
+    app.config['FAIR_SCHEDULING'] = os.getenv(
+        'CCUTTER_FAIR_SCHEDULING', '1') not in ('', '0')
+    app.config['FAIR_MAX_RUNNING_PER_USER'] = int(
+        os.getenv('CCUTTER_FAIR_MAX_RUNNING_PER_USER', '2'))
+    app.config['FAIR_MAX_QUEUED_PER_USER'] = int(
+        os.getenv('CCUTTER_FAIR_MAX_QUEUED_PER_USER', '20'))
+    app.config['FAIR_RETRY_SECONDS'] = float(
+        os.getenv('CCUTTER_FAIR_RETRY_SECONDS', '10'))
+    # A running job's hold on its user's slot lapses after this long, in
+    #  case its worker died; it should outlast the longest job.
+    app.config['FAIR_LEASE_SECONDS'] = int(
+        os.getenv('CCUTTER_FAIR_LEASE_SECONDS', str(2 * 60 * 60)))
+
+    # GitHub push webhooks for the template repositories (routes/webhooks.py)
+    #  are verified with this secret, and disabled if it is not set.
+    app.config['WEBHOOK_SECRET'] = os.getenv('CCUTTER_WEBHOOK_SECRET')
+    # How often each process looks for announced template changes
+    app.config['TEMPLATE_ANNOUNCE_CHECK_SECONDS'] = float(
+        os.getenv('CCUTTER_TEMPLATE_ANNOUNCE_CHECK_SECONDS', '5'))
+
+    # Worker-side credentials (credentialbroker.py).  With strict checking,
+    #  a worker refuses to start if any user's secrets are incomplete.
+    app.config['CREDENTIAL_STRICT'] = os.getenv(
+        'CCUTTER_CREDENTIAL_STRICT', '1') not in ('', '0')
+    app.config['KEEPER_URL'] = os.getenv(
+        'CCUTTER_KEEPER_URL', 'https://keeper.lsst.codes')
+    app.config['KEEPER_TOKEN_TTL'] = float(
+        os.getenv('CCUTTER_KEEPER_TOKEN_TTL', '3600'))
+    app.config['KEEPER_TOKEN_REFRESH_AHEAD'] = float(
+        os.getenv('CCUTTER_KEEPER_TOKEN_REFRESH_AHEAD', '300'))
+
+    # Soft and hard deadlines for each job stage (see deadlines.py);
+    #  $CCUTTER_STAGE_DEADLINES is JSON like {"push": [300, 360]}.
+    app.config['STAGE_DEADLINES'] = load_deadlines(
+        os.getenv('CCUTTER_STAGE_DEADLINES'))
+
+    # Circuit breakers for GitHub, Keeper and Travis CI (circuitbreaker.py);
+    #  $CCUTTER_CIRCUIT_BREAKERS is JSON like {"travis": {"window": 120}}.
+    #  A job held up by an open breaker is deferred at most this many times.
+    app.config['CIRCUIT_BREAKERS'] = load_breaker_settings(
+        os.getenv('CCUTTER_CIRCUIT_BREAKERS'))
+    app.config['BREAKER_MAX_DEFERRALS'] = int(
+        os.getenv('CCUTTER_BREAKER_MAX_DEFERRALS', '24'))
+    # How long job checkpoints (jobs.py), and so the chance to resume a
+    #  job, are kept after the job's last progress
+    app.config['JOB_RETENTION'] = int(
+        os.getenv('CCUTTER_JOB_RETENTION', str(60 * 60 * 24 * 7)))
+    # A job left running this long without progress is taken to have lost
+    #  its worker, and can be resumed.  By default that is ten minutes past
+    #  the longest hard stage deadline, as a healthy job can go that long
+    #  without a checkpoint; with a stage unlimited, never.
+    stale = os.getenv('CCUTTER_JOB_STALE_SECONDS')
+    if stale is None:
+        longest = longest_deadline(app.config['STAGE_DEADLINES'])
+        stale = longest + 600 if longest is not None else None
+    app.config['JOB_STALE_SECONDS'] = int(stale) if stale else None
 
-    # Prime cache at start and then check it on each GET
-    refresh_cache(app, app.config['max_cache_age'])
+    # Traces of requests and jobs (tracing.py) go to this Zipkin-compatible
+    #  collector; without one, spans are not kept.
+    app.config['TRACE_EXPORT_URL'] = os.getenv('CCUTTER_TRACE_EXPORT_URL')
+    app.config['TRACE_SERVICE_NAME'] = os.getenv(
+        'CCUTTER_TRACE_SERVICE_NAME', 'uservice-ccutter')
+    instrument_requests()
 
     return app
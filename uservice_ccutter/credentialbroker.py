@@ -0,0 +1,199 @@
+"""Per-user secrets for the workers, and LTD Keeper tokens to go with them.
+
+Each user that can finalize technotes has a bundle of secrets in
+environment variables named after their GitHub username, uppercased:
+``SQRBOT_KEEPER_USERNAME``, ``SQRBOT_KEEPER_PASSWORD``, and so on (see
+`BUNDLE_FIELDS`).  Bundles are read and checked once, when the worker
+starts, so that a misconfigured user shows up at boot rather than after
+their repository has been created.
+
+Keeper tokens are cached per process until shortly before they expire,
+and refreshed in the background once they are within
+``KEEPER_TOKEN_REFRESH_AHEAD`` seconds of it, so finalizing a technote does
+not normally wait on Keeper.
+"""
+
+__all__ = ['BUNDLE_FIELDS', 'load_bundles', 'CredentialBroker',
+           'init_broker', 'get_broker']
+
+import os
+import threading
+import time
+
+from apikit import raise_from_response, raise_ise
+import requests
+from structlog import get_logger
+
+# Longest first, so that SQRBOT_LTD_KEEPER_PASSWORD is not taken for the
+#  KEEPER_PASSWORD of a user called SQRBOT_LTD.
+BUNDLE_FIELDS = ["LTD_MASON_AWS_SECRET",
+                 "LTD_KEEPER_PASSWORD",
+                 "LTD_MASON_AWS_ID",
+                 "LTD_KEEPER_USER",
+                 "KEEPER_USERNAME",
+                 "KEEPER_PASSWORD"]
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def load_bundles(environ=None):
+    """Collect the secret bundles from the environment.
+
+    Returns
+    -------
+    bundles : `dict`
+        Complete bundles, keyed by uppercased username; each maps the names
+        in `BUNDLE_FIELDS` to values.
+    problems : `list` of `str`
+        A description of each incomplete bundle.
+    """
+    if environ is None:
+        environ = os.environ
+    found = {}
+    for name, value in environ.items():
+        for field in BUNDLE_FIELDS:
+            suffix = "_" + field
+            if name.endswith(suffix) and len(name) > len(suffix):
+                found.setdefault(name[:-len(suffix)], {})[field] = value
+                break
+    bundles = {}
+    problems = []
+    for user, bundle in sorted(found.items()):
+        missing = [user + "_" + field for field in BUNDLE_FIELDS
+                   if not bundle.get(field)]
+        if missing:
+            problems.append("Credentials for %s are incomplete: %s unset" %
+                            (user, ", ".join(sorted(missing))))
+            continue
+        bundles[user] = bundle
+    return bundles, problems
+
+
+class CredentialBroker(object):
+    """Hand out secret bundles and cached Keeper tokens.
+
+    Parameters
+    ----------
+    bundles : `dict`
+        Bundles as returned by `load_bundles`.
+    keeper_url : `str`
+        Base URL of LTD Keeper.
+    token_ttl : `float`
+        How long a Keeper token is good for, in seconds.
+    refresh_ahead : `float`
+        Refresh a token in the background once it has less than this many
+        seconds left.
+    """
+
+    def __init__(self, bundles, keeper_url, token_ttl, refresh_ahead):
+        self._bundles = bundles
+        self._token_url = keeper_url.rstrip("/") + "/token"
+        self._token_ttl = token_ttl
+        self._refresh_ahead = refresh_ahead
+        self._tokens = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @property
+    def users(self):
+        return sorted(self._bundles)
+
+    def bundle(self, username):
+        """Return the secret bundle for a user, or raise a 500 if they have
+        none.
+        """
+        user = username.upper()
+        if user not in self._bundles:
+            raise_ise("No credentials are configured for %s (%s_*)" %
+                      (username, user))
+        return self._bundles[user]
+
+    def keeper_token(self, username):
+        """Return a Keeper token for a user, fetching one only if there is
+        no cached token or it has expired.
+        """
+        user = username.upper()
+        now = time.time()
+        with self._lock:
+            cached = self._tokens.get(user)
+        if cached is None or cached[1] <= now:
+            return self._fetch_token(user)
+        if cached[1] - now <= self._refresh_ahead:
+            self._refresh_in_background(user)
+        return cached[0]
+
+    def warm(self):
+        """Fetch tokens for every user in the background.
+        """
+        for user in self._bundles:
+            self._refresh_in_background(user)
+
+    def _fetch_token(self, user):
+        bundle = self.bundle(user)
+        requested = time.time()
+        get_logger().info("Requesting Keeper token", user=user)
+        resp = requests.get(self._token_url,
+                            auth=(bundle["KEEPER_USERNAME"],
+                                  bundle["KEEPER_PASSWORD"]))
+        raise_from_response(resp)
+        try:
+            token = resp.json()["token"]
+        except Exception as exc:
+            raise_ise(str(exc))
+        with self._lock:
+            # Count the lifetime from before we asked, to be safe.
+            self._tokens[user] = (token, requested + self._token_ttl)
+        return token
+
+    def _refresh_in_background(self, user):
+        with self._lock:
+            if user in self._refreshing:
+                return
+            self._refreshing.add(user)
+        refresher = threading.Thread(target=self._refresh, args=(user,))
+        refresher.daemon = True
+        refresher.start()
+
+    def _refresh(self, user):
+        try:
+            self._fetch_token(user)
+        except Exception as exc:
+            # The cached token, if any, is still good for now.
+            get_logger().warning("Could not refresh Keeper token",
+                                 user=user, error=str(exc))
+        finally:
+            with self._lock:
+                self._refreshing.discard(user)
+
+
+def init_broker(app, strict=False):
+    """Load the secret bundles and install a fresh broker.
+
+    Incomplete bundles are logged; if ``strict``, they raise `RuntimeError`
+    instead.
+    """
+    global _broker
+    bundles, problems = load_bundles()
+    logger = get_logger()
+    for problem in problems:
+        logger.error(problem)
+    if problems and strict:
+        raise RuntimeError("; ".join(problems))
+    broker = CredentialBroker(bundles, app.config["KEEPER_URL"],
+                              app.config["KEEPER_TOKEN_TTL"],
+                              app.config["KEEPER_TOKEN_REFRESH_AHEAD"])
+    logger.info("Loaded worker credentials", users=broker.users)
+    with _broker_lock:
+        _broker = broker
+    return broker
+
+
+def get_broker(app):
+    """Return the broker, loading (leniently) one if the worker did not.
+    """
+    with _broker_lock:
+        broker = _broker
+    if broker is None:
+        broker = init_broker(app)
+    return broker
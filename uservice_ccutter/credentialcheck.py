@@ -0,0 +1,71 @@
+"""Validate GitHub credentials at the API edge, with a cache of verdicts.
+
+Without this, bad credentials are only discovered once a worker picks up the
+job.  Verdicts are cached in the shared store (see `uservice_ccutter.store`)
+keyed by a hash of the credentials, so a repeat submitter costs one store
+lookup rather than a round trip to GitHub.
+"""
+
+__all__ = ['validate_credentials', 'check_org_membership']
+
+import hashlib
+import json
+
+from apikit import BackendError
+from structlog import get_logger
+
+from .github import get_github_identity
+from .store import get_store
+
+_VERDICT_KEY = "ccutter:auth:"
+
+
+def validate_credentials(app, username, token):
+    """Return the identity (see `uservice_ccutter.github.get_github_identity`)
+    for a set of credentials, or raise a 401 if they are not valid.
+
+    Valid verdicts are cached for ``AUTH_CACHE_TTL`` seconds and invalid ones
+    for ``AUTH_NEGATIVE_CACHE_TTL`` seconds.  If GitHub cannot be reached,
+    the credentials are let through (and not cached): the worker will check
+    them again anyway.
+    """
+    logger = get_logger().bind(username=username)
+    store = get_store(app)
+    key = _VERDICT_KEY + hashlib.sha256(
+        (username + ":" + token).encode("utf-8")).hexdigest()
+    cached = store.get(key)
+    if cached is not None:
+        verdict = json.loads(cached.decode("utf-8"))
+        if verdict["valid"]:
+            return verdict["identity"]
+        raise BackendError(status_code=401,
+                           reason="Bad credentials",
+                           content=verdict["reason"])
+    try:
+        identity = get_github_identity(username, token)
+    except BackendError as exc:
+        logger.info("Rejecting credentials", reason=exc.content)
+        store.set(key, json.dumps({"valid": False, "reason": exc.content}),
+                  ex=app.config["AUTH_NEGATIVE_CACHE_TTL"])
+        raise
+    except Exception as exc:
+        logger.warning("Could not validate credentials", error=str(exc))
+        return None
+    store.set(key, json.dumps({"valid": True, "identity": identity}),
+              ex=app.config["AUTH_CACHE_TTL"])
+    return identity
+
+
+def check_org_membership(identity, org):
+    """Raise a 403 unless ``identity`` belongs to the GitHub ``org``.
+
+    Either may be None (identity unknown, or the project type can't say
+    which org it creates in), in which case the check is left to the worker.
+    """
+    if identity is None or org is None:
+        return
+    if org.lower() not in [x.lower() for x in identity["orgs"]]:
+        raise BackendError(status_code=403,
+                           reason="Forbidden",
+                           content="%s is not a member of %s." %
+                           (identity["login"], org))
@@ -0,0 +1,47 @@
+"""Pass credentials to jobs by reference.
+
+Rather than putting the submitter's GitHub token in the task message, where
+it sits in the broker and in any message dump, the web tier stashes it in
+the shared store under a random reference with a short expiry and sends the
+reference instead.  The job drops it when it is done with it.
+"""
+
+__all__ = ['stash_credentials', 'fetch_credentials', 'drop_credentials']
+
+import json
+import uuid
+
+from .store import get_store
+
+_CREDENTIAL_KEY = "ccutter:credentials:"
+
+
+def stash_credentials(app, auth, ttl=None):
+    """Store ``auth`` for at most ``ttl`` seconds (default:
+    ``app.config["CREDENTIAL_TTL"]``) and return its reference.
+    """
+    ref = uuid.uuid4().hex
+    get_store(app).set(_CREDENTIAL_KEY + ref, json.dumps(auth),
+                       ex=ttl or app.config["CREDENTIAL_TTL"])
+    return ref
+
+
+def fetch_credentials(app, ref):
+    """Return the credentials stashed under ``ref``.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if they have expired (the job waited in the queue longer
+        than ``CREDENTIAL_TTL``) or were already dropped.
+    """
+    data = get_store(app).get(_CREDENTIAL_KEY + ref)
+    if data is None:
+        raise RuntimeError("Credentials for this job have expired")
+    return json.loads(data.decode("utf-8"))
+
+
+def drop_credentials(app, ref):
+    """Forget the credentials stashed under ``ref``.
+    """
+    get_store(app).delete(_CREDENTIAL_KEY + ref)
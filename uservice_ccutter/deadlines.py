@@ -0,0 +1,190 @@
+"""Soft and hard deadlines for the stages of a project creation job.
+
+Each stage of the pipeline, and each phase of a project type's
+``finalize_``, runs under a deadline from ``app.config["STAGE_DEADLINES"]``
+(see `DEFAULT_DEADLINES`).
+
+- At the soft deadline, `StageTimeout` is raised in the job (by
+  ``SIGALRM``), so the job unwinds normally: its workspace is removed and the
+  failure names the stage.
+- If the job is still in the stage at the hard deadline (because the
+  exception was swallowed, or the job is stuck somewhere Python cannot
+  interrupt), the workspaces registered with `cleanup_on_hard_deadline` are
+  removed and the worker process exits, so the pool replaces it and the
+  slot is not lost.
+
+Soft deadlines need the job to run in the main thread of its process, as
+it does in the default prefork pool.  Elsewhere only the hard deadline is
+enforced, and by logging rather than exiting.
+"""
+
+__all__ = ['DEFAULT_DEADLINES', 'StageTimeout', 'deadline', 'stage',
+           'cleanup_on_hard_deadline', 'load_deadlines', 'longest_deadline']
+
+import contextlib
+import json
+import os
+import shutil
+import signal
+import threading
+import time
+
+from structlog import get_logger
+
+from .tracing import span
+
+# (soft, hard) seconds for each stage; None for no limit.  The Travis CI
+#  webhook phase retries for about an hour by design.
+DEFAULT_DEADLINES = {
+    "substitute": (60, 90),
+    "clone": (60, 90),
+    "render": (120, 180),
+    "init": (60, 90),
+    "create_repo": (60, 90),
+    "push": (120, 180),
+    "finalize": (4800, 5100),
+    "finalize:keeper": (60, 90),
+    "finalize:travis_webhook": (4200, 4500),
+    "finalize:travis_yml": (60, 90),
+    "finalize:travis_push": (120, 180),
+    "finalize:protect_branch": (120, 180),
+}
+
+_active = []
+_workspaces = []
+
+
+class StageTimeout(Exception):
+    """A stage ran past its soft deadline.
+    """
+
+    def __init__(self, stage_name, seconds):
+        super().__init__("Stage %r exceeded its %ss deadline" %
+                         (stage_name, seconds))
+        self.stage = stage_name
+        self.seconds = seconds
+
+
+class _Deadline(object):
+    def __init__(self, name, soft, hard):
+        now = time.time()
+        self.name = name
+        self.soft = soft
+        self.soft_at = now + soft if soft else None
+        self.hard = hard
+        self.hard_at = now + hard if hard else None
+        self.fired = False
+
+
+def load_deadlines(overrides=None):
+    """Return `DEFAULT_DEADLINES` updated from a JSON string such as
+    ``{"push": [300, 360], "finalize:travis_webhook": null}``.
+    """
+    deadlines = dict(DEFAULT_DEADLINES)
+    for name, limits in json.loads(overrides or "{}").items():
+        deadlines[name] = tuple(limits) if limits else (None, None)
+    return deadlines
+
+
+def longest_deadline(deadlines):
+    """The longest hard deadline of any stage in ``deadlines``, or None if
+    some stage has no hard deadline.
+    """
+    hards = [hard for _, hard in deadlines.values()]
+    if None in hards:
+        return None
+    return max(hards)
+
+
+@contextlib.contextmanager
+def stage(app, name):
+    """Run the body of the ``with`` statement under the configured deadlines
+    for stage ``name``, as a span of the job's trace (see tracing.py).
+    """
+    soft, hard = app.config["STAGE_DEADLINES"].get(name, (None, None))
+    with span(name), deadline(name, soft, hard):
+        yield
+
+
+@contextlib.contextmanager
+def deadline(name, soft=None, hard=None):
+    """Run the body of the ``with`` statement under a soft and a hard
+    deadline, in seconds.  Deadlines nest.
+    """
+    entry = _Deadline(name, soft, hard)
+    in_main_thread = threading.current_thread() is threading.main_thread()
+    watchdog = None
+    if entry.hard_at is not None:
+        watchdog = threading.Timer(hard, _hard_deadline,
+                                   args=(entry, in_main_thread))
+        watchdog.daemon = True
+        watchdog.start()
+    if in_main_thread:
+        _active.append(entry)
+        previous = signal.signal(signal.SIGALRM, _soft_deadline)
+        _arm()
+    try:
+        yield
+    finally:
+        if watchdog is not None:
+            watchdog.cancel()
+        if in_main_thread:
+            _active.remove(entry)
+            _arm()
+            if not _active:
+                signal.signal(signal.SIGALRM, previous)
+
+
+@contextlib.contextmanager
+def cleanup_on_hard_deadline(path):
+    """Remove ``path`` if a hard deadline ends the process while in the body
+    of the ``with`` statement.
+    """
+    _workspaces.append(path)
+    try:
+        yield path
+    finally:
+        _workspaces.remove(path)
+
+
+def _arm():
+    """Set the alarm for the earliest soft deadline still to come.
+    """
+    pending = [entry.soft_at for entry in _active
+               if entry.soft_at is not None and not entry.fired]
+    if not pending:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        return
+    signal.setitimer(signal.ITIMER_REAL, max(min(pending) - time.time(),
+                                             0.001))
+
+
+def _soft_deadline(signum, frame):
+    now = time.time()
+    expired = [entry for entry in _active
+               if entry.soft_at is not None and not entry.fired and
+               entry.soft_at <= now]
+    if not expired:
+        _arm()  # Woken early; go back to sleep.
+        return
+    # The outermost expired stage is the one to report.
+    entry = expired[0]
+    for other in expired:
+        other.fired = True
+    _arm()
+    get_logger().error("Stage deadline exceeded", stage=entry.name,
+                       soft_deadline=entry.soft)
+    raise StageTimeout(entry.name, entry.soft)
+
+
+def _hard_deadline(entry, exit_process):
+    logger = get_logger()
+    logger.critical("Stage hard deadline exceeded", stage=entry.name,
+                    hard_deadline=entry.hard, exiting=exit_process)
+    if not exit_process:
+        return
+    for path in list(_workspaces):
+        shutil.rmtree(path, ignore_errors=True)
+    # Nothing in the job can be trusted to unwind now; let the pool replace
+    #  this process.
+    os._exit(1)
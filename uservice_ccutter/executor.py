@@ -0,0 +1,171 @@
+"""Where tasks run: on Celery workers, or in this process.
+
+``EXECUTOR`` picks the backend:
+
+- ``celery`` (the default): tasks go through the broker to the Celery
+  workers, as always.
+- ``thread``: tasks run in a pool of ``EXECUTOR_WORKERS`` threads in the
+  web process.  Nothing else needs to be running, not even Redis (with
+  ``CCUTTER_STORE_URL=memory://``), so this suits development, tests and
+  small installs.  Soft stage deadlines are not enforced in threads (see
+  `uservice_ccutter.deadlines`).
+- ``process``: tasks run in a pool of ``EXECUTOR_WORKERS`` processes
+  forked from this one, each set up like a Celery worker on its first
+  task.  Job records
+  and credentials must be visible to them, so the store has to be Redis.
+  A process that exits at a hard stage deadline breaks the whole pool:
+  every job the pool had, running or waiting, is marked failed (and can
+  be resumed), and the pool is replaced.
+
+Either way a task runs as it would on a worker (``Task.apply``): in an app
+context, with its task ID, in the trace that queued it (see
+`uservice_ccutter.tracing`), and keeping its job record up to date (see
+`uservice_ccutter.jobs`).  The pools are bounded by their number of
+workers; the jobs waiting for one count as the queue for admission
+control (see `uservice_ccutter.admission` and
+`uservice_ccutter.brokerstatus`).
+"""
+
+__all__ = ['EXECUTORS', 'submit', 'queued_count', 'worker_count']
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import functools
+import threading
+
+from structlog import get_logger
+
+from .jobs import get_job, update_job
+from .scratch import cleanup_orphans
+from .tracing import TRACE_HEADER, current_traceparent
+
+EXECUTORS = ("celery", "thread", "process")
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+# Whether this pool process has set itself up (see _run_in_process).
+_process_ready = [False]
+_process_lock = threading.Lock()
+
+
+def submit(app, task, args=(), kwargs=None, task_id=None, countdown=None):
+    """Run Celery task ``task`` with the configured executor, after
+    ``countdown`` seconds if given.
+    """
+    kind = app.config["EXECUTOR"]
+    if kind == "celery":
+        options = dict((key, value) for key, value in
+                       [("kwargs", kwargs), ("task_id", task_id),
+                        ("countdown", countdown)] if value is not None)
+        task.apply_async(args, **options)
+        return
+    # Handed on by hand, as there is no message for the headers to go in.
+    headers = {TRACE_HEADER: current_traceparent()}
+    if countdown:
+        timer = threading.Timer(countdown, _pool(app).submit,
+                                args=(app, task.name, args, kwargs, task_id,
+                                      headers))
+        timer.daemon = True
+        timer.start()
+        return
+    _pool(app).submit(app, task.name, args, kwargs, task_id, headers)
+
+
+def queued_count(app):
+    """Tasks waiting for an in-process worker.
+    """
+    return _pool(app).queued()
+
+
+def worker_count(app):
+    return app.config["EXECUTOR_WORKERS"]
+
+
+class _Pool(object):
+    """A pool of threads or processes, and how many tasks it has yet to
+    finish.
+    """
+
+    def __init__(self, kind, workers):
+        self.kind = kind
+        self.workers = workers
+        self._outstanding = 0
+        self._lock = threading.Lock()
+        self._executor = self._start()
+
+    def _start(self):
+        if self.kind == "thread":
+            return ThreadPoolExecutor(max_workers=self.workers)
+        # Neither initializer nor mp_context exist before Python 3.7: the
+        #  processes set themselves up on their first task.
+        return ProcessPoolExecutor(max_workers=self.workers)
+
+    def submit(self, app, name, args, kwargs, task_id, headers):
+        run = _run_task if self.kind == "thread" else _run_in_process
+        with self._lock:
+            try:
+                future = self._executor.submit(run, name, args, kwargs,
+                                               task_id, headers)
+            except BrokenProcessPool:
+                # A process was lost (a hard stage deadline exits it); the
+                #  jobs it had are failed (see _done), and the pool is
+                #  replaced.
+                get_logger().warning("Restarting the process pool")
+                self._executor = self._start()
+                future = self._executor.submit(run, name, args, kwargs,
+                                               task_id, headers)
+            self._outstanding += 1
+        future.add_done_callback(functools.partial(self._done, app,
+                                                   task_id))
+
+    def queued(self):
+        with self._lock:
+            return max(self._outstanding - self.workers, 0)
+
+    def _done(self, app, task_id, future):
+        with self._lock:
+            self._outstanding -= 1
+        if future.exception() is None:
+            return
+        get_logger().error("Task failed to run", task_id=task_id,
+                           error=str(future.exception()))
+        # The task never got to record its own failure.  A job's task ID
+        #  is its job ID.
+        job = get_job(app, task_id) if task_id is not None else None
+        if job is not None and job["status"] in ("queued", "running"):
+            update_job(app, task_id, status="failed",
+                       error="Task failed to run: %s" % future.exception())
+
+
+def _pool(app):
+    kind = app.config["EXECUTOR"]
+    with _pools_lock:
+        if kind not in _pools:
+            cleanup_orphans(app)
+            _pools[kind] = _Pool(kind, app.config["EXECUTOR_WORKERS"])
+        return _pools[kind]
+
+
+def _run_in_process(name, args, kwargs, task_id, headers):
+    """Run a task in a pool process, setting the process up as a Celery
+    worker would be on its first task.
+
+    Tasks queued by its tasks (a deferred job's resumption, say) run in
+    threads of the same process, rather than in a pool of its own.
+    """
+    with _process_lock:
+        if not _process_ready[0]:
+            from .createapp import create_worker_app
+            create_worker_app().config["EXECUTOR"] = "thread"
+            _process_ready[0] = True
+    _run_task(name, args, kwargs, task_id, headers)
+
+
+def _run_task(name, args, kwargs, task_id, headers):
+    from .celeryapp import celery_app
+    result = celery_app.tasks[name].apply(args, kwargs, task_id=task_id,
+                                          headers=headers)
+    if result.failed():
+        get_logger().error("Task failed", task=name, task_id=task_id,
+                           error=str(result.result))
@@ -0,0 +1,164 @@
+"""Fair scheduling of jobs across submitting users.
+
+Rather than going straight onto the Celery queue, a job waits in its
+submitter's own queue in the shared store, and a *dispatch token*
+(``dispatch_job_as_task``) goes onto the Celery queue in its place.
+Whichever worker runs a token takes the next job round-robin across the
+users with jobs waiting, so one user's burst of jobs cannot hold everyone
+else's back.
+
+- No user has more than ``FAIR_MAX_RUNNING_PER_USER`` jobs running at once;
+  their other jobs wait while other users' jobs run.  A token that finds
+  only capped users waiting puts itself back on the queue.
+- A user with ``FAIR_MAX_QUEUED_PER_USER`` jobs already waiting is turned
+  away with a ``429`` (`check_user_quota`; see also
+  `uservice_ccutter.admission`).
+
+Running jobs hold a lease of ``FAIR_LEASE_SECONDS``, so that a worker that
+dies mid-job does not hold its user's slot for ever.
+"""
+
+__all__ = ['check_user_quota', 'enqueue_job', 'next_job', 'finish_job',
+           'queued_count', 'running_count']
+
+import contextlib
+import math
+import time
+import uuid
+
+import msgpack
+from structlog import get_logger
+
+from .admission import AdmissionError
+from .store import get_store
+
+_USERS_KEY = "ccutter:fair:users"
+_QUEUE_KEY = "ccutter:fair:queue:"
+_RUNNING_KEY = "ccutter:fair:running:"
+_LOCK_KEY = "ccutter:fair:lock"
+
+
+def check_user_quota(app, username):
+    """Raise `AdmissionError` if ``username`` already has
+    ``FAIR_MAX_QUEUED_PER_USER`` jobs waiting.
+    """
+    queued = queued_count(app, username)
+    cap = app.config["FAIR_MAX_QUEUED_PER_USER"]
+    if not cap or queued < cap:
+        return
+    retry_after = int(math.ceil(
+        (queued - cap + 1) * app.config["ADMISSION_JOB_SECONDS"] /
+        float(max(app.config["FAIR_MAX_RUNNING_PER_USER"], 1))))
+    get_logger().warning("Refusing job", user=username, queued=queued,
+                         retry_after=retry_after)
+    raise AdmissionError(retry_after,
+                         "You already have %d jobs waiting; "
+                         "try again in %d seconds." % (queued, retry_after))
+
+
+def enqueue_job(app, username, job):
+    """Put ``job`` (a `dict` of msgpack-able values, with a ``job_id``) in
+    ``username``'s queue.
+    """
+    user = username.lower()
+    store = get_store(app)
+    with _locked(store):
+        store.rpush(_QUEUE_KEY + user, msgpack.packb(job, use_bin_type=True))
+        if user.encode("utf-8") not in store.lrange(_USERS_KEY, 0, -1):
+            store.rpush(_USERS_KEY, user)
+
+
+def next_job(app):
+    """Take the next job in round-robin order across users who are under
+    their concurrency cap.
+
+    Returns
+    -------
+    picked : `tuple` or None
+        ``(username, job)``, or None if no job may run now.
+    """
+    store = get_store(app)
+    cap = app.config["FAIR_MAX_RUNNING_PER_USER"]
+    with _locked(store):
+        for _ in range(store.llen(_USERS_KEY)):
+            user = store.lpop(_USERS_KEY)
+            if user is None:
+                break
+            user = user.decode("utf-8")
+            queue = _QUEUE_KEY + user
+            if not store.llen(queue):
+                continue
+            if cap and _running(store, user) >= cap:
+                store.rpush(_USERS_KEY, user)
+                continue
+            job = msgpack.unpackb(store.lpop(queue), raw=False)
+            if store.llen(queue):
+                # To the back of the line.
+                store.rpush(_USERS_KEY, user)
+            expires = time.time() + app.config["FAIR_LEASE_SECONDS"]
+            store.rpush(_RUNNING_KEY + user, _lease(job["job_id"], expires))
+            return user, job
+    return None
+
+
+def finish_job(app, username, job_id):
+    """Release the slot held by a job.
+    """
+    store = get_store(app)
+    user = username.lower()
+    with _locked(store):
+        for lease in store.lrange(_RUNNING_KEY + user, 0, -1):
+            if lease.decode("utf-8").split(" ")[0] == job_id:
+                store.lrem(_RUNNING_KEY + user, 1, lease)
+
+
+def queued_count(app, username=None):
+    """Jobs waiting for one user, or for everyone.
+    """
+    store = get_store(app)
+    if username is not None:
+        return store.llen(_QUEUE_KEY + username.lower())
+    return sum(store.llen(_QUEUE_KEY + user.decode("utf-8"))
+               for user in store.lrange(_USERS_KEY, 0, -1))
+
+
+def running_count(app, username):
+    """Jobs running for a user.
+    """
+    store = get_store(app)
+    with _locked(store):
+        return _running(store, username.lower())
+
+
+def _lease(job_id, expires):
+    return "%s %f" % (job_id, expires)
+
+
+def _running(store, user):
+    """Count a user's unexpired leases, dropping the expired ones.
+    """
+    now = time.time()
+    count = 0
+    for lease in store.lrange(_RUNNING_KEY + user, 0, -1):
+        if float(lease.decode("utf-8").split(" ")[1]) <= now:
+            store.lrem(_RUNNING_KEY + user, 1, lease)
+        else:
+            count += 1
+    return count
+
+
+@contextlib.contextmanager
+def _locked(store, timeout=5):
+    """Serialize scheduling decisions across processes.
+    """
+    token = uuid.uuid4().hex
+    deadline = time.time() + timeout
+    while not store.set(_LOCK_KEY, token, ex=timeout, nx=True):
+        if time.time() > deadline:
+            raise RuntimeError("Timed out waiting for the scheduling lock")
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        if store.get(_LOCK_KEY) == token.encode("utf-8"):
+            store.delete(_LOCK_KEY)
@@ -0,0 +1,177 @@
+"""Create projects at GitHub from template repositories, without a local
+build.
+
+For project types whose registry entry sets ``"engine": "generate"``,
+GitHub copies the template repository into the new repository itself
+(``POST /repos/:owner/:template/generate``), and the project is then
+rendered in memory (see `uservice_ccutter.render`) and committed over the
+copy with the Git Data API in a single commit.  Blobs that GitHub already
+has, which is every file that rendering did not change, are referred to by
+their SHA instead of being uploaded again.  Nothing is written to disk and
+no git process runs.
+
+The template repository must be marked as a template at GitHub, and must
+not have cookiecutter hooks, which only run in a real build.  GitHub copies
+the template's default branch, whichever branch the registry names: the
+project is rendered from the registry's branch, and replaces the copy
+entirely, but its commit's parent is the head of the default branch.
+"""
+
+__all__ = ['can_generate', 'generate_repository', 'commit_project',
+           'blob_sha']
+
+import base64
+import hashlib
+import os
+import stat
+import time
+from urllib.parse import urlparse
+
+from apikit import BackendError, raise_from_response
+import requests
+
+from .rendercache import render_cached
+
+_HEADERS = {
+    # The generate endpoint was a preview when this was written.
+    "Accept": "application/vnd.github.baptiste-preview+json",
+}
+
+
+def can_generate(template_repo_dir):
+    """Whether a template can be used to generate projects (it has no
+    hooks).
+    """
+    return not os.path.isdir(os.path.join(template_repo_dir, "hooks"))
+
+
+def generate_repository(app, auth, template_url, template_values):
+    """Create ``template_values["github_repo"]`` from a template repository
+    and wait until GitHub has filled it in.
+
+    Parameters
+    ----------
+    app : `flask.Flask`
+        The app, for ``GITHUB_API_URL``.
+    auth : `dict`
+        ``username`` and ``password`` (GitHub token).
+    template_url : `str`
+        GitHub URL of the template repository.
+    template_values : `dict`
+        Template values, after substitution.
+
+    Returns
+    -------
+    clone_url : `str`
+        HTTPS clone URL of the new repository.
+    branch : `str`
+        Its default branch, the copy of the template's.
+
+    Raises
+    ------
+    apikit.BackendError
+        Raised if GitHub refuses; a 404 or 422 means the template repository
+        is not a template (or not visible to the user).
+    """
+    api = app.config["GITHUB_API_URL"].rstrip("/")
+    owner, name = template_values["github_repo"].split("/")
+    template = urlparse(template_url).path.strip("/")
+    description = template_values.get(
+        "github_description", template_values.get("description", ""))
+    resp = requests.post(api + "/repos/" + template + "/generate",
+                         auth=_auth(auth), headers=_HEADERS,
+                         json={"owner": owner, "name": name,
+                               "description": description})
+    raise_from_response(resp)
+    repo = resp.json()
+    # The copy happens in the background; the branch shows up when it is
+    #  done.
+    branch = repo.get("default_branch") or "master"
+    for attempt in range(1, 11):
+        resp = requests.get("%s/repos/%s/git/ref/heads/%s" %
+                            (api, repo["full_name"], branch),
+                            auth=_auth(auth))
+        if resp.status_code not in (404, 409):
+            break
+        time.sleep(0.5 * attempt)
+    raise_from_response(resp)
+    return repo["clone_url"], branch
+
+
+def commit_project(app, auth, template_repo_dir, template_values,
+                   message="Initial commit.", branch="master"):
+    """Replace the contents of ``branch`` of ``template_values["github_repo"]``
+    with the rendered project, in one commit.
+
+    Returns
+    -------
+    uploaded : `int`
+        The number of files whose content had to be uploaded.
+    """
+    api = "%s/repos/%s" % (app.config["GITHUB_API_URL"].rstrip("/"),
+                           template_values["github_repo"])
+    resp = requests.get(api + "/git/ref/heads/" + branch, auth=_auth(auth))
+    raise_from_response(resp)
+    head = resp.json()["object"]["sha"]
+    resp = requests.get(api + "/git/commits/" + head, auth=_auth(auth))
+    raise_from_response(resp)
+    resp = requests.get(api + "/git/trees/" + resp.json()["tree"]["sha"],
+                        params={"recursive": "1"}, auth=_auth(auth))
+    raise_from_response(resp)
+    existing = set(entry["sha"] for entry in resp.json()["tree"]
+                   if entry["type"] == "blob")
+
+    tree = []
+    uploaded = 0
+    for rfile in render_cached(app, template_repo_dir, template_values):
+        # Drop the project directory: its contents are the repository.
+        path = rfile.path.split("/", 1)[1]
+        sha = blob_sha(rfile.content)
+        if sha not in existing:
+            content = base64.b64encode(rfile.content).decode("ascii")
+            resp = requests.post(api + "/git/blobs", auth=_auth(auth),
+                                 json={"content": content,
+                                       "encoding": "base64"})
+            raise_from_response(resp)
+            if resp.json()["sha"] != sha:
+                raise BackendError(reason="Internal Server Error",
+                                   status_code=500,
+                                   content="GitHub stored %s as %s" %
+                                   (path, resp.json()["sha"]))
+            existing.add(sha)
+            uploaded += 1
+        executable = rfile.mode & (stat.S_IXUSR | stat.S_IXGRP |
+                                   stat.S_IXOTH)
+        tree.append({"path": path, "type": "blob", "sha": sha,
+                     "mode": "100755" if executable else "100644"})
+
+    # No base tree: whatever the template had that the project does not
+    #  (cookiecutter.json, ...) goes.
+    resp = requests.post(api + "/git/trees", auth=_auth(auth),
+                         json={"tree": tree})
+    raise_from_response(resp)
+    committer = {"name": template_values["github_name"],
+                 "email": template_values["github_email"]}
+    resp = requests.post(api + "/git/commits", auth=_auth(auth),
+                         json={"message": message,
+                               "tree": resp.json()["sha"],
+                               "parents": [head],
+                               "author": committer,
+                               "committer": committer})
+    raise_from_response(resp)
+    resp = requests.patch(api + "/git/refs/heads/" + branch,
+                          auth=_auth(auth),
+                          json={"sha": resp.json()["sha"], "force": False})
+    raise_from_response(resp)
+    return uploaded
+
+
+def blob_sha(content):
+    """The git object ID of a blob with this content.
+    """
+    header = ("blob %d\0" % len(content)).encode("ascii")
+    return hashlib.sha1(header + content).hexdigest()
+
+
+def _auth(auth):
+    return (auth["username"], auth["password"])
@@ -1,7 +1,7 @@
 """GitHub client utilities.
 """
 
-__all__ = ['login_github']
+__all__ = ['login_github', 'get_github_identity']
 
 import github3
 
@@ -37,3 +37,42 @@ def login_github(username, token=None):
                            reason="Bad credentials",
                            content="GitHub login failed.")
     return github_client
+
+
+def get_github_identity(username, token):
+    """Look up who a set of GitHub credentials belongs to.
+
+    Parameters
+    ----------
+    username : `str`
+        GitHub username
+    token : `str`
+        API token.
+
+    Returns
+    -------
+    identity : `dict`
+        ``login``: the GitHub login the token belongs to, and ``orgs``: the
+        sorted logins of the organizations that user belongs to.
+
+    Raises
+    ------
+    apikit.BackendError
+        Raised with a 401 status code when the login fails or the token
+        belongs to somebody other than ``username``.
+    """
+    github_client = github3.login(username, token=token)
+    try:
+        user = github_client.me()
+        login = user.login
+    except (github3.exceptions.AuthenticationFailed, AttributeError):
+        raise BackendError(status_code=401,
+                           reason="Bad credentials",
+                           content="GitHub login failed.")
+    if login.lower() != username.lower():
+        raise BackendError(status_code=401,
+                           reason="Bad credentials",
+                           content="GitHub token does not belong to %s." %
+                           username)
+    orgs = sorted(org.login for org in github_client.organizations())
+    return {"login": login, "orgs": orgs}
@@ -0,0 +1,115 @@
+"""Push commits to GitHub, and clone from it, without running git.
+
+dulwich speaks git's smart HTTP protocol in process: it asks the remote
+for its refs, packs the objects the remote lacks straight from the local
+object store, and sends them with the credentials attached to the request.
+Nothing is written to the repository's configuration and no subprocess is
+started.
+"""
+
+__all__ = ['push', 'clone']
+
+import os
+from urllib.parse import urlparse
+
+from dulwich.client import HttpGitClient, LocalGitClient
+from dulwich.errors import GitProtocolError, NotGitRepository
+from dulwich.repo import Repo
+
+
+def push(repo_dir, remote_url, username=None, password=None,
+         branch="master"):
+    """Push a branch of a local repository to the same branch of a remote.
+
+    Parameters
+    ----------
+    repo_dir : `str`
+        Local repository.
+    remote_url : `str`
+        HTTPS clone URL of the remote (or a ``file://`` URL, for testing).
+    username : `str`, optional
+        GitHub username.
+    password : `str`, optional
+        GitHub API token.
+    branch : `str`, optional
+        Branch to push.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if the push is refused, including when it is not a
+        fast-forward of the remote branch.
+    """
+    ref = ("refs/heads/" + branch).encode("utf-8")
+    local = Repo(repo_dir)
+    new_sha = local.refs[ref]
+
+    def update_refs(refs):
+        old_sha = refs.get(ref)
+        if old_sha is not None and old_sha != new_sha and \
+                not _is_ancestor(local, old_sha, new_sha):
+            raise RuntimeError("Git push to {} failed: {} is not a "
+                               "fast-forward".format(remote_url, branch))
+        refs[ref] = new_sha
+        return refs
+
+    client, path = _client(remote_url, username, password)
+    try:
+        client.send_pack(path, update_refs,
+                         local.object_store.generate_pack_data)
+    except (GitProtocolError, NotGitRepository) as exc:
+        raise RuntimeError("Git push to {} failed: {}".format(remote_url,
+                                                              exc))
+    finally:
+        local.close()
+
+
+def clone(remote_url, repo_dir, username=None, password=None,
+          branch="master"):
+    """Clone a branch of a remote repository into a new local repository,
+    and check it out.
+
+    Parameters are as for `push`.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if the remote cannot be read or has no such branch.
+    """
+    ref = ("refs/heads/" + branch).encode("utf-8")
+    client, path = _client(remote_url, username, password)
+    local = Repo.init(repo_dir, mkdir=not os.path.exists(repo_dir))
+    try:
+        result = client.fetch(path, local)
+        refs = getattr(result, "refs", result)
+        if ref not in refs:
+            raise RuntimeError("Git clone of {} failed: no branch {}".format(
+                remote_url, branch))
+        local.refs[ref] = refs[ref]
+        local.refs.set_symbolic_ref(b"HEAD", ref)
+        local.reset_index(local[refs[ref]].tree)
+    except (GitProtocolError, NotGitRepository) as exc:
+        raise RuntimeError("Git clone of {} failed: {}".format(remote_url,
+                                                               exc))
+    finally:
+        local.close()
+
+
+def _client(remote_url, username, password):
+    """Return a dulwich client for a remote, and the path to ask it for.
+    """
+    parsed = urlparse(remote_url)
+    if parsed.scheme == "file":
+        return LocalGitClient(), parsed.path
+    client = HttpGitClient(parsed.scheme + "://" + parsed.netloc + "/",
+                           username=username, password=password)
+    return client, parsed.path
+
+
+def _is_ancestor(repo, ancestor, sha):
+    """Whether commit ``ancestor`` is in the history of commit ``sha``.
+    """
+    if ancestor not in repo.object_store:
+        return False
+    return any(entry.commit.id == ancestor
+               for entry in repo.get_walker(include=[sha]))
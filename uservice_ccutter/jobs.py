@@ -0,0 +1,145 @@
+"""Checkpoints of project creation jobs, so that a job that stops partway
+can be resumed rather than started over.
+
+Each job has a record in the shared store under its ID (the Celery task ID
+of ``create_project_as_task``), holding:
+
+- ``status``: ``queued``, ``running``, ``deferred`` (waiting on an
+  upstream; see `uservice_ccutter.circuitbreaker`), ``done``,
+  ``incomplete`` (the repository exists but finalization did not finish)
+  or ``failed``;
+- ``stages``: the stages completed so far, in order, including each
+  ``finalize_`` phase as ``finalize:<phase>``;
+- ``values``: the template values as of the last checkpoint, so
+  ``serial_number``, ``github_repo_url`` and so on survive the job; and
+- ``owner``, ``project_type``, ``error``, ``deferrals``, ``updated``, and
+  ``trace_id``, the trace of its latest run (see
+  `uservice_ccutter.tracing`).
+
+Stages that only touch the job's workspace are not checkpointed, since the
+workspace does not survive the job; a resumed job redoes them, or clones
+the repository back from GitHub once it has been pushed.  Records expire
+``JOB_RETENTION`` seconds after their last update.
+
+A job can be resumed once it has ``failed`` or is ``incomplete``, or if it
+has been ``running`` without progress for ``JOB_STALE_SECONDS``: its worker
+is taken to have died under it.
+"""
+
+__all__ = ['RESUMABLE', 'create_job', 'get_job', 'update_job',
+           'claim_for_resume', 'tracking', 'checkpoint']
+
+import contextlib
+from collections import OrderedDict
+import json
+import threading
+import time
+
+from .store import get_store
+
+_JOB_KEY = "ccutter:job:"
+_RESUME_LOCK_KEY = "ccutter:job-resume:"
+
+# A job in one of these states can be resumed.
+RESUMABLE = ("failed", "incomplete")
+
+_current = threading.local()
+
+
+def create_job(app, job_id, project_type, owner, values, trace_id=None):
+    """Record a newly queued job, with its initial template values.
+    """
+    record = {"id": job_id, "project_type": project_type, "owner": owner,
+              "status": "queued", "stages": [], "values": values,
+              "error": None, "deferrals": 0, "trace_id": trace_id}
+    _save(app, record)
+    return record
+
+
+def get_job(app, job_id):
+    """Return a job's record, or None if there is none (any more).
+
+    ``values`` is an `OrderedDict`, in template order.
+    """
+    data = get_store(app).get(_JOB_KEY + job_id)
+    if data is None:
+        return None
+    record = json.loads(data.decode("utf-8"))
+    record["values"] = OrderedDict(record["values"])
+    return record
+
+
+def update_job(app, job_id, **fields):
+    """Update fields of a job's record, and return it.
+    """
+    record = get_job(app, job_id)
+    if record is None:
+        raise RuntimeError("No record of job %s" % job_id)
+    record.update(fields)
+    _save(app, record)
+    return record
+
+
+def claim_for_resume(app, job_id):
+    """Queue a resumable job again, returning its record, or None if it is
+    not resumable (or someone else is resuming it right now).
+
+    A ``running`` job is resumable once it has made no progress for
+    ``JOB_STALE_SECONDS``.
+    """
+    store = get_store(app)
+    if not store.set(_RESUME_LOCK_KEY + job_id, "1", ex=60, nx=True):
+        return None
+    try:
+        record = get_job(app, job_id)
+        if record is None or not _resumable(app, record):
+            return None
+        record["status"] = "queued"
+        _save(app, record)
+        return record
+    finally:
+        store.delete(_RESUME_LOCK_KEY + job_id)
+
+
+@contextlib.contextmanager
+def tracking(app, job_id):
+    """Make job ``job_id`` the one that `checkpoint` records progress for,
+    in the body of the ``with`` statement.
+    """
+    _current.job = (app, job_id)
+    try:
+        yield
+    finally:
+        _current.job = None
+
+
+def checkpoint(stage, values):
+    """Record that the current job (see `tracking`) has completed ``stage``,
+    leaving the template values as ``values``.
+
+    Does nothing outside of a job.
+    """
+    current = getattr(_current, "job", None)
+    if current is None:
+        return
+    app, job_id = current
+    record = get_job(app, job_id)
+    if stage not in record["stages"]:
+        record["stages"].append(stage)
+    record["values"] = values
+    _save(app, record)
+
+
+def _resumable(app, record):
+    if record["status"] == "running":
+        stale = app.config["JOB_STALE_SECONDS"]
+        return stale is not None and time.time() - record["updated"] > stale
+    return record["status"] in RESUMABLE
+
+
+def _save(app, record):
+    record["updated"] = time.time()
+    # Values go as pairs, to keep the template order.
+    data = dict(record, values=list(record["values"].items()))
+    get_store(app).set(_JOB_KEY + record["id"], json.dumps(data),
+                       ex=app.config["JOB_RETENTION"])
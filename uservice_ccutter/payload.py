@@ -0,0 +1,44 @@
+"""Compact encoding of template values for the trip through the broker.
+
+Values are packed with msgpack as a list of ``[key, value]`` pairs, which
+keeps them small and (unlike a msgpack map) keeps their order, which
+cookiecutter needs.  Payloads above a size threshold are also
+zlib-compressed.  The first byte of a payload says which it is.
+"""
+
+__all__ = ['encode_values', 'decode_values']
+
+from collections import OrderedDict
+import zlib
+
+import msgpack
+
+_PACKED = b"\x00"
+_COMPRESSED = b"\x01"
+
+
+def encode_values(template_values, compress_threshold=None):
+    """Encode an ordered mapping of template values as `bytes`.
+
+    Parameters
+    ----------
+    template_values : `collections.OrderedDict`
+        Template values.
+    compress_threshold : `int`, optional
+        Compress payloads of at least this many bytes.  None means never.
+    """
+    packed = msgpack.packb(list(template_values.items()), use_bin_type=True)
+    if compress_threshold is not None and len(packed) >= compress_threshold:
+        return _COMPRESSED + zlib.compress(packed)
+    return _PACKED + packed
+
+
+def decode_values(payload):
+    """Decode `bytes` from `encode_values` back into an `OrderedDict`.
+    """
+    flag, body = payload[:1], payload[1:]
+    if flag == _COMPRESSED:
+        body = zlib.decompress(body)
+    elif flag != _PACKED:
+        raise ValueError("Unknown template payload format %r" % flag)
+    return OrderedDict(msgpack.unpackb(body, raw=False))
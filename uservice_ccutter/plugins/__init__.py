@@ -1,5 +1,8 @@
 """Plugins for the Cookiecutter make-me-a-thing service"""
 # Actual project types live in the projecttypes directory.
-from .finalize import finalize
+from .finalize import finalize, has_finalize
+from .load_plugin import preload_plugins
 from .substitute import substitute
-__all__ = ["finalize", "substitute"]
+from .targetorg import target_org
+__all__ = ["finalize", "has_finalize", "preload_plugins", "substitute",
+           "target_org"]
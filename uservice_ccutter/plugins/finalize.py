@@ -6,6 +6,13 @@ from structlog import get_logger
 from .load_plugin import load_plugin
 
 
+def has_finalize(templatetype):
+    """Whether the type has a finalize_ (which may need a checkout of the
+    new repository).
+    """
+    return "finalize_" in load_plugin(templatetype).__dict__
+
+
 def finalize(templatetype, auth, inputdict):
     """Dispatch to particular type's finalize_ (note trailing underscore;
     the theory is that your actual fields won't end with one) function, if
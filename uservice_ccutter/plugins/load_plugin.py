@@ -1,4 +1,4 @@
-"""Load a plugin module by name.
+"""Load plugin modules by name.
 """
 import sys
 import importlib
@@ -8,6 +8,7 @@ try:
 except ImportError:
     ModuleNotFoundError = ImportError
 from apikit import BackendError
+from structlog import get_logger
 
 
 def load_plugin(plugin_name):
@@ -32,3 +33,16 @@ def load_plugin(plugin_name):
                                (plugin_name, str(exc)))
         mod = sys.modules[modname]
     return mod
+
+
+def preload_plugins(plugin_names):
+    """Load the named plugins, skipping (with a warning) project types that
+    have no plugin.
+    """
+    logger = get_logger()
+    for plugin_name in plugin_names:
+        try:
+            load_plugin(plugin_name)
+        except BackendError as exc:
+            logger.warning("Could not preload plugin", plugin=plugin_name,
+                           error=exc.content)
@@ -7,18 +7,24 @@ type as the first string argument and your
 dictionary-requiring-substitution as input, and it will change the
 values in that dictionary.
 """
-import os
+import time
 from urllib.parse import urljoin
 
 from celery.utils.log import get_task_logger
+from flask import current_app
 import git
-from git.exc import GitCommandError
 import requests
 from travisci import TravisCI
-from apikit import retry_request, raise_ise, raise_from_response
+from apikit import BackendError, raise_ise, raise_from_response
 
 from .generic import current_year
+from ... import deadlines
+from ...circuitbreaker import (CircuitOpenError, get_breaker, upstream,
+                               upstream_failed)
+from ...credentialbroker import get_broker
+from ...jobs import checkpoint
 from ...github import login_github
+from ...gitpush import push
 
 ORGSERIESMAP = {"sqr": "lsst-sqre",
                 "dmtn": "lsst-dm",
@@ -44,8 +50,9 @@ def serial_number(auth, inputdict):
     #  is a candidate to be something in a series.
     matchstr = gh_org + "/" + series + "-"
     usedserials = []
-    for repo in github_client.repositories():
-        rnm = str(repo).lower()
+    with upstream(current_app, "github"):
+        repos = [str(repo).lower() for repo in github_client.repositories()]
+    for rnm in repos:
         if rnm.startswith(matchstr):
             # Take whatever is after the dash as a possible serial number
             serstr = rnm[(len(matchstr)):]
@@ -116,12 +123,22 @@ def first_author(auth, inputdict):
     return inputdict["first_author"]
 
 
+def target_org_(auth, inputdict):
+    """The org is determined by the series.
+    """
+    series = inputdict.get("series")
+    if not isinstance(series, str):
+        # Still the pick list; substitution will fail later anyway.
+        return None
+    return ORGSERIESMAP.get(series.lower())
+
+
 def finalize_(auth, inputdict):
     """Register with Keeper.
 
-    This requires some environment variables to be set.  The first
-    token in the environment variable (before the first underscore) is
-    the username that comes in as auth["username"], uppercased.  Let's
+    This requires a bundle of secrets for the submitting user (see
+    `uservice_ccutter.credentialbroker`).  The environment variables
+    holding them are named after auth["username"], uppercased.  Let's
     pretend that is 'SQRBOT', because it usually will be.  Then
     'SQRBOT_KEEPER_USERNAME' and 'SQRBOT_KEEPER_PASSWORD' must be set
     in the environment in order to update LSST The Docs.
@@ -135,86 +152,124 @@ def finalize_(auth, inputdict):
 
     This is very clumsy and means, basically, you need one set of six
     environment variables per user.  But we certainly do not want to
-    let unauthenticated users poke the API.
+    let unauthenticated users poke the API.  At least the worker checks
+    them all when it starts, and the Keeper token is usually cached.
 
     This is a pretty good argument for Vault or something like it.
+
+    Completed phases are listed in inputdict["finalized_phases"] (and
+    checkpointed; see `uservice_ccutter.jobs`), and skipped if finalize_
+    is run again, as it is when the job is resumed.  If a phase fails, the
+    return value says which phases are incomplete.  If an upstream's
+    circuit breaker is open (see `uservice_ccutter.circuitbreaker`),
+    `CircuitOpenError` is raised so that the rest of the work can be
+    deferred.
     """
     logger.debug('finalize_ inputdict: %r', inputdict)
 
-    logger.debug('finalize_ inputdict: %r' % inputdict)
+    broker = get_broker(current_app)
+    keeper_url = current_app.config["KEEPER_URL"]
+    travis_clients = []
+
+    def travis():
+        # Logging in to Travis CI is a call to it too.
+        if not travis_clients:
+            with upstream(current_app, "travis"):
+                travis_clients.append(TravisCI(github_token=auth["password"]))
+        return travis_clients[0]
+
+    def update_keeper():
+        with upstream(current_app, "keeper"):
+            keeper_token = broker.keeper_token(auth["username"])
+            _update_keeper(keeper_url, keeper_token, inputdict)
 
-    tokenurl = "https://keeper.lsst.codes/token"
-    keeper_token = _get_keeper_token(tokenurl, auth)
-    stage = 0
     # pylint: disable=bad-continuation
-    phases = ["Update LTD keeper with new technote",
-              "Add Travis CI webhook",
-              "Update .travis.yml with secrets",
-              "Push updated .travis.yml to GitHub",
-              "Protect 'master' branch at GitHub",
+    phases = [("keeper", "Update LTD keeper with new technote",
+               update_keeper),
+              ("travis_webhook", "Add Travis CI webhook",
+               lambda: _add_travis_webhook(travis(), inputdict)),
+              ("travis_yml", "Update .travis.yml with secrets",
+               lambda: _update_travis_yml(travis(), inputdict, keeper_url,
+                                          broker.bundle(auth["username"]))),
+              ("travis_push", "Push updated .travis.yml to GitHub",
+               lambda: _push_to_github(auth, inputdict)),
+              ("protect_branch", "Protect 'master' branch at GitHub",
+               lambda: _enable_protected_branches(auth, inputdict)),
               ]
+    done = inputdict.setdefault("finalized_phases", [])
+    # The updated .travis.yml only exists in the local clone until it is
+    #  pushed.
+    if "travis_yml" in done and "travis_push" not in done:
+        done.remove("travis_yml")
     retval = None
     try:
-        logger.info("Attempting to: %s", phases[stage])
-        _update_keeper(keeper_token, inputdict)
-        logger.info("Completed: %s", phases[stage])
-        stage += 1
-
-        tcli = TravisCI(github_token=auth["password"])
-        logger.info("Attempting to: %s", phases[stage])
-        _add_travis_webhook(tcli, inputdict)
-        logger.info("Completed: %s", phases[stage])
-        stage += 1
-
-        logger.info("Attempting to: %s", phases[stage])
-        _update_travis_yml(tcli, inputdict, auth["username"].upper())
-        logger.info("Completed: %s", phases[stage])
-        stage += 1
-
-        logger.info("Attempting to: %s", phases[stage])
-        _push_to_github(inputdict)
-        logger.info("Completed: %s", phases[stage])
-        stage += 1
-
-        logger.info("Attempting to: %s", phases[stage])
-        _enable_protected_branches(auth, inputdict)
-        logger.info("Completed: %s", phases[stage])
-        stage += 1
+        for name, description, action in phases:
+            if name in done:
+                continue
+            logger.info("Attempting to: %s", description)
+            with deadlines.stage(current_app, "finalize:" + name):
+                action()
+            done.append(name)
+            checkpoint("finalize:" + name, inputdict)
+            logger.info("Completed: %s", description)
+    except CircuitOpenError:
+        raise
     except Exception as exc:
         # We actually want the overall API call to succeed, since we have
         #  successfuly created the repository, which is the point of no
         #  return
         logger.error("Exception in finalization: %s", str(exc))
-        logger.error('Incomplete finalization stages: %r',
-                     ', '.join(phases[stage:]))
+        incomplete = ', '.join(description
+                               for name, description, _ in phases
+                               if name not in done)
+        logger.error('Incomplete finalization stages: %r', incomplete)
+        retval = "%s (incomplete: %s)" % (exc, incomplete)
     return retval
 
 
 def _add_travis_webhook(tcli, inputdict, retries=10):
     """Enable repository for Travis CI.
     """
+    breaker = get_breaker(current_app, "travis")
+
     def _retry_callback(n=None, remaining=None, status=None, content=None):
         """Callback for enable_travis_webhook called after each unsuccessful
         retry attempt.
         """
         logger.info('Travis webhook try %r/%r, Travis status=%r',
                     n, n + remaining, status)
+        breaker.record(status is not None and status < 500)
+        breaker.check()
         # Kick the resync endpoint again
         tcli.start_travis_sync()
 
     series = inputdict["series"].lower()
     slug = ORGSERIESMAP[series] + "/" + series + "-" + \
         inputdict["serial_number"]
-    # Set up the retries to go for about an hour
-    tcli.enable_travis_webhook(slug, retry_args={'tries': 17,
-                                                 'initial_interval': 30,
-                                                 'callback': _retry_callback})
+    # Set up the retries to go for about an hour.  Until Travis CI has
+    #  synced the new repository it answers with a 4xx, which is expected;
+    #  only server errors count against the breaker, and the retries stop
+    #  if it opens.
+    breaker.check()
+    try:
+        tcli.enable_travis_webhook(slug,
+                                   retry_args={'tries': 17,
+                                               'initial_interval': 30,
+                                               'callback': _retry_callback})
+    except CircuitOpenError:
+        # Opened by a failed retry, which has been recorded.
+        raise
+    except Exception as exc:
+        breaker.record(not upstream_failed(exc))
+        raise
+    breaker.record(True)
 
 
-def _update_travis_yml(tcli, inputdict, username):
+def _update_travis_yml(tcli, inputdict, keeper_url, bundle):
     """Put encrypted authentication secrets into .travis.yml.
     """
-    data = _generate_travis_secrets(tcli, inputdict, username)
+    with upstream(current_app, "travis"):
+        data = _generate_travis_secrets(tcli, inputdict, keeper_url, bundle)
     filename = inputdict["local_git_dir"] + "/.travis.yml"
     logger.debug("About to try to write %r", filename)
     try:
@@ -225,63 +280,44 @@ def _update_travis_yml(tcli, inputdict, username):
         raise_ise(str(exc))
 
 
-def _generate_travis_secrets(tcli, inputdict, username):
-    """Map environment variables (probably set as Kubernetes secrets)
+def _generate_travis_secrets(tcli, inputdict, keeper_url, bundle):
+    """Map the user's secret bundle (probably set from Kubernetes secrets)
     to statements to encrypt and put into travis.yml.
     """
-    keeperurl = "https://keeper.lsst.codes"
     travis_base_envvars = ["LTD_KEEPER_USER",
                            "LTD_KEEPER_PASSWORD",
                            "LTD_MASON_AWS_ID",
                            "LTD_MASON_AWS_SECRET"]
-    travis_env_values = []
-    for benv in travis_base_envvars:
-        fullvarname = username + "_" + benv
-        try:
-            travis_env_values.append(os.environ[fullvarname])
-        except KeyError as exc:
-            raise_ise("Environment variable " + str(exc) + " must be set")
-    logger.debug("All environment variables present")
-    travis_env = dict(zip(travis_base_envvars, travis_env_values))
-    travis_env["LTD_KEEPER_URL"] = keeperurl
-    secure_env = ""
-    repo = inputdict["github_repo"]
+    travis_env = dict((benv, bundle[benv]) for benv in travis_base_envvars)
+    travis_env["LTD_KEEPER_URL"] = keeper_url
+    return _encrypt_travis_env(tcli, inputdict["github_repo"], travis_env)
 
+
+def _encrypt_travis_env(tcli, repo, travis_env):
+    """Encrypt environment variables for the repository's .travis.yml.
+
+    The repository's public key is fetched once (TravisCI caches it per
+    repository), and every secret is then encrypted locally against it.
+    """
+    pubkey = tcli.get_public_key(repo)
+    if not pubkey:
+        # Travis has not generated a key for the repository yet; asking
+        #  again for each secret would not help.
+        raise_ise("Travis CI has no public key for " + repo)
+    secure_env = ""
     for envkey in travis_env:
         envstr = "%s=%s" % (envkey, travis_env[envkey])
         logger.debug("Travis encrypt: %r", envkey)
         secure_env += "    - "
-        secure_env += tcli.create_travis_secure_string_for_repo(repo, envstr)
+        secure_env += tcli.create_travis_secure_string(pubkey, envstr)
         secure_env += "\n"
     return secure_env
 
 
-def _get_keeper_token(tokenurl, auth):
-    """Get token from keeper.lsst.codes.
-    """
-    uname = auth["username"].upper()
-    uenv = uname + "_KEEPER_USERNAME"
-    penv = uname + "_KEEPER_PASSWORD"
-    try:
-        kuser = os.environ[uenv]
-        kpass = os.environ[penv]
-    except KeyError:
-        logger.error("Both %r and %r must be set", uenv, penv)
-        raise_ise("Both %s and %s must be set" % (uenv, penv))
-    logger.info("Requesting token from keeper.lsst.codes")
-    resp = requests.get(tokenurl, auth=(kuser, kpass))
-    raise_from_response(resp)
-    try:
-        token = resp.json()["token"]
-    except Exception as exc:
-        raise_ise(str(exc))
-    return token
-
-
-def _update_keeper(token, inputdict):
+def _update_keeper(keeper_url, token, inputdict):
     """Update keeper with new product.
     """
-    updateurl = "https://keeper.lsst.codes/products/"
+    updateurl = keeper_url.rstrip("/") + "/products/"
     slug = inputdict["series"].lower() + "-" + inputdict["serial_number"]
     postdata = {
         "bucket_name": "lsst-the-docs",
@@ -300,7 +336,7 @@ def _update_keeper(token, inputdict):
     raise_from_response(resp)
 
 
-def _push_to_github(inputdict):
+def _push_to_github(auth, inputdict):
     repo = git.Repo(inputdict["local_git_dir"])
     idx = repo.index
     committer = git.Actor(inputdict["github_name"],
@@ -308,11 +344,12 @@ def _push_to_github(inputdict):
     idx.add([".travis.yml"])
     idx.commit("Added Travis CI configuration.",
                author=committer, committer=committer)
-    origin = repo.remote()
-    try:
-        origin.push(refspec="master:master")
-    except GitCommandError:
-        raise_ise("Git push to %s failed" % inputdict["github_repo"])
+    with upstream(current_app, "github"):
+        try:
+            push(inputdict["local_git_dir"], inputdict["github_repo_url"],
+                 auth["username"], auth["password"])
+        except RuntimeError:
+            raise_ise("Git push to %s failed" % inputdict["github_repo"])
 
 
 def _enable_protected_branches(auth, inputdict):
@@ -345,7 +382,7 @@ def _enable_protected_branches(auth, inputdict):
     user = auth["username"]
     token = auth["password"]
 
-    gh_host = "https://api.github.com"
+    gh_host = current_app.config["GITHUB_API_URL"]
     endpoint_path = '/repos/{github_repo}/branches/{branch}/protection'
     endpoint_path = endpoint_path.format(github_repo=inputdict['github_repo'],
                                          branch='master')
@@ -370,7 +407,18 @@ def _enable_protected_branches(auth, inputdict):
     logger.debug("Changing branch protection %r", endpoint_url)
 
     # Sometimes this, weirdly, gets a 404.  We'll wrap it in a retry
-    #  loop
-    resp = retry_request("put", endpoint_url, headers=headers, payload=data,
-                         auth=(user, token))
-    raise_from_response(resp)
+    #  loop, which gives up as soon as the GitHub breaker opens.
+    tries = 10
+    for attempt in range(1, tries + 1):
+        try:
+            with upstream(current_app, "github"):
+                resp = requests.put(endpoint_url, headers=headers, json=data,
+                                    auth=(user, token))
+                raise_from_response(resp)
+            return
+        except BackendError as exc:
+            if attempt == tries:
+                raise
+            logger.info("Branch protection try %d/%d, GitHub status=%r",
+                        attempt, tries, exc.status_code)
+            time.sleep(5 * attempt)
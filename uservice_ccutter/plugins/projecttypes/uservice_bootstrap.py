@@ -41,3 +41,11 @@ def svc_name(auth, inputdict):
         inputdict["github_repo"] = "lsst-sqre/uservice-" + \
                                    inputdict["svc_name"]
     return inputdict["svc_name"]
+
+
+def target_org_(auth, inputdict):
+    """The org is the one in github_repo, which defaults to lsst-sqre.
+    """
+    if inputdict.get("github_repo"):
+        return inputdict["github_repo"].split("/")[0]
+    return "lsst-sqre"
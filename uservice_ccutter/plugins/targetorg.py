@@ -0,0 +1,20 @@
+"""Ask a project type which GitHub organization a project will go in.
+"""
+from .load_plugin import load_plugin
+
+
+def target_org(templatetype, auth, inputdict):
+    """Dispatch to the particular type's target_org_ function, if it
+    exists.  Return None if it doesn't.
+
+    target_org_ is called before substitution, so it must work from the
+    submitted fields alone, and it must not talk to GitHub: it is used to
+    reject submissions from users who could not create the repository
+    before they are queued.  It returns the organization name, or None if
+    it cannot tell.
+    """
+    module = load_plugin(templatetype)
+    fname = "target_org_"
+    if fname in module.__dict__:
+        return getattr(module, fname)(auth, inputdict)
+    return None
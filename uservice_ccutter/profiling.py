@@ -0,0 +1,188 @@
+"""Opt-in profiling of project creation jobs and HTTP requests.
+
+A profile is taken when the caller asks for one (the ``X-Ccutter-Profile``
+header on a request, which is also passed on to the job it enqueues), or
+at random with probability ``PROFILE_SAMPLE_RATE``.  Reports go into the
+shared store (see `uservice_ccutter.store`), where the newest
+``PROFILE_MAX_REPORTS`` are kept for at most ``PROFILE_RETENTION``
+seconds.
+"""
+
+__all__ = ['PROFILE_HEADER', 'should_profile', 'Profile', 'profiled',
+           'list_reports', 'get_report']
+
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import resource
+import time
+import uuid
+
+from structlog import get_logger
+
+from .store import get_store
+
+PROFILE_HEADER = "X-Ccutter-Profile"
+
+_INDEX_KEY = "ccutter:profiles"
+_REPORT_KEY = "ccutter:profile:"
+
+# Where the time goes, by the package the code lives in.  Time spent waiting
+#  on git subprocesses is charged to GitPython, which spawns them.
+_AREAS = [("git", os.sep + "git" + os.sep),
+          ("cookiecutter", os.sep + "cookiecutter" + os.sep),
+          ("plugins", os.sep + os.path.join("uservice_ccutter", "plugins")),
+          ("github", os.sep + "github3" + os.sep)]
+
+
+def should_profile(app, requested=False):
+    """Decide whether to profile: always if ``requested``, otherwise at
+    the configured sampling rate.
+    """
+    if requested:
+        return True
+    return random.random() < app.config["PROFILE_SAMPLE_RATE"]
+
+
+class Profile(object):
+    """A wall-clock profile of one job or request, plus its CPU time and
+    that of any subprocesses it waited for.
+    """
+
+    def __init__(self, kind, name, report_id=None):
+        self.kind = kind
+        self.name = name
+        self.report_id = report_id or uuid.uuid4().hex
+        self._profile = cProfile.Profile()
+        self._started = None
+        self._wall = None
+        self._cpu = None
+        self._children = None
+
+    def start(self):
+        self._started = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._children = _children_cpu()
+        self._profile.enable()
+
+    def stop(self):
+        """Stop profiling and return the report as a `dict`.
+        """
+        self._profile.disable()
+        stats = pstats.Stats(self._profile)
+        text = io.StringIO()
+        stats.stream = text
+        stats.sort_stats("cumulative").print_stats(60)
+        return {"id": self.report_id,
+                "kind": self.kind,
+                "name": self.name,
+                "started": self._started,
+                "wall_seconds": time.perf_counter() - self._wall,
+                "cpu_seconds": time.process_time() - self._cpu,
+                "subprocess_cpu_seconds": _children_cpu() - self._children,
+                "areas": _area_times(stats),
+                "stats": text.getvalue()}
+
+    def save(self, app, report):
+        """Store a report and drop reports beyond the retention limit.
+
+        Failing to store a report is logged, never raised: profiling must
+        not break the job or request being profiled.
+        """
+        try:
+            store = get_store(app)
+            store.set(_REPORT_KEY + report["id"], json.dumps(report),
+                      ex=app.config["PROFILE_RETENTION"])
+            store.lpush(_INDEX_KEY, report["id"])
+            limit = app.config["PROFILE_MAX_REPORTS"]
+            dropped = store.lrange(_INDEX_KEY, limit, -1)
+            if dropped:
+                store.delete(*[_REPORT_KEY + report_id.decode("utf-8")
+                               for report_id in dropped])
+            store.ltrim(_INDEX_KEY, 0, limit - 1)
+        except Exception as exc:
+            get_logger().warning("Could not store profile",
+                                 profile=report["id"], error=str(exc))
+            return
+        get_logger().info("Stored profile", profile=report["id"],
+                          kind=report["kind"], name=report["name"],
+                          wall_seconds=report["wall_seconds"])
+
+
+@contextlib.contextmanager
+def profiled(app, kind, name, enabled, report_id=None):
+    """Profile the body of the ``with`` statement if ``enabled``, and store
+    the report when it exits, whether or not it raised.
+    """
+    if not enabled:
+        yield None
+        return
+    profile = Profile(kind, name, report_id=report_id)
+    profile.start()
+    try:
+        yield profile
+    finally:
+        profile.save(app, profile.stop())
+
+
+def list_reports(app):
+    """Return summaries (everything but the stats) of stored reports, most
+    recent first.
+    """
+    store = get_store(app)
+    summaries = []
+    for report_id in store.lrange(_INDEX_KEY, 0, -1):
+        report = get_report(app, report_id.decode("utf-8"))
+        if report is None:
+            continue  # Expired
+        report.pop("stats")
+        summaries.append(report)
+    return summaries
+
+
+def get_report(app, report_id):
+    """Return a stored report, or None if there is no such report.
+    """
+    data = get_store(app).get(_REPORT_KEY + report_id)
+    if data is None:
+        return None
+    return json.loads(data.decode("utf-8"))
+
+
+def _children_cpu():
+    """CPU time used by terminated, waited-for child processes.
+    """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _area_times(stats):
+    """Cumulative time spent in each area of interest.
+
+    Only calls into an area from outside it are counted (``pstats`` keeps
+    cumulative time per caller), so nested calls within an area are not
+    counted twice.
+    """
+    totals = dict((area, 0.0) for area, _ in _AREAS)
+    for func, (_, _, _, cumtime, callers) in stats.stats.items():
+        area = _area_of(func[0])
+        if area is None:
+            continue
+        if not callers:
+            totals[area] += cumtime
+        for caller, timing in callers.items():
+            if _area_of(caller[0]) != area:
+                totals[area] += timing[3]
+    return totals
+
+
+def _area_of(filename):
+    for area, marker in _AREAS:
+        if marker in filename:
+            return area
+    return None
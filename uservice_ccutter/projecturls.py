@@ -1,4 +1,64 @@
-"""GitHub URLs for each project type.
+"""GitHub URLs for each project type, and the template registry built from
+them.
 """
+
+__all__ = ['PROJECTURLS', 'load_registry']
+
+from collections import OrderedDict
+import json
+
+# The default registry: every type is preloaded and refreshed on the
+#  global cache timeout.
 PROJECTURLS = ["https://github.com/lsst-sqre/lsst-technote-bootstrap",
                "https://github.com/lsst-sqre/uservice-bootstrap"]
+
+
+def load_registry(registry_file=None, default_ttl=None):
+    """Build the template registry.
+
+    Parameters
+    ----------
+    registry_file : `str`, optional
+        Path of a JSON file holding a list of registry entries.  Each entry
+        is an object with:
+
+        - ``url``: GitHub URL of the template repository (required).
+        - ``name``: project type name (default: the repository name).
+        - ``branch``: branch to use (default: ``master``).
+        - ``ttl``: seconds before the cached cookiecutter.json is stale
+          (default: ``default_ttl``).
+        - ``preload``: whether the type is loaded at startup and kept
+          resident (default: true).  Other types are loaded on first use.
+        - ``idle_ttl``: seconds without use after which a type that is not
+          preloaded is evicted (default: its ``ttl``).
+        - ``engine``: how projects are created: ``cookiecutter`` (build
+          and push them; the default) or ``generate`` (have GitHub copy
+          the template repository; see `uservice_ccutter.generate`).
+
+        If not given, the registry is `PROJECTURLS` with default settings.
+    default_ttl : `int`, optional
+        TTL for entries that don't set one.
+
+    Returns
+    -------
+    registry : `collections.OrderedDict`
+        Registry entries (with every field filled in), keyed by name.
+    """
+    if registry_file is None:
+        entries = [{"url": url} for url in PROJECTURLS]
+    else:
+        with open(registry_file) as fh:
+            entries = json.load(fh)
+    registry = OrderedDict()
+    for entry in entries:
+        url = entry["url"].rstrip("/")
+        ttl = entry.get("ttl", default_ttl)
+        name = entry.get("name", url.split("/")[-1])
+        registry[name] = {"name": name,
+                          "url": url,
+                          "branch": entry.get("branch", "master"),
+                          "ttl": ttl,
+                          "preload": entry.get("preload", True),
+                          "idle_ttl": entry.get("idle_ttl", ttl),
+                          "engine": entry.get("engine", "cookiecutter")}
+    return registry
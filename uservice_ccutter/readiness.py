@@ -0,0 +1,98 @@
+"""Whether this web process is fit to take traffic.
+
+The process is ready when:
+
+- every preloaded project type has a template in the cache (one that
+  failed its last refresh is still served, and still counts);
+- the shared store (see `uservice_ccutter.store`) answers;
+- the Celery broker answers; and
+- at least one worker answers (see `uservice_ccutter.brokerstatus`).
+
+The checks are run at most every ``READINESS_CACHE_SECONDS``, so that a
+probe every few seconds from each of Kubernetes, the load balancer and
+the autoscaler costs next to nothing.
+"""
+
+__all__ = ['check_readiness']
+
+import threading
+import time
+
+from structlog import get_logger
+
+from .brokerstatus import live_workers, queue_depth, worker_slots
+from .store import get_store
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def check_readiness(app):
+    """Return a report of the readiness checks, as a `dict` whose ``ready``
+    item says whether they all passed.
+    """
+    now = time.time()
+    with _cache_lock:
+        hit = _cache.get("report")
+        if hit is not None and \
+                now - hit[0] < app.config["READINESS_CACHE_SECONDS"]:
+            return hit[1]
+    checks = {"templates": _check_templates(app, now),
+              "store": _check_store(app),
+              "broker": _check_broker(app),
+              "workers": _check_workers(app)}
+    report = {"ready": all(check["ok"] for check in checks.values()),
+              "checked": now,
+              "checks": checks}
+    if not report["ready"]:
+        get_logger().warning("Not ready", failing=sorted(
+            name for name, check in checks.items() if not check["ok"]))
+    with _cache_lock:
+        _cache["report"] = (now, report)
+    return report
+
+
+def _check_templates(app, now):
+    """The age and last refresh result of each cached template.
+    """
+    types = {}
+    missing = []
+    for name, reg in app.config["TEMPLATE_REGISTRY"].items():
+        entry = app.config["PROJECTTYPE"].get(name)
+        if entry is None or "template" not in entry:
+            if reg["preload"]:
+                missing.append(name)
+            continue
+        age = now - entry["fetched"]
+        types[name] = {"age_seconds": round(age, 1),
+                       "stale": age >= reg["ttl"],
+                       "last_error": entry.get("last_error")}
+    return {"ok": not missing, "missing": missing, "types": types}
+
+
+def _check_store(app):
+    try:
+        get_store(app).exists("ccutter:readiness")
+    except Exception as exc:
+        return {"ok": False, "error": str(exc)}
+    return {"ok": True}
+
+
+def _check_broker(app):
+    """Reachability, queue depth, and how long the queue would take to
+    drain at ``ADMISSION_JOB_SECONDS`` a job.
+    """
+    depth = queue_depth(app)
+    if depth is None:
+        return {"ok": False, "queue_depth": None}
+    slots = worker_slots(app) or 0
+    return {"ok": True, "queue_depth": depth,
+            "estimated_wait_seconds": round(
+                depth * app.config["ADMISSION_JOB_SECONDS"] / max(slots, 1),
+                1)}
+
+
+def _check_workers(app):
+    workers = live_workers(app)
+    return {"ok": bool(workers), "live": workers,
+            "slots": worker_slots(app)}
@@ -0,0 +1,172 @@
+"""Render cookiecutter templates in memory.
+
+This mirrors what ``cookiecutter.generate.generate_files`` does, but it
+yields the rendered files instead of writing them to an output directory,
+and it does not run the template's pre- or post-generation hooks (those may
+have side effects, and are run for real when the project is created).
+Given an earlier rendering of the same template, it renders again only the
+files that the changed values affect.
+"""
+
+__all__ = ['RenderedFile', 'render_template', 'render_context']
+
+from collections import namedtuple
+import fnmatch
+import os
+
+from binaryornot.check import is_binary
+from cookiecutter.environment import StrictEnvironment
+from cookiecutter.find import find_template
+from cookiecutter.prompt import prompt_for_config
+from jinja2 import FileSystemLoader
+
+from .renderdeps import affected, changed_fields, field_index
+
+RenderedFile = namedtuple('RenderedFile', ['path', 'mode', 'content'])
+"""A single rendered file.
+
+``path`` is the POSIX path of the file, starting with the rendered project
+directory name; ``mode`` is the permission bits of the template file; and
+``content`` is the rendered file body as `bytes`.
+"""
+
+
+def render_template(template_repo_dir, template_values, previous=None):
+    """Render a cookiecutter template repository with the given values.
+
+    Parameters
+    ----------
+    template_repo_dir : `str`
+        Local checkout of the template repository (the directory that
+        contains ``cookiecutter.json``).
+    template_values : `dict`
+        Template values, as they would be written to ``cookiecutter.json``
+        (that is, after field substitution).
+    previous : `tuple`, optional
+        ``(context, files)``: the context (see `render_context`) and the
+        `RenderedFile` list of an earlier rendering of the same template
+        commit.  Files whose body refers to no field that has changed
+        since are copied from it rather than rendered again (see
+        `uservice_ccutter.renderdeps`).
+
+    Returns
+    -------
+    files : iterator of `RenderedFile`
+        The rendered files, produced lazily in ``os.walk`` order.  The
+        context and the project directory name are computed before this
+        function returns, so undefined variables in those raise here rather
+        than partway through iteration.
+    """
+    context = render_context(template_values)
+    template_dir = find_template(template_repo_dir)
+    env = StrictEnvironment(context=context, keep_trailing_newline=True)
+    env.loader = FileSystemLoader(template_dir)
+    project_name = env.from_string(
+        os.path.basename(template_dir)).render(**context)
+    reuse = None
+    if previous is not None:
+        reuse = _reuser(template_repo_dir, template_values, context, env,
+                        previous)
+    return _render_files(template_dir, project_name, context, env, reuse)
+
+
+def render_context(template_values):
+    """The context a template is rendered in: ``template_values``, with
+    the templates among them rendered.
+    """
+    context = {'cookiecutter': template_values}
+    context['cookiecutter'] = prompt_for_config(context, no_input=True)
+    return context
+
+
+def _reuser(template_repo_dir, template_values, context, env, previous):
+    """Return a function that returns the body of a template file from the
+    ``previous`` rendering, or None if it must be rendered.
+    """
+    index = field_index(template_repo_dir, template_values)
+    old_context, old_files = previous
+    changed = changed_fields(old_context, context)
+    if index.volatile or any(name.startswith('_') for name in changed):
+        # Which files are copied or rendered, and how, may have changed.
+        return None
+    bodies = dict((rfile.path.split('/', 1)[1], rfile.content)
+                  for rfile in old_files)
+
+    def reuse(relfile, outpath):
+        fields = index.files.get(relfile)
+        if fields is None or affected(fields.body, changed):
+            return None
+        if affected(fields.path, changed):
+            outpath = env.from_string(relfile).render(**old_context)
+        return bodies.get(_posix(outpath))
+
+    return reuse
+
+
+def _render_files(template_dir, project_name, context, env, reuse=None):
+    """Walk the template directory and yield a `RenderedFile` per file,
+    taking the bodies ``reuse`` has from it.
+    """
+    for root, dirs, files in os.walk(template_dir):
+        relroot = os.path.relpath(root, template_dir)
+        render_dirs = []
+        for dirname in dirs:
+            reldir = os.path.normpath(os.path.join(relroot, dirname))
+            if _is_copy_only_path(reldir, context):
+                # Like cookiecutter, copied directories keep their
+                #  unrendered names.
+                for rfile in _copy_dir(template_dir, reldir, project_name):
+                    yield rfile
+            else:
+                render_dirs.append(dirname)
+        dirs[:] = render_dirs
+
+        for filename in files:
+            relfile = os.path.normpath(os.path.join(relroot, filename))
+            infile = os.path.join(template_dir, relfile)
+            outpath = env.from_string(relfile).render(**context)
+            if not os.path.basename(outpath):
+                # A file whose name renders empty is skipped.
+                continue
+            mode = os.stat(infile).st_mode & 0o7777
+            if _is_copy_only_path(relfile, context) or is_binary(infile):
+                with open(infile, 'rb') as fh:
+                    content = fh.read()
+            else:
+                content = reuse(relfile, outpath) if reuse else None
+                if content is None:
+                    tmpl = env.get_template(
+                        relfile.replace(os.path.sep, '/'))
+                    content = tmpl.render(**context).encode('utf-8')
+            yield RenderedFile(_join(project_name, outpath), mode, content)
+
+
+def _copy_dir(template_dir, reldir, project_name):
+    """Yield the files of a ``_copy_without_render`` directory verbatim.
+    """
+    for root, _, files in os.walk(os.path.join(template_dir, reldir)):
+        for filename in files:
+            infile = os.path.join(root, filename)
+            relfile = os.path.relpath(infile, template_dir)
+            with open(infile, 'rb') as fh:
+                content = fh.read()
+            yield RenderedFile(_join(project_name, relfile),
+                               os.stat(infile).st_mode & 0o7777,
+                               content)
+
+
+def _is_copy_only_path(path, context):
+    """Check ``path`` against the template's ``_copy_without_render`` globs.
+    """
+    patterns = context['cookiecutter'].get('_copy_without_render', [])
+    return any(fnmatch.fnmatch(path, pattern) for pattern in patterns)
+
+
+def _join(project_name, relpath):
+    """Join a rendered path onto the project directory as a POSIX path.
+    """
+    return project_name + '/' + _posix(relpath)
+
+
+def _posix(relpath):
+    return '/'.join(os.path.normpath(relpath).split(os.sep))
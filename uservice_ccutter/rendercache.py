@@ -0,0 +1,206 @@
+"""Remember rendered projects, so that rendering the same thing twice is a
+lookup.
+
+The same project is often rendered more than once: previewed again and
+again while a user fills the form in, or built again by a job resumed
+after its push failed.  Each rendering is kept, as its list of
+`uservice_ccutter.render.RenderedFile`, under the template's commit and a
+hash of the values it was rendered with, in a per-process LRU cache of at
+most ``RENDER_CACHE_BYTES`` of file content (zero turns it off).
+
+Being per process, the cache only helps renderings done by the same
+process: repeated previews in a web process, and a job built again by the
+same worker.  A preview saves the job that follows it the rendering only
+with the ``thread`` executor, where both run in the web process (see
+`uservice_ccutter.executor`).
+
+A rendering that is not in the cache, but whose template commit is, is
+made from the most recently used rendering of that commit: only the files
+that the changed values affect are rendered again (see
+`uservice_ccutter.renderdeps`).
+
+Values that the service fills in after rendering (see `render_values`) are
+left out of the rendering, so that a resumed job renders what it first
+did.  Only templates without hooks are cached, as only their rendering in
+memory (for previews and generated projects) and their cookiecutter build
+produce the same files; nor are templates whose files come out different
+every time.
+"""
+
+__all__ = ['render_values', 'render_key', 'get_render', 'put_render',
+           'reuse_render', 'render_cached', 'read_project', 'write_project']
+
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import threading
+
+from structlog import get_logger
+
+from .render import RenderedFile, render_context, render_template
+from .renderdeps import field_index, template_revision
+
+# Set on the values after rendering, for finalize_ functions.
+_AFTER_RENDER = ("github_repo_url", "github_default_branch",
+                 "local_git_dir")
+
+_cache = OrderedDict()
+_cache_size = [0]
+_cache_lock = threading.Lock()
+
+
+def render_values(template_values):
+    """The template values to render with: ``template_values`` without the
+    ones that are only known once a project is rendered.
+    """
+    return OrderedDict((key, value) for key, value in template_values.items()
+                       if key not in _AFTER_RENDER)
+
+
+def render_key(template_repo_dir, template_values):
+    """The cache key for rendering the template checked out in
+    ``template_repo_dir`` with ``template_values``, or None if it cannot
+    be cached.
+    """
+    if os.path.isdir(os.path.join(template_repo_dir, "hooks")):
+        return None
+    revision = template_revision(template_repo_dir)
+    if revision is None or \
+            field_index(template_repo_dir, template_values).volatile:
+        return None
+    # Not sorted: cookiecutter renders the values in order, and a value
+    #  may refer to those before it.
+    values = json.dumps(render_values(template_values),
+                        separators=(",", ":"))
+    return (revision, hashlib.sha256(values.encode("utf-8")).hexdigest())
+
+
+def get_render(app, key):
+    """The cached rendering for ``key``, as a `tuple` of `RenderedFile`, or
+    None.
+    """
+    if key is None:
+        return None
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+    files = entry[1] if entry is not None else None
+    get_logger().debug("Render cache " +
+                       ("miss" if files is None else "hit"),
+                       revision=key[0], values=key[1])
+    return files
+
+
+def put_render(app, key, template_values, files):
+    """Cache the rendering ``files`` of ``template_values`` for ``key``,
+    evicting the least recently used renderings to make room.
+    """
+    limit = app.config["RENDER_CACHE_BYTES"]
+    size = _size(files)
+    if key is None or not files or size > limit:
+        return
+    context = render_context(render_values(template_values))
+    with _cache_lock:
+        if key in _cache:
+            _cache_size[0] -= _size(_cache.pop(key)[1])
+        _cache[key] = (context, tuple(files))
+        _cache_size[0] += size
+        while _cache_size[0] > limit:
+            _, (_, evicted) = _cache.popitem(last=False)
+            _cache_size[0] -= _size(evicted)
+
+
+def reuse_render(app, template_repo_dir, template_values):
+    """Return the cached rendering of a template with ``template_values``,
+    or one made from an earlier rendering of the same template commit, or
+    None if there is neither.
+    """
+    key = render_key(template_repo_dir, template_values)
+    files = get_render(app, key)
+    if files is not None or key is None:
+        return files
+    with _cache_lock:
+        previous = next((entry for cached, entry in reversed(_cache.items())
+                         if cached[0] == key[0]), None)
+    if previous is None:
+        return None
+    try:
+        files = list(render_template(template_repo_dir,
+                                     render_values(template_values),
+                                     previous=previous))
+    except Exception as exc:
+        get_logger().info("Could not render from the cache",
+                          error=str(exc))
+        return None
+    if template_revision(template_repo_dir) != key[0]:
+        # The checkout moved on while we rendered from it.
+        return None
+    put_render(app, key, template_values, files)
+    return files
+
+
+def render_cached(app, template_repo_dir, template_values):
+    """Render a template as `uservice_ccutter.render.render_template` does,
+    from the cache if it can be.
+
+    The rendering is cached once it has been produced in full.
+    """
+    files = reuse_render(app, template_repo_dir, template_values)
+    if files is not None:
+        return iter(files)
+    key = render_key(template_repo_dir, template_values)
+    files = render_template(template_repo_dir,
+                            render_values(template_values))
+    if key is None:
+        return files
+    return _filling(app, key, template_values, files)
+
+
+def read_project(project_dir):
+    """Read a project built on disk back as a `list` of `RenderedFile`, or
+    return None if it has anything but plain files and directories.
+    """
+    files = []
+    name = os.path.basename(project_dir)
+    for root, dirs, filenames in os.walk(project_dir):
+        dirs.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(root, filename)
+            if os.path.islink(path) or not os.path.isfile(path):
+                return None
+            with open(path, "rb") as fh:
+                content = fh.read()
+            relpath = os.path.relpath(path, project_dir)
+            files.append(RenderedFile(
+                "/".join([name] + relpath.split(os.sep)),
+                os.stat(path).st_mode & 0o7777, content))
+    return files
+
+
+def write_project(files, target_dir):
+    """Write a rendering out under ``target_dir``, as cookiecutter would,
+    and return the project directory.
+    """
+    project_dir = None
+    for rfile in files:
+        path = os.path.join(target_dir, *rfile.path.split("/"))
+        project_dir = os.path.join(target_dir, rfile.path.split("/")[0])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fh:
+            fh.write(rfile.content)
+        os.chmod(path, rfile.mode)
+    return project_dir
+
+
+def _filling(app, key, template_values, files):
+    rendered = []
+    for rfile in files:
+        rendered.append(rfile)
+        yield rfile
+    put_render(app, key, template_values, rendered)
+
+
+def _size(files):
+    return sum(len(rfile.path) + len(rfile.content) for rfile in files)
@@ -0,0 +1,188 @@
+"""Which template fields each file of a cookiecutter template depends on.
+
+Rendering a template again with a few values changed (a new
+``serial_number`` after a collision, say) need only render again the files
+that refer to those values.  `field_index` finds out, from the Jinja syntax
+tree of each file's path and body, which ``cookiecutter.*`` fields it
+refers to; `uservice_ccutter.render.render_template` uses that to copy the
+other files from an earlier rendering.
+
+A file that uses the ``cookiecutter`` variable other than to look up a
+field by name, or that includes, extends or imports another template, is
+taken to depend on every field.  A template any of whose files produce
+something new every time they are rendered (``{% now %}``, ``random``, and
+the like) is volatile: nothing of it is reused or cached.
+
+The index is worked out once per template commit.
+"""
+
+__all__ = ['FileFields', 'FieldIndex', 'field_index', 'template_revision',
+           'changed_fields', 'affected']
+
+from collections import OrderedDict, namedtuple
+import os
+import threading
+
+from binaryornot.check import is_binary
+from cookiecutter.environment import StrictEnvironment
+from cookiecutter.find import find_template
+from dulwich.errors import NotGitRepository
+from dulwich.repo import Repo
+from jinja2 import TemplateSyntaxError, nodes
+
+FileFields = namedtuple('FileFields', ['path', 'body'])
+"""The fields a template file's ``path`` and ``body`` refer to, each a
+`frozenset` of field names, or None for every field.
+"""
+
+FieldIndex = namedtuple('FieldIndex', ['files', 'volatile'])
+"""The `FileFields` of each template file (a `dict` keyed by its path
+within the template directory), and whether the template is volatile.
+"""
+
+# Globals that always give the same result for the same arguments.
+_PURE_GLOBALS = frozenset(["range", "dict", "cycler", "joiner", "namespace"])
+
+# Attributes of the values themselves, which Jinja finds before any field
+#  of the same name.
+_DICT_METHODS = frozenset(name for name in dir(OrderedDict)
+                          if not name.startswith("_"))
+
+# Template commits whose index we keep.
+_MAX_INDEXES = 32
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+class _Volatile(Exception):
+    pass
+
+
+def template_revision(template_repo_dir):
+    """The commit checked out in ``template_repo_dir``, or None if it is
+    not a git repository.
+    """
+    try:
+        return Repo(template_repo_dir).head().decode("ascii")
+    except (NotGitRepository, KeyError):
+        return None
+
+
+def field_index(template_repo_dir, template_values):
+    """Return the `FieldIndex` of the template checked out in
+    ``template_repo_dir``.
+
+    ``template_values`` are only used for the Jinja extensions they name.
+    """
+    revision = template_revision(template_repo_dir)
+    with _indexes_lock:
+        index = _indexes.get(revision)
+        if index is not None:
+            _indexes.move_to_end(revision)
+            return index
+    index = _index(find_template(template_repo_dir), template_values)
+    if revision is not None:
+        with _indexes_lock:
+            _indexes[revision] = index
+            while len(_indexes) > _MAX_INDEXES:
+                _indexes.popitem(last=False)
+    return index
+
+
+def changed_fields(old_context, new_context):
+    """The names of the fields whose values differ between two contexts
+    (``{"cookiecutter": {...}}``).
+    """
+    old = old_context["cookiecutter"]
+    new = new_context["cookiecutter"]
+    return frozenset(name for name in set(old) | set(new)
+                     if name not in old or name not in new or
+                     old[name] != new[name])
+
+
+def affected(fields, changed):
+    """Whether something that refers to ``fields`` (a `frozenset`, or None
+    for every field) is affected by a change to ``changed``.
+    """
+    return fields is None or not fields.isdisjoint(changed)
+
+
+def _index(template_dir, template_values):
+    env = StrictEnvironment(context={'cookiecutter': template_values},
+                            keep_trailing_newline=True)
+    files = {}
+    try:
+        for root, _, filenames in os.walk(template_dir):
+            relroot = os.path.relpath(root, template_dir)
+            for filename in filenames:
+                relfile = os.path.normpath(os.path.join(relroot, filename))
+                infile = os.path.join(template_dir, relfile)
+                if is_binary(infile):
+                    body = frozenset()
+                else:
+                    with open(infile, 'rb') as fh:
+                        try:
+                            body = _fields(env, fh.read().decode('utf-8'))
+                        except UnicodeDecodeError:
+                            body = None
+                files[relfile] = FileFields(_fields(env, relfile), body)
+    except _Volatile:
+        return FieldIndex({}, True)
+    return FieldIndex(files, False)
+
+
+def _fields(env, source):
+    try:
+        tree = env.parse(source)
+    except TemplateSyntaxError:
+        # Rendering it will fail, or it is copied as is; either way it is
+        #  not worth reusing.
+        return None
+    fields = set()
+    if not _visit(env, tree, fields):
+        return None
+    return frozenset(fields)
+
+
+def _visit(env, node, fields):
+    """Add the fields ``node`` refers to to ``fields``, and return whether
+    those are all it depends on.
+    """
+    if isinstance(node, nodes.Call) and \
+            isinstance(node.node, nodes.Getattr) and \
+            _is_cookiecutter(node.node.node):
+        # cookiecutter.get(name), or any other method, may read any field.
+        for child in node.iter_child_nodes():
+            _visit(env, child, fields)
+        return False
+    if isinstance(node, (nodes.Getattr, nodes.Getitem)) and \
+            _is_cookiecutter(node.node):
+        if isinstance(node, nodes.Getattr):
+            if node.attr in _DICT_METHODS:
+                # cookiecutter.items and the like, not a field.
+                return False
+            fields.add(node.attr)
+            return True
+        if isinstance(node.arg, nodes.Const):
+            fields.add(node.arg.value)
+            return True
+        return False
+    if isinstance(node, nodes.ExtensionAttribute) or \
+            (isinstance(node, nodes.Filter) and node.name == "random") or \
+            (isinstance(node, nodes.Name) and node.name in env.globals and
+             node.name not in _PURE_GLOBALS):
+        raise _Volatile()
+    if _is_cookiecutter(node) or \
+            isinstance(node, (nodes.Include, nodes.Extends, nodes.Import,
+                              nodes.FromImport)):
+        known = False
+    else:
+        known = True
+    for child in node.iter_child_nodes():
+        known = _visit(env, child, fields) and known
+    return known
+
+
+def _is_cookiecutter(node):
+    return isinstance(node, nodes.Name) and node.name == "cookiecutter"
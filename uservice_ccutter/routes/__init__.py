@@ -9,7 +9,13 @@ from flask import Blueprint
 api = Blueprint('api', __name__)
 
 from . import errorhandlers
+from . import tracing
 from . import root
 from . import projectlist
 from . import gettemplate
 from . import createproject
+from . import preview
+from . import profiling
+from . import admin
+from . import webhooks
+from . import jobs
@@ -0,0 +1,51 @@
+__all__ = ['list_profiles', 'get_profile', 'check_admin_authorization']
+
+import hmac
+
+from apikit import BackendError
+from flask import current_app, jsonify, request
+
+from . import api
+from ..profiling import get_report, list_reports
+
+
+@api.route("/ccutter/admin/profiles", methods=["GET"])
+@api.route("/ccutter/admin/profiles/", methods=["GET"])
+def list_profiles():
+    """List stored profiling reports, most recent first.
+    """
+    check_admin_authorization()
+    return jsonify({"profiles": list_reports(current_app)})
+
+
+@api.route("/ccutter/admin/profiles/<report_id>", methods=["GET"])
+def get_profile(report_id):
+    """Return a single profiling report.
+
+    Job reports have the Celery task ID as their report ID.
+    """
+    check_admin_authorization()
+    report = get_report(current_app, report_id)
+    if report is None:
+        raise BackendError(reason="Not Found",
+                           status_code=404,
+                           content="No profile %s." % report_id)
+    return jsonify(report)
+
+
+def check_admin_authorization():
+    """Raise an error unless the request carries the admin token as its
+    Basic auth password.
+    """
+    token = current_app.config["ADMIN_TOKEN"]
+    if not token:
+        raise BackendError(reason="Forbidden",
+                           status_code=403,
+                           content="Admin endpoints are not enabled.")
+    req_auth = request.authorization
+    if req_auth is None or not hmac.compare_digest(
+            (req_auth.password or "").encode("utf-8"),
+            token.encode("utf-8")):
+        raise BackendError(reason="Unauthorized",
+                           status_code=401,
+                           content="Admin token required.")
@@ -1,14 +1,26 @@
-__all__ = ['create_project']
+__all__ = ['create_project', 'build_template_values', 'check_authorization']
 
 from copy import deepcopy
-import json
+import uuid
 
 from apikit import BackendError
-from flask import jsonify, request, current_app
+from flask import g, jsonify, request, current_app
 from structlog import get_logger
 
 from . import api
-from ..tasks.createproject import create_project_as_task
+from ..admission import check_admission
+from ..credentialcheck import check_org_membership, validate_credentials
+from ..credentialref import stash_credentials
+from ..executor import submit
+from ..fairqueue import check_user_quota, enqueue_job
+from ..jobs import create_job
+from ..payload import encode_values
+from ..plugins import target_org
+from ..profiling import PROFILE_HEADER
+from ..tasks.createproject import (create_project_as_task,
+                                   dispatch_job_as_task)
+from ..templatecache import get_single_project_type
+from ..tracing import current_traceparent, current_trace_id, tag_span
 
 
 @api.route("/ccutter/<project_type>", methods=["POST"])
@@ -16,12 +28,59 @@ from ..tasks.createproject import create_project_as_task
 def create_project(project_type):
     """Create a new project.
     """
-    logger = get_logger()
-
     # We need authorization to POST.  Raise error if not.
     # FIXME move auth checking to a decorator?
-    check_authorization()
-    auth = current_app.config["AUTH"]["data"]
+    identity = check_authorization()
+    auth = g.auth
+
+    template_values = build_template_values(project_type)
+    # Don't queue a job that could only fail to create its repository.
+    check_org_membership(identity,
+                         target_org(project_type, auth, template_values))
+
+    # Refuse the job (429) if the backlog is already too deep, or if the
+    #  submitter already has too many jobs waiting.
+    check_admission(current_app)
+    if current_app.config["FAIR_SCHEDULING"]:
+        check_user_quota(current_app, auth["username"])
+
+    payload = encode_values(template_values,
+                            current_app.config["PAYLOAD_COMPRESS_THRESHOLD"])
+    credential_ref = stash_credentials(current_app, auth)
+    # The job ID is also the task ID, under which the job's progress is
+    #  recorded (see jobs.py).
+    job_id = str(uuid.uuid4())
+    create_job(current_app, job_id, project_type, auth["username"],
+               template_values, trace_id=current_trace_id())
+    tag_span(job_id=job_id)
+    profile = bool(request.headers.get(PROFILE_HEADER))
+    if current_app.config["FAIR_SCHEDULING"]:
+        # Wait in the submitter's own queue (see fairqueue.py).  The job
+        #  may be picked up by another request's dispatch task, so it
+        #  carries its own trace.
+        enqueue_job(current_app, auth["username"],
+                    {"job_id": job_id, "project_type": project_type,
+                     "credential_ref": credential_ref, "payload": payload,
+                     "profile": profile,
+                     "traceparent": current_traceparent()})
+        submit(current_app, dispatch_job_as_task)
+    else:
+        submit(current_app, create_project_as_task,
+               (project_type, credential_ref, payload), {"profile": profile},
+               task_id=job_id)
+    get_logger().info("Queued job", job_id=job_id, project_type=project_type,
+                      username=auth["username"],
+                      trace_id=current_trace_id())
+
+    return jsonify({'message': "I’m creating your project. "
+                               "Check GitHub in a sec.",
+                    'job_id': job_id})
+
+
+def build_template_values(project_type):
+    """Merge the POSTed JSON over a copy of the project type's template.
+    """
+    logger = get_logger()
 
     # Get data from request
     request_data = request.get_json()
@@ -30,36 +89,39 @@ def create_project(project_type):
                            status_code=400,
                            content="POST data must not be empty.")
 
-    logger.debug('Original template: %r' %
-                 current_app.config["PROJECTTYPE"][project_type]["template"])
+    template = get_single_project_type(current_app, project_type)
+    logger.debug('Original template: %r' % template)
 
-    template_values = deepcopy(
-        current_app.config["PROJECTTYPE"][project_type]["template"])
+    template_values = deepcopy(template)
     logger.debug('Copied template: %r' % template_values)
     # Necessary for ensuring ordering in template_values (for cookiecutter)
     for key in request_data:
         template_values[key] = request_data[key]
     logger.debug('Template with user data: %r' % template_values)
+    return template_values
 
-    serialized_template_values = json.dumps(template_values, indent=4)
-    create_project_as_task.apply_async(
-        (project_type, auth, serialized_template_values))
 
-    return jsonify({'message': "I’m creating your project. "
-                               "Check GitHub in a sec."})
+def check_authorization():
+    """Set ``g.auth`` to the request's credentials (a `dict` of ``username``
+    and ``password``) if provided, raise an error otherwise.
 
+    The credentials belong to this request alone: nothing about the caller
+    is kept in the app, which is shared by every request a process serves
+    at once.
 
-def check_authorization():
-    """Set app.auth["data"] if credentials provided, raise an error otherwise.
+    Unless ``AUTH_PRECHECK`` is off, the credentials are also validated
+    against GitHub (see `uservice_ccutter.credentialcheck`), and the
+    GitHub identity they belong to is returned.  Otherwise, returns None.
     """
-    logger = get_logger()
     req_auth = request.authorization
     if req_auth is None:
         raise BackendError(reason="Unauthorized",
                            status_code=401,
                            content="No authorization provided.")
-    # FIXME look into this: I don't think per-session auth information
-    # should go into the **app config**.
-    current_app.config["AUTH"]["data"]["username"] = req_auth.username
-    current_app.config["AUTH"]["data"]["password"] = req_auth.password
-    logger = logger.bind(username=req_auth.username)
+    g.auth = {"username": req_auth.username,
+              "password": req_auth.password}
+    tag_span(username=req_auth.username)
+    if not current_app.config["AUTH_PRECHECK"]:
+        return None
+    return validate_credentials(current_app, req_auth.username,
+                                req_auth.password)
@@ -18,4 +18,7 @@ def handle_invalid_usage(error):
     logger.error(errdict)
     response = jsonify(errdict)
     response.status_code = error.status_code
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        response.headers["Retry-After"] = str(retry_after)
     return response
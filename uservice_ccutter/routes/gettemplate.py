@@ -11,5 +11,5 @@ from ..templatecache import refresh_cache, get_single_project_type
 def get_template(ptype):
     """Get a single project template.
     """
-    refresh_cache(current_app, current_app.config['max_cache_age'])
-    return jsonify(get_single_project_type(ptype))
+    refresh_cache(current_app)
+    return jsonify(get_single_project_type(current_app, ptype))
@@ -0,0 +1,66 @@
+__all__ = ['get_job_status', 'resume_job']
+
+from apikit import BackendError
+from flask import current_app, g, jsonify
+
+from . import api
+from .createproject import check_authorization
+from ..credentialref import stash_credentials
+from ..executor import submit
+from ..jobs import claim_for_resume, get_job, update_job
+from ..tasks.createproject import resume_project_as_task
+from ..tracing import current_trace_id
+
+
+@api.route("/ccutter/jobs/<job_id>", methods=["GET"])
+@api.route("/ccutter/jobs/<job_id>/", methods=["GET"])
+def get_job_status(job_id):
+    """Report a job's progress to the user who submitted it.
+    """
+    check_authorization()
+    job = _get_own_job(job_id)
+    return jsonify(_describe(job))
+
+
+@api.route("/ccutter/jobs/<job_id>/resume", methods=["POST"])
+@api.route("/ccutter/jobs/<job_id>/resume/", methods=["POST"])
+def resume_job(job_id):
+    """Run the stages a failed or incomplete job did not complete.
+    """
+    check_authorization()
+    auth = g.auth
+    _get_own_job(job_id)
+    job = claim_for_resume(current_app, job_id)
+    if job is None:
+        raise BackendError(reason="Conflict",
+                           status_code=409,
+                           content="Job %s cannot be resumed now." % job_id)
+    submit(current_app, resume_project_as_task,
+           (job_id, stash_credentials(current_app, auth)))
+    job = update_job(current_app, job_id, trace_id=current_trace_id())
+    response = jsonify(_describe(job))
+    response.status_code = 202
+    return response
+
+
+def _get_own_job(job_id):
+    """Return the job, if the requesting user submitted it.
+    """
+    job = get_job(current_app, job_id)
+    username = g.auth["username"]
+    # Someone else's job is as good as missing.
+    if job is None or job["owner"].lower() != username.lower():
+        raise BackendError(reason="Not Found",
+                           status_code=404,
+                           content="No job %s." % job_id)
+    return job
+
+
+def _describe(job):
+    return {"job_id": job["id"],
+            "project_type": job["project_type"],
+            "status": job["status"],
+            "stages": job["stages"],
+            "error": job["error"],
+            "trace_id": job.get("trace_id"),
+            "github_repo_url": job["values"].get("github_repo_url")}
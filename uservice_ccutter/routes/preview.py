@@ -0,0 +1,117 @@
+__all__ = ['preview_project']
+
+import hashlib
+import io
+import json
+import tarfile
+import time
+
+from apikit import BackendError
+from flask import Response, current_app, g, request, stream_with_context
+from structlog import get_logger
+
+from . import api
+from .createproject import build_template_values, check_authorization
+from ..plugins import substitute
+from ..rendercache import render_cached
+from ..templatecheckout import get_template_checkout
+
+
+@api.route("/ccutter/<project_type>/preview", methods=["POST"])
+@api.route("/ccutter/<project_type>/preview/", methods=["POST"])
+def preview_project(project_type):
+    """Render a project without creating anything at GitHub.
+
+    The rendered project is streamed back as it is produced: as a gzipped
+    tarball by default, or as a JSON file manifest with ``?format=json``.
+    """
+    logger = get_logger()
+
+    # Field substitution may need to read from GitHub (e.g. to find the
+    #  next technote serial number), so we need credentials here too.
+    check_authorization()
+    auth = g.auth
+
+    output_format = request.args.get("format", "tar")
+    if output_format not in ("tar", "json"):
+        raise BackendError(reason="Bad Request",
+                           status_code=400,
+                           content="format must be one of 'tar' or 'json'.")
+
+    template_values = build_template_values(project_type)
+    substitute(project_type, auth, template_values)
+    logger.debug('Template after substitute: %r' % template_values)
+
+    checkout_dir = get_template_checkout(current_app, project_type)
+    try:
+        files = render_cached(current_app, checkout_dir, template_values)
+    except Exception as exc:
+        raise BackendError(reason="Bad Request",
+                           status_code=400,
+                           content="Could not render template: " + str(exc))
+
+    if output_format == "json":
+        return Response(stream_with_context(_stream_manifest(files)),
+                        mimetype="application/json")
+    response = Response(stream_with_context(_stream_tarball(files)),
+                        mimetype="application/gzip")
+    response.headers["Content-Disposition"] = \
+        "attachment; filename=%s-preview.tar.gz" % project_type
+    return response
+
+
+class _ChunkSink(object):
+    """Write-only file object that collects output for a streamed response.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _stream_tarball(files):
+    """Yield a gzipped tarball of the rendered files, chunk by chunk.
+    """
+    sink = _ChunkSink()
+    now = time.time()
+    with tarfile.open(fileobj=sink, mode="w|gz") as tarball:
+        for rfile in files:
+            info = tarfile.TarInfo(rfile.path)
+            info.size = len(rfile.content)
+            info.mode = rfile.mode
+            info.mtime = now
+            tarball.addfile(info, io.BytesIO(rfile.content))
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    yield sink.drain()
+
+
+def _stream_manifest(files):
+    """Yield a JSON manifest of the rendered files, one entry at a time.
+
+    Text files carry their content; binary files carry ``null``.
+    """
+    yield '{"files": ['
+    separator = ""
+    for rfile in files:
+        try:
+            content = rfile.content.decode("utf-8")
+        except UnicodeDecodeError:
+            content = None
+        entry = {"path": rfile.path,
+                 "mode": "%04o" % rfile.mode,
+                 "size": len(rfile.content),
+                 "sha256": hashlib.sha256(rfile.content).hexdigest(),
+                 "content": content}
+        yield separator + json.dumps(entry)
+        separator = ", "
+    yield "]}"
@@ -0,0 +1,40 @@
+"""Profile requests that ask for it, or a sample of all requests.
+"""
+
+__all__ = ['start_request_profile', 'add_profile_header',
+           'stop_request_profile']
+
+from flask import current_app, g, request
+
+from . import api
+from ..profiling import PROFILE_HEADER, Profile, should_profile
+
+
+@api.before_request
+def start_request_profile():
+    """Start a profile if this request is to be profiled.
+    """
+    if not should_profile(current_app,
+                          bool(request.headers.get(PROFILE_HEADER))):
+        return
+    g.profile = Profile("request", request.method + " " + request.path)
+    g.profile.start()
+
+
+@api.after_request
+def add_profile_header(response):
+    """Tell the client where to find the profile of its request.
+    """
+    profile = g.get("profile")
+    if profile is not None:
+        response.headers[PROFILE_HEADER + "-Id"] = profile.report_id
+    return response
+
+
+@api.teardown_request
+def stop_request_profile(exc):
+    """Store the profile once the response, streamed or not, is done.
+    """
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profile.save(current_app, profile.stop())
@@ -9,10 +9,21 @@ from ..templatecache import refresh_cache, get_single_project_type
 @api.route("/ccutter")
 @api.route("/ccutter/")
 def display_project_types():
-    """Return cookiecutter.json for each project type.
+    """Return cookiecutter.json for each preloaded or loaded project type,
+    and where to find the others.
+
+    Listing types does not load them, or keep them from being evicted as
+    idle; only using them does (see templatecache.py).
     """
-    refresh_cache(current_app, current_app.config['max_cache_age'])
+    refresh_cache(current_app)
     retval = {}
-    for ptype in current_app.config["PROJECTTYPE"]:
-        retval[ptype] = get_single_project_type(current_app, ptype)
+    for ptype, reg in current_app.config["TEMPLATE_REGISTRY"].items():
+        loaded = current_app.config["PROJECTTYPE"].get(ptype)
+        if reg["preload"]:
+            retval[ptype] = get_single_project_type(current_app, ptype)
+        elif loaded is not None and "template" in loaded:
+            retval[ptype] = loaded["template"]
+        else:
+            retval[ptype] = {"_url": reg["url"], "_branch": reg["branch"],
+                             "_loaded": False}
     return jsonify(retval)
@@ -1,6 +1,9 @@
-__all__ = ['healthcheck']
+__all__ = ['healthcheck', 'readiness']
+
+from flask import current_app, jsonify
 
 from . import api
+from ..readiness import check_readiness
 
 
 @api.route("/")
@@ -8,3 +11,14 @@ def healthcheck():
     """Root endpoint used for Kubernetes  health checks.
     """
     return "OK"
+
+
+@api.route("/ready")
+def readiness():
+    """Readiness probe: report the checks, with a 503 if any failed.
+    """
+    report = check_readiness(current_app)
+    response = jsonify(report)
+    if not report["ready"]:
+        response.status_code = 503
+    return response
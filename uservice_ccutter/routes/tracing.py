@@ -0,0 +1,41 @@
+"""Run each request in a span of its trace (see tracing.py).
+"""
+
+__all__ = ['start_request_span', 'add_trace_header', 'finish_request_span']
+
+from flask import current_app, g, request
+
+from . import api
+from ..tracing import TRACE_HEADER, TRACE_ID_HEADER, Span
+
+
+@api.before_request
+def start_request_span():
+    """Start the request's span, continuing the caller's trace if it sent
+    one.
+    """
+    rule = request.url_rule.rule if request.url_rule else request.path
+    g.trace_span = Span(request.method + " " + rule, kind="SERVER",
+                        parent=request.headers.get(TRACE_HEADER),
+                        app=current_app,
+                        **{"http.method": request.method,
+                           "http.url": request.base_url})
+    g.trace_span.start()
+
+
+@api.after_request
+def add_trace_header(response):
+    """Tell the client which trace its request is in.
+    """
+    trace_span = g.get("trace_span")
+    if trace_span is not None:
+        trace_span.tags["http.status_code"] = str(response.status_code)
+        response.headers[TRACE_ID_HEADER] = trace_span.trace_id
+    return response
+
+
+@api.teardown_request
+def finish_request_span(exc):
+    trace_span = g.pop("trace_span", None)
+    if trace_span is not None:
+        trace_span.finish(error=exc)
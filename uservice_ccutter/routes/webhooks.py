@@ -0,0 +1,86 @@
+__all__ = ['github_push_hook', 'check_webhook_signature']
+
+import hashlib
+import hmac
+from urllib.parse import urlparse
+
+from apikit import BackendError
+from flask import current_app, jsonify, request
+from structlog import get_logger
+
+from . import api
+from ..celeryapp import celery_app, UPDATE_TEMPLATE_COMMAND
+from ..templatecache import announce_template_change
+
+
+@api.route("/ccutter/hooks/github", methods=["POST"])
+@api.route("/ccutter/hooks/github/", methods=["POST"])
+def github_push_hook():
+    """Receive GitHub push webhooks for the template repositories.
+
+    A push to the branch a project type uses refreshes that type's
+    cookiecutter.json in every web process, and tells the workers to update
+    their checkouts.  Other events are acknowledged and ignored.
+    """
+    check_webhook_signature()
+    event = request.headers.get("X-GitHub-Event")
+    if event == "ping":
+        return jsonify({"message": "pong"})
+    if event != "push":
+        return jsonify({"message": "Ignoring %s event." % event})
+    payload = request.get_json(force=True, silent=True) or {}
+    if payload.get("deleted"):
+        return jsonify({"updated": []})
+    full_name = payload.get("repository", {}).get("full_name", "").lower()
+    ref = payload.get("ref")
+    sha = payload.get("after")
+    logger = get_logger().bind(repository=full_name, ref=ref, sha=sha)
+    updated = []
+    errors = {}
+    for ptype, reg in current_app.config["TEMPLATE_REGISTRY"].items():
+        path = urlparse(reg["url"]).path.strip("/").lower()
+        if path.endswith(".git"):
+            path = path[:-4]
+        if path != full_name or ref != "refs/heads/" + reg["branch"]:
+            continue
+        logger.info("Template repository changed", ptype=ptype)
+        try:
+            announce_template_change(current_app, ptype, sha)
+        except Exception as exc:
+            # The announcement stands; other processes will try again.
+            errors[ptype] = str(exc)
+        try:
+            celery_app.control.broadcast(
+                UPDATE_TEMPLATE_COMMAND,
+                arguments={"ptype": ptype, "generation": sha})
+        except Exception as exc:
+            logger.warning("Could not notify workers", error=str(exc))
+        updated.append(ptype)
+    return jsonify({"updated": updated, "errors": errors})
+
+
+def check_webhook_signature():
+    """Raise an error unless the request body is signed with the webhook
+    secret.
+
+    GitHub's SHA-256 signature is checked if the request has one, and its
+    older SHA-1 signature otherwise.
+    """
+    secret = current_app.config["WEBHOOK_SECRET"]
+    if not secret:
+        raise BackendError(reason="Forbidden",
+                           status_code=403,
+                           content="Webhooks are not enabled.")
+    signature = request.headers.get("X-Hub-Signature-256")
+    digestmod = hashlib.sha256
+    if signature is None:
+        signature = request.headers.get("X-Hub-Signature")
+        digestmod = hashlib.sha1
+    algorithm, _, digest = (signature or "").partition("=")
+    expected = hmac.new(secret.encode("utf-8"), request.get_data(),
+                        digestmod).hexdigest()
+    if algorithm != digestmod().name or \
+            not hmac.compare_digest(digest, expected):
+        raise BackendError(reason="Unauthorized",
+                           status_code=401,
+                           content="Bad webhook signature.")
@@ -0,0 +1,187 @@
+"""Scratch space for job workspaces, in memory where there is room.
+
+A job's workspace holds a clone of the template, the rendered project and
+its new git repository: many small files, written once and read back
+soon after.  With ``SCRATCH_DIR`` set to a RAM-backed filesystem (a tmpfs
+such as ``/dev/shm``, or a Kubernetes ``emptyDir`` with ``medium:
+Memory``), workspaces go there, within two quotas:
+
+- a job whose workspace is expected to need more than ``SCRATCH_JOB_QUOTA``
+  bytes (`EXPANSION` times the size of its template checkout) gets one on
+  disk instead, in the system temporary directory; and
+- the workspaces in ``SCRATCH_DIR`` together may not be expected to need
+  more than ``SCRATCH_TOTAL_QUOTA`` bytes, or more than the filesystem has
+  free; a job that would go over gets a workspace on disk.
+
+Each workspace records who made it and what it reserved.  Workspaces whose
+process is gone (a worker that crashed or was killed), or that are older
+than ``SCRATCH_ORPHAN_AGE`` seconds, are removed by `cleanup_orphans`,
+which runs when a worker starts and whenever scratch space runs short.
+"""
+
+__all__ = ['EXPANSION', 'workspace', 'cleanup_orphans']
+
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+import uuid
+
+from structlog import get_logger
+
+# How much room a job takes, in multiples of its template checkout: the
+#  clone, the rendered project and the project's git objects.
+EXPANSION = 3
+
+_PREFIX = "ccutter-job-"
+_MARKER = ".ccutter-scratch.json"
+_LOCK = ".ccutter-scratch.lock"
+
+
+@contextlib.contextmanager
+def workspace(app, template_dir=None):
+    """Make a workspace for a job from the template checkout in
+    ``template_dir``, yield its path, and remove it afterwards.
+    """
+    estimate = EXPANSION * _size(template_dir) if template_dir else 0
+    path = _reserve(app, estimate)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def cleanup_orphans(app):
+    """Remove workspaces left behind by processes that are gone, or that
+    have outlived ``SCRATCH_ORPHAN_AGE``.
+
+    Returns the number removed.
+    """
+    now = time.time()
+    removed = 0
+    for base in _bases(app):
+        for name in _workspaces(base):
+            path = os.path.join(base, name)
+            marker = _read_marker(path)
+            if marker is None:
+                # Not yet marked, or marked by something else entirely.
+                try:
+                    created = os.path.getmtime(path)
+                except OSError:
+                    continue
+                owner_alive = True
+            else:
+                created = marker["created"]
+                owner_alive = marker["host"] != socket.gethostname() or \
+                    _alive(marker["pid"])
+            if owner_alive and \
+                    now - created < app.config["SCRATCH_ORPHAN_AGE"]:
+                continue
+            get_logger().info("Removing orphaned workspace", path=path)
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def _reserve(app, estimate):
+    """Create a workspace, in scratch space if it fits there.
+    """
+    scratch = app.config["SCRATCH_DIR"]
+    if scratch and estimate <= app.config["SCRATCH_JOB_QUOTA"]:
+        os.makedirs(scratch, exist_ok=True)
+        with _locked(scratch):
+            fits = _fits(app, scratch, estimate)
+            if not fits and cleanup_orphans(app):
+                fits = _fits(app, scratch, estimate)
+            if fits:
+                return _make(scratch, estimate)
+        reason = "scratch space is full"
+    elif scratch:
+        reason = "template is too large"
+    else:
+        reason = None
+    if reason is not None:
+        get_logger().info("Workspace goes on disk", reason=reason,
+                          estimate=estimate)
+    return _make(tempfile.gettempdir(), estimate)
+
+
+def _fits(app, scratch, estimate):
+    reserved = 0
+    for name in _workspaces(scratch):
+        marker = _read_marker(os.path.join(scratch, name))
+        if marker is not None:
+            reserved += marker["reserved"]
+    stat = os.statvfs(scratch)
+    free = stat.f_bavail * stat.f_frsize
+    return reserved + estimate <= app.config["SCRATCH_TOTAL_QUOTA"] and \
+        estimate <= free
+
+
+def _make(base, estimate):
+    path = os.path.join(base, _PREFIX + uuid.uuid4().hex)
+    os.mkdir(path)
+    with open(os.path.join(path, _MARKER), "w") as f:
+        json.dump({"host": socket.gethostname(), "pid": os.getpid(),
+                   "reserved": estimate, "created": time.time()}, f)
+    return path
+
+
+def _bases(app):
+    bases = [tempfile.gettempdir()]
+    if app.config["SCRATCH_DIR"]:
+        bases.insert(0, app.config["SCRATCH_DIR"])
+    return bases
+
+
+def _workspaces(base):
+    try:
+        return [name for name in os.listdir(base)
+                if name.startswith(_PREFIX)]
+    except OSError:
+        return []
+
+
+def _read_marker(path):
+    try:
+        with open(os.path.join(path, _MARKER)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+@contextlib.contextmanager
+def _locked(scratch):
+    """Serialize reservations across the processes sharing ``scratch``.
+    """
+    with open(os.path.join(scratch, _LOCK), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
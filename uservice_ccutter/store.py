@@ -0,0 +1,187 @@
+"""Shared key-value store for state that every web and worker process must
+see.
+
+By default this is the Redis instance that already serves as the Celery
+broker.  Setting ``CCUTTER_STORE_URL`` to ``memory://`` gives a
+process-local store instead, which is enough for development and tests.
+"""
+
+__all__ = ['get_store', 'MemoryStore']
+
+import threading
+import time
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(app):
+    """Return the store client for ``app.config["STORE_URL"]``.
+
+    Clients are created once per URL and shared; both the Redis client and
+    `MemoryStore` are safe to use from multiple threads.
+    """
+    url = app.config["STORE_URL"]
+    with _stores_lock:
+        if url not in _stores:
+            if url.startswith("memory://"):
+                _stores[url] = MemoryStore()
+            else:
+                import redis
+                _stores[url] = redis.StrictRedis.from_url(url)
+        return _stores[url]
+
+
+class MemoryStore(object):
+    """A process-local stand-in for the subset of the Redis client API that
+    this service uses.
+
+    As with Redis, values are returned as `bytes`.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._expiry = {}
+        self._lock = threading.RLock()
+
+    def _expire_stale(self, name):
+        deadline = self._expiry.get(name)
+        if deadline is not None and deadline <= time.time():
+            self._data.pop(name, None)
+            self._expiry.pop(name, None)
+
+    def _get(self, name, default=None):
+        self._expire_stale(name)
+        return self._data.get(name, default)
+
+    def _put_list(self, name, items):
+        # Like Redis, an emptied list no longer exists.
+        if items:
+            self._data[name] = items
+        else:
+            self._data.pop(name, None)
+            self._expiry.pop(name, None)
+
+    def get(self, name):
+        with self._lock:
+            return self._get(name)
+
+    def set(self, name, value, ex=None, nx=False):
+        with self._lock:
+            if nx and self._get(name) is not None:
+                return None
+            self._data[name] = _encode(value)
+            self._expiry.pop(name, None)
+            if ex is not None:
+                self._expiry[name] = time.time() + ex
+            return True
+
+    def setex(self, name, time_seconds, value):
+        return self.set(name, value, ex=time_seconds)
+
+    def delete(self, *names):
+        with self._lock:
+            count = 0
+            for name in names:
+                if self._get(name) is not None:
+                    count += 1
+                self._data.pop(name, None)
+                self._expiry.pop(name, None)
+            return count
+
+    def exists(self, name):
+        with self._lock:
+            return int(self._get(name) is not None)
+
+    def expire(self, name, time_seconds):
+        with self._lock:
+            if self._get(name) is None:
+                return False
+            self._expiry[name] = time.time() + time_seconds
+            return True
+
+    def ttl(self, name):
+        with self._lock:
+            if self._get(name) is None:
+                return -2
+            if name not in self._expiry:
+                return -1
+            return int(round(self._expiry[name] - time.time()))
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            value = int(self._get(name, b"0")) + amount
+            self._data[name] = _encode(value)
+            return value
+
+    def decr(self, name, amount=1):
+        return self.incr(name, -amount)
+
+    def lpush(self, name, *values):
+        with self._lock:
+            items = self._get(name, [])
+            for value in values:
+                items.insert(0, _encode(value))
+            self._data[name] = items
+            return len(items)
+
+    def rpush(self, name, *values):
+        with self._lock:
+            items = self._get(name, [])
+            items.extend(_encode(value) for value in values)
+            self._data[name] = items
+            return len(items)
+
+    def lpop(self, name):
+        with self._lock:
+            items = self._get(name, [])
+            value = items.pop(0) if items else None
+            self._put_list(name, items)
+            return value
+
+    def llen(self, name):
+        with self._lock:
+            return len(self._get(name, []))
+
+    def lrange(self, name, start, end):
+        with self._lock:
+            items = self._get(name, [])
+            return list(items[_slice(start, end, len(items))])
+
+    def ltrim(self, name, start, end):
+        with self._lock:
+            items = self._get(name, [])
+            self._put_list(name, items[_slice(start, end, len(items))])
+            return True
+
+    def lrem(self, name, count, value):
+        with self._lock:
+            items = self._get(name, [])
+            value = _encode(value)
+            kept = []
+            removed = 0
+            for item in items:
+                if item == value and (count == 0 or removed < abs(count)):
+                    removed += 1
+                else:
+                    kept.append(item)
+            self._put_list(name, kept)
+            return removed
+
+
+def _encode(value):
+    """Coerce a value to bytes the way redis-py does.
+    """
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return str(value).encode("utf-8")
+
+
+def _slice(start, end, length):
+    """Convert Redis inclusive list indices into a Python slice.
+    """
+    if end < 0:
+        end += length
+    return slice(start if start >= 0 else max(start + length, 0), end + 1)
@@ -1,77 +1,348 @@
-__all__ = ['create_project_as_task']
+__all__ = ['create_project_as_task', 'dispatch_job_as_task',
+           'resume_project_as_task']
 
 import json
-from collections import OrderedDict
 import contextlib
 import os
-import time
+import threading
 
+from apikit import BackendError
 from celery.utils.log import get_task_logger
-from codekit.codetools import TempDir, get_git_credential_helper
 from cookiecutter.main import cookiecutter
 from cookiecutter.exceptions import CookiecutterException
 import git
-from git.exc import GitCommandError
 from flask import current_app
 
 from ..celeryapp import celery_app
+from ..circuitbreaker import CircuitOpenError, upstream
+from ..credentialref import (drop_credentials, fetch_credentials,
+                             stash_credentials)
+from ..deadlines import cleanup_on_hard_deadline, stage
+from ..executor import submit
+from ..fairqueue import finish_job, next_job, queued_count
+from ..generate import can_generate, commit_project, generate_repository
 from ..github import login_github
-from ..plugins import substitute, finalize
+from ..gitpush import clone, push
+from ..jobs import checkpoint, create_job, get_job, tracking, update_job
+from ..payload import decode_values
+from ..plugins import substitute, finalize, has_finalize
+from ..profiling import profiled, should_profile
+from ..rendercache import (put_render, read_project, render_key,
+                           render_values, reuse_render, write_project)
+from ..scratch import workspace
+from ..templatecheckout import get_template_checkout
+from ..tracing import current_trace_id, span
 
 logger = get_task_logger(__name__)
 
+_cwd_lock = threading.Lock()
 
-@celery_app.task
-def create_project_as_task(project_type, auth, template_values_str):
+
+@celery_app.task(bind=True)
+def create_project_as_task(self, project_type, credential_ref, payload,
+                           profile=False):
     """Create a project repository (intended to operate as an async Celery
     task.
+
+    ``credential_ref`` refers to the submitter's credentials (see
+    `uservice_ccutter.credentialref`) and ``payload`` holds the template
+    values (see `uservice_ccutter.payload`).
+
+    If ``profile`` is set (or the job is sampled; see
+    `uservice_ccutter.profiling`), a profile of the job is stored under
+    the task ID.
+
+    The job's progress is checkpointed under the task ID (see
+    `uservice_ccutter.jobs`), and `resume_project_as_task` picks it up
+    from there.  That happens on its own if an upstream's circuit breaker
+    is open (see `uservice_ccutter.circuitbreaker`), once the breaker may
+    let the job through.
+    """
+    _start_job(self.request.id, project_type, credential_ref, payload,
+               profile)
+
+
+@celery_app.task(bind=True)
+def dispatch_job_as_task(self):
+    """Run the next job in fair order across users (see
+    `uservice_ccutter.fairqueue`); one of these is queued for each job.
+
+    If every user with jobs waiting is at their concurrency cap, another
+    is queued to try again in ``FAIR_RETRY_SECONDS``.
+    """
+    picked = next_job(current_app)
+    if picked is None:
+        if queued_count(current_app):
+            submit(current_app, dispatch_job_as_task,
+                   countdown=current_app.config["FAIR_RETRY_SECONDS"])
+        return
+    username, job = picked
+    try:
+        # In the trace of the request that submitted the job, rather than
+        #  that of this task.
+        with span("job " + job["project_type"],
+                  parent=job.get("traceparent"), app=current_app,
+                  job_id=job["job_id"]):
+            _start_job(job["job_id"], job["project_type"],
+                       job["credential_ref"], job["payload"], job["profile"])
+    finally:
+        finish_job(current_app, username, job["job_id"])
+
+
+def _start_job(job_id, project_type, credential_ref, payload, profile):
+    """Run a new job.
+    """
+    try:
+        with _failing_job(job_id):
+            auth = fetch_credentials(current_app, credential_ref)
+            template_values = decode_values(payload)
+        if get_job(current_app, job_id) is None:
+            # Queued by a web process that does not record jobs.
+            create_job(current_app, job_id, project_type, auth["username"],
+                       template_values)
+        with profiled(current_app, "job", project_type,
+                      should_profile(current_app, profile),
+                      report_id=job_id):
+            _run_job(job_id, project_type, auth, template_values)
+    finally:
+        drop_credentials(current_app, credential_ref)
+
+
+@celery_app.task(bind=True)
+def resume_project_as_task(self, job_id, credential_ref):
+    """Resume job ``job_id`` from its last checkpoint, running only the
+    stages it has not completed.
+    """
+    try:
+        with _failing_job(job_id):
+            auth = fetch_credentials(current_app, credential_ref)
+        job = get_job(current_app, job_id)
+        if job is None:
+            raise RuntimeError("No record of job %s" % job_id)
+        logger.info('Resuming job %s after %r', job_id, job["stages"])
+        _run_job(job_id, job["project_type"], auth, job["values"],
+                 job["stages"])
+    finally:
+        drop_credentials(current_app, credential_ref)
+
+
+@contextlib.contextmanager
+def _failing_job(job_id):
+    """Mark the job failed if the body of the ``with`` statement raises.
+
+    Without its credentials or values a job cannot run; its record says
+    so, rather than staying queued for good.
+    """
+    try:
+        yield
+    except Exception as exc:
+        if get_job(current_app, job_id) is not None:
+            update_job(current_app, job_id, status="failed", error=str(exc))
+        raise
+
+
+def _run_job(job_id, project_type, auth, template_values, done=()):
+    """Run or resume a job, keeping its record up to date.
+    """
+    update_job(current_app, job_id, status="running", error=None,
+               trace_id=current_trace_id())
+    try:
+        with tracking(current_app, job_id):
+            post_commit_error = _create_project(project_type, auth,
+                                                template_values, done)
+    except CircuitOpenError as exc:
+        job = get_job(current_app, job_id)
+        if job["deferrals"] >= current_app.config["BREAKER_MAX_DEFERRALS"]:
+            update_job(current_app, job_id, status="failed", error=str(exc))
+            raise
+        logger.warning('Deferring job %s for %ss: %s', job_id,
+                       exc.retry_after, exc)
+        update_job(current_app, job_id, status="deferred", error=str(exc),
+                   deferrals=job["deferrals"] + 1)
+        submit(current_app, resume_project_as_task,
+               (job_id, stash_credentials(current_app, auth)),
+               countdown=exc.retry_after)
+        return
+    except Exception as exc:
+        update_job(current_app, job_id, status="failed", error=str(exc))
+        raise
+    if post_commit_error:
+        update_job(current_app, job_id, status="incomplete",
+                   error=post_commit_error)
+    else:
+        update_job(current_app, job_id, status="done")
+
+
+def _create_project(project_type, auth, template_values, done=()):
+    """Run the project creation pipeline, skipping the checkpointed stages
+    in ``done``.
+
+    Returns the error from finalization, if any.
     """
-    template_values = json.loads(template_values_str,
-                                 object_pairs_hook=OrderedDict)
     logger.info('Creating a project of type %r', project_type)
 
     logger.debug('Template before substitute: %r', template_values)
 
     # Use project type plugin to fully compute template values based on
     # defaults and user inputs already in template_values
-    substitute(project_type, auth, template_values)
+    if "substitute" not in done:
+        with stage(current_app, "substitute"):
+            substitute(project_type, auth, template_values)
+        checkpoint("substitute", template_values)
 
     logger.debug('Template after substitute: %r', template_values)
 
-    # finalize_ may need to do work with checked-out repo
-    with TempDir() as workdir:
-        template_repo_dir = os.path.join(workdir, '_template_src')
-        clone_template_repo(
-            current_app.config["PROJECTTYPE"][project_type]["cloneurl"],
-            template_repo_dir)
-
-        replace_cookiecutter_json(template_repo_dir, template_values)
-
-        build_dir = os.path.join(workdir, '_build')
-        if not os.path.exists(build_dir):
-            os.makedirs(build_dir)
-        project_dir = run_cookiecutter(template_repo_dir, build_dir)
+    # finalize_ may need to do work with checked-out repo.  The workspace
+    #  is sized from the template checkout we already have, if any (see
+    #  scratch.py).  A stage that misses its deadline (see deadlines.py)
+    #  unwinds through workspace(), which removes it.
+    checkout = current_app.config.get("TEMPLATECHECKOUT", {}).get(
+        project_type, {}).get("dir")
+    with workspace(current_app, checkout if "push" not in done else None) \
+            as workdir, cleanup_on_hard_deadline(workdir):
+        project_dir = None
+        if "push" not in done:
+            entry = current_app.config["TEMPLATE_REGISTRY"].get(project_type)
+            if entry is not None and entry["engine"] == "generate":
+                project_dir = _generate_project(project_type, auth,
+                                                template_values, workdir,
+                                                done)
+            else:
+                project_dir = _build_project(project_type, auth,
+                                             template_values, workdir, done)
+        if project_dir is None and has_finalize(project_type):
+            # There is no local copy (the job is being resumed, or GitHub
+            #  generated the project), but GitHub has the project.
+            project_dir = os.path.join(workdir, '_build', 'project')
+            with stage(current_app, "clone"), \
+                    upstream(current_app, "github"):
+                clone(template_values["github_repo_url"], project_dir,
+                      auth["username"], auth["password"])
 
         # Store project_dir for finalize()
         template_values["local_git_dir"] = project_dir
 
+        # This is the point of no return.  We have a GitHub repo,
+        #  which we must report to the user.
+        # finalize_ should not raise an exception, but returns a
+        #  description of what it could not do.
+        with stage(current_app, "finalize"):
+            post_commit_error = finalize(project_type, auth,
+                                         template_values)
+        if not post_commit_error:
+            checkpoint("finalize", template_values)
+
+    logger.info('Finalize return value: %s', post_commit_error)
+    logger.info('Finished creating the project')
+    return post_commit_error
+
+
+def _generate_project(project_type, auth, template_values, workdir, done):
+    """Have GitHub create the repository from the template, then commit the
+    rendered project over it (see generate.py).
+
+    Falls back to `_build_project` (returning the local repository
+    directory) if the template cannot be used that way; otherwise returns
+    None.
+    """
+    entry = current_app.config["TEMPLATE_REGISTRY"][project_type]
+    template_repo_dir = get_template_checkout(current_app, project_type)
+    if "create_repo" not in done:
+        if not can_generate(template_repo_dir):
+            logger.info('Template for %r has hooks; building it instead',
+                        project_type)
+            return _build_project(project_type, auth, template_values,
+                                  workdir, done)
+        logger.info('Generating GitHub repository from %s', entry["url"])
+        try:
+            with stage(current_app, "create_repo"), \
+                    upstream(current_app, "github"):
+                (template_values["github_repo_url"],
+                 template_values["github_default_branch"]) = \
+                    generate_repository(current_app, auth, entry["url"],
+                                        template_values)
+        except BackendError as exc:
+            if exc.status_code not in (404, 422):
+                raise
+            # Not (visibly) a template repository; nothing was created.
+            logger.warning('Cannot generate from %s (%s); building it '
+                           'instead', entry["url"], exc.content)
+            return _build_project(project_type, auth, template_values,
+                                  workdir, done)
+        checkpoint("create_repo", template_values)
+
+    with stage(current_app, "push"), upstream(current_app, "github"):
+        uploaded = commit_project(
+            current_app, auth, template_repo_dir, template_values,
+            branch=template_values.get("github_default_branch", "master"))
+    logger.info('Committed the project, uploading %d files', uploaded)
+    checkpoint("push", template_values)
+    return None
+
+
+def _build_project(project_type, auth, template_values, workdir, done):
+    """Render the project in ``workdir``, commit it, and push it to a new
+    GitHub repository (or the one already created, if ``done`` says so).
+
+    Returns the local repository directory.
+    """
+    build_dir = os.path.join(workdir, '_build')
+    checkout_dir = get_template_checkout(current_app, project_type)
+    # The same project may have been rendered already by this process
+    #  (previewed, or built by an earlier attempt at this job), or one
+    #  differing from it in a few values, of which we need only render
+    #  what those affect (see rendercache.py).
+    rendered = reuse_render(current_app, checkout_dir, template_values)
+    if rendered is not None:
+        logger.info('Using the cached rendering')
+        with stage(current_app, "render"):
+            project_dir = write_project(rendered, build_dir)
+    else:
+        project_dir = _render_project(checkout_dir, template_values,
+                                      workdir, build_dir)
+
+    with stage(current_app, "init"):
         init_repo(project_dir, template_values)
 
+    if "create_repo" not in done:
         logger.info('Creating GitHub repository')
-        github_remote_url = create_github_repository(auth, template_values)
-        template_values["github_repo_url"] = github_remote_url
+        with stage(current_app, "create_repo"), \
+                upstream(current_app, "github"):
+            template_values["github_repo_url"] = create_github_repository(
+                auth, template_values)
+        checkpoint("create_repo", template_values)
+
+    with stage(current_app, "push"), upstream(current_app, "github"):
+        push_to_github(project_dir, template_values["github_repo_url"], auth)
+    checkpoint("push", template_values)
+    return project_dir
 
-        push_to_github(project_dir, github_remote_url, auth)
 
-        # retval = make_project(project_type, auth, template_values, workdir)
-        # This is the point of no return.  We have a GitHub repo,
-        #  which we must report to the user.
-        # Therefore, if finalize raises an exception (it shouldn't)
-        #  we must catch it and wrap it.
-        post_commit_error = finalize(project_type, auth, template_values)
+def _render_project(checkout_dir, template_values, workdir, build_dir):
+    """Render the project with cookiecutter, from a clone of the template
+    checkout, and cache the result.
 
-    logger.info('Finalize return value: %s', post_commit_error)
-    logger.info('Finished creating the project')
+    Returns the project directory.
+    """
+    template_repo_dir = os.path.join(workdir, '_template_src')
+    # Clone from this host's checkout of the template, which is kept up
+    #  to date (see templatecheckout.py), rather than from GitHub.
+    with stage(current_app, "clone"):
+        clone_template_repo(checkout_dir, template_repo_dir)
+
+    with stage(current_app, "render"):
+        replace_cookiecutter_json(template_repo_dir, template_values)
+
+        if not os.path.exists(build_dir):
+            os.makedirs(build_dir)
+        project_dir = run_cookiecutter(template_repo_dir, build_dir)
+
+    key = render_key(template_repo_dir, template_values)
+    if key is not None:
+        rendered = read_project(project_dir)
+        if rendered is not None:
+            put_render(current_app, key, template_values, rendered)
+    return project_dir
 
 
 def clone_template_repo(repo_url, template_repo_dir):
@@ -84,14 +355,16 @@ def replace_cookiecutter_json(template_repo_dir, template_values):
     logger.info('Setting up cookiecutter.json')
     json_path = os.path.join(template_repo_dir, 'cookiecutter.json')
     with open(json_path, "w") as f:
-        f.write(json.dumps(template_values, indent=4))
+        f.write(json.dumps(render_values(template_values), indent=4))
 
 
 def run_cookiecutter(template_repo_dir, target_dir):
     logger.info('Running cookiecutter')
     if not os.path.exists(target_dir):
         os.makedirs(target_dir)
-    with change_dir(target_dir):
+    # cookiecutter changes the working directory of the whole process,
+    #  which jobs running in threads (see executor.py) share.
+    with _cwd_lock, change_dir(target_dir):
         try:
             cookiecutter(template_repo_dir, no_input=True)
         except (CookiecutterException, TypeError) as exc:
@@ -163,30 +436,7 @@ def create_github_repository(auth, template_values):
 
 def push_to_github(project_dir, remote_url, auth):
     logger.info('Pushing to GitHub')
-    repo = git.Repo(project_dir)
-
-    # Set up remote config to auth correctly
-    cred_helper = get_git_credential_helper(auth["username"],
-                                            auth["password"])
-    origin = repo.create_remote("origin", url=remote_url)
-    config_writer = repo.config_writer()
-    if not config_writer.has_section("credential"):
-        config_writer.add_section("credential")
-        config_writer.set("credential", "helper", cred_helper)
-    config_writer.release()
-    # https://gitpython.readthedocs.io/en/stable/tutorial.html:
-    # # Please note that in python 2, writing
-    # # origin.config_writer.set(...) is totally safe.
-    # # In py3 __del__ calls can be delayed, thus not writing changes
-    # # in time.
-    #  suggests that you need to wait/sync or something?
-    time.sleep(1)
-    os.sync()
-
-    try:
-        origin.push(refspec="master:master")
-    except GitCommandError:
-        raise RuntimeError("Git push to {} failed".format(remote_url))
+    push(project_dir, remote_url, auth["username"], auth["password"])
 
 
 @contextlib.contextmanager
@@ -1,10 +1,30 @@
 """Manage the cookiecutter template repo cache.
+
+Which project types exist, and where their templates live, is recorded in
+the template registry, ``app.config["TEMPLATE_REGISTRY"]`` (see
+`uservice_ccutter.projecturls.load_registry`).  The cookiecutter.json for
+a type is cached in ``app.config["PROJECTTYPE"][type]["template"]``, with
+its clone URL in ``app.config["PROJECTTYPE"][type]["cloneurl"]``.
+
+Each type has its own TTL.  Preloaded types are fetched at startup and
+kept fresh by `refresh_cache`; other types are only fetched the first time
+somebody asks for them, and are evicted again once they have not been
+asked for in their ``idle_ttl``.  That way the cost of the cache scales with
+the types people use, not with the size of the catalog.
+
+When a template repository is pushed to, `announce_template_change` records
+the new head in the shared store (see `uservice_ccutter.store`).  Every
+process looks for announcements at most every
+``TEMPLATE_ANNOUNCE_CHECK_SECONDS`` and refetches the announced types at the
+announced commit, so the TTL only matters when a push goes unannounced.
 """
 
-__all__ = ['refresh_cache']
+__all__ = ['refresh_cache', 'get_single_project_type',
+           'announce_template_change', 'announced_head']
 
 from collections import OrderedDict
 import json
+import threading
 import time
 from urllib.parse import urlparse
 
@@ -12,60 +32,217 @@ from apikit import BackendError
 import requests
 from structlog import get_logger
 
-from .projecturls import PROJECTURLS
+from .store import get_store
 
 
-def refresh_cache(app, timeout):
-    """Refresh cookiecutter.json cache if needed.
-    """
-    logger = get_logger()
+_refresh_lock = threading.Lock()
+
+_ANNOUNCED_KEY = "ccutter:template-head:"
 
-    if "CACHETIME" not in app.config:
-        app.config["CACHETIME"] = 0
-    last_cache = app.config["CACHETIME"]
-    now = int(time.time())
-    if now - last_cache < timeout:
+
+def refresh_cache(app):
+    """Refresh stale preloaded project types, and evict idle lazily-loaded
+    ones.  Each registry entry carries its own TTL.
+
+    If ``app.config["BACKGROUND_CACHE_REFRESH"]`` is set and the cache has
+    been primed, stale types are refreshed in a background thread (a
+    greenlet, under gevent) while callers carry on with the stale copies,
+    rather than holding up the request that noticed.
+    """
+    now = time.time()
+    _evict_idle(app, now)
+    announced = _pending_announcements(app, now)
+    stale = [name for name, entry in app.config["TEMPLATE_REGISTRY"].items()
+             if (entry["preload"] and _is_stale(app, name, now)) or
+             name in announced]
+    if not stale:
+        return
+    if not app.config.get("BACKGROUND_CACHE_REFRESH") or \
+            not app.config["PROJECTTYPE"]:
+        _fetch_types(app, stale, announced)
+        return
+    # Only one refresh at a time; everybody else uses the stale cache.
+    if not _refresh_lock.acquire(False):
         return
-    # Cache is older than timeout (or doesn't exist), so rebuild it.
-    # Hit each of our GitHub repositories for cookiecutter projects we
-    #  can build.  For each of those, retrieve the cookiecutter.json
-    #  file and make it into an OrderedDict.
-    # The dictionary of the cookiecutter.json files is stored in
-    #  app.config["PROJECTTYPE"][type]["template"].  Where to get a project
-    #  of that type is in app.config["PROJECTTYPE"][type]["cloneurl"].
-    # That way, when we're asked about what a particular project type
-    # needs, we only have to hit GitHub when first asked or when the
-    # timeout has expired.
-    logger.info("Cookiecutter cache requires refresh")
-    app.config["CACHETIME"] = now
-    for purl in PROJECTURLS:
-        pname = purl.split("/")[-1]
-        urlp = urlparse(purl)
-        path = urlp.path
-        ccj = "cookiecutter.json"
-        rawpath = "https://raw.githubusercontent.com" + path
-        rawpath += "/master/" + ccj
-        logger.info("Retrieving project template", path=rawpath)
-        resp = requests.get(rawpath)
-        if pname not in app.config["PROJECTTYPE"]:
-            app.config["PROJECTTYPE"][pname] = {}
-        if "template" not in app.config["PROJECTTYPE"][pname]:
-            app.config["PROJECTTYPE"][pname]["template"] = OrderedDict()
-        if resp.status_code != 200:
-            raise BackendError(reason=resp.reason,
-                               status_code=resp.status_code,
-                               content=resp.text)
-        tdata = json.loads(resp.text, object_pairs_hook=OrderedDict)
-        app.config["PROJECTTYPE"][pname]["template"] = tdata
-        app.config["PROJECTTYPE"][pname]["cloneurl"] = purl
+    # We may be handed the current_app proxy, which means nothing outside
+    #  this request.
+    app = getattr(app, "_get_current_object", lambda: app)()
+    refresher = threading.Thread(target=_fetch_types_in_background,
+                                 args=(app, stale, announced))
+    refresher.daemon = True
+    refresher.start()
 
 
 def get_single_project_type(app, ptype):
-    """Return a single project type's cookiecutter.json.
+    """Return a single project type's cookiecutter.json, fetching it first
+    if it is not loaded or has gone stale.
     """
-    if ptype not in app.config["PROJECTTYPE"]:
-        types = [x for x in app.config["PROJECTTYPE"]]
+    registry = app.config["TEMPLATE_REGISTRY"]
+    if ptype not in registry:
+        types = [x for x in registry]
         raise BackendError(status_code=400,
                            reason="Bad Request",
                            content="Project type must be one of " + str(types))
-    return app.config["PROJECTTYPE"][ptype]["template"]
+    now = time.time()
+    loaded = app.config["PROJECTTYPE"].get(ptype)
+    if loaded is not None:
+        # First, so that no other request evicts it as idle meanwhile.
+        loaded["accessed"] = now
+    # With background refreshes, refresh_cache catches up with stale
+    #  preloaded types; we serve what we have.
+    refreshed_elsewhere = registry[ptype]["preload"] and \
+        ptype in app.config["PROJECTTYPE"] and \
+        app.config.get("BACKGROUND_CACHE_REFRESH")
+    announced = _pending_announcements(app, now)
+    if (_is_stale(app, ptype, now) or ptype in announced) and \
+            not refreshed_elsewhere:
+        _fetch_types(app, [ptype], announced)
+    entry = app.config["PROJECTTYPE"][ptype]
+    entry["accessed"] = now
+    return entry["template"]
+
+
+def announce_template_change(app, ptype, sha):
+    """Record that a project type's template branch is now at commit
+    ``sha``, and refetch its cookiecutter.json here at once.
+
+    Other processes pick the announcement up on their next check.
+    """
+    get_store(app).set(_ANNOUNCED_KEY + ptype, sha)
+    app.config.setdefault("TEMPLATE_ANNOUNCED", {}).setdefault(
+        "heads", {})[ptype] = sha
+    _fetch_types(app, [ptype], {ptype: sha})
+
+
+def announced_head(app, ptype):
+    """Return the last announced head commit of a project type's template
+    branch, or None if there has been no announcement.
+    """
+    return _announced_heads(app, time.time()).get(ptype)
+
+
+def _announced_heads(app, now):
+    """Return the announced heads, reading them from the store at most every
+    ``TEMPLATE_ANNOUNCE_CHECK_SECONDS``.
+    """
+    state = app.config.setdefault("TEMPLATE_ANNOUNCED",
+                                  {"checked": 0, "heads": {}})
+    interval = app.config.get("TEMPLATE_ANNOUNCE_CHECK_SECONDS", 5)
+    if now - state.get("checked", 0) < interval:
+        return state["heads"]
+    state["checked"] = now
+    heads = {}
+    try:
+        store = get_store(app)
+        for ptype in app.config["TEMPLATE_REGISTRY"]:
+            sha = store.get(_ANNOUNCED_KEY + ptype)
+            if sha is not None:
+                heads[ptype] = sha.decode("utf-8")
+    except Exception as exc:
+        # Without the store we fall back on the TTLs.
+        get_logger().warning("Could not read template announcements",
+                             error=str(exc))
+        return state["heads"]
+    state["heads"] = heads
+    return heads
+
+
+def _pending_announcements(app, now):
+    """Announced heads of loaded types that we have not caught up with.
+    """
+    loaded = app.config["PROJECTTYPE"]
+    return dict((ptype, sha)
+                for ptype, sha in _announced_heads(app, now).items()
+                if ptype in loaded and loaded[ptype].get("generation") != sha)
+
+
+def _is_stale(app, ptype, now):
+    entry = app.config["PROJECTTYPE"].get(ptype)
+    if entry is None:
+        return True
+    ttl = app.config["TEMPLATE_REGISTRY"][ptype]["ttl"]
+    return now - entry["fetched"] >= ttl
+
+
+def _evict_idle(app, now):
+    """Drop lazily-loaded types that nobody has asked for in a while.
+    """
+    registry = app.config["TEMPLATE_REGISTRY"]
+    for ptype in list(app.config["PROJECTTYPE"]):
+        reg = registry.get(ptype)
+        if reg is None or reg["preload"]:
+            continue
+        entry = app.config["PROJECTTYPE"][ptype]
+        if now - entry.get("accessed", entry["fetched"]) >= reg["idle_ttl"]:
+            get_logger().info("Evicting idle project type", ptype=ptype)
+            app.config["PROJECTTYPE"].pop(ptype, None)
+
+
+def _fetch_types_in_background(app, ptypes, announced=None):
+    """Fetch project types, log rather than raise failures, and release the
+    refresh lock.
+    """
+    try:
+        _fetch_types(app, ptypes, announced)
+    except Exception as exc:
+        get_logger().error("Background cache refresh failed",
+                           error=str(exc))
+    finally:
+        _refresh_lock.release()
+
+
+def _fetch_types(app, ptypes, announced=None):
+    """Fetch cookiecutter.json for each of the given project types.
+
+    Types in ``announced`` (a `dict` of announced head commits) are fetched
+    at that commit rather than at their branch, which raw.githubusercontent
+    may still be caching.
+
+    As before there were per-type TTLs, a failed fetch of a type we already
+    have still counts as a refresh, so that we serve the stale copy until
+    its TTL runs out again rather than hammering GitHub.  The error is
+    raised all the same.
+    """
+    announced = announced or {}
+    heads = app.config.get("TEMPLATE_ANNOUNCED", {}).get("heads", {})
+    logger = get_logger()
+    logger.info("Cookiecutter cache requires refresh", ptypes=ptypes)
+    for pname in ptypes:
+        now = time.time()
+        # Replace entries rather than mutate them, so readers never see a
+        #  half-built one.
+        entry = dict(app.config["PROJECTTYPE"].get(pname, {}))
+        try:
+            entry["template"] = _fetch_template(app, pname,
+                                                announced.get(pname))
+        except Exception as exc:
+            if "template" in entry:
+                entry["fetched"] = now
+                entry["last_error"] = str(exc)
+                app.config["PROJECTTYPE"][pname] = entry
+            raise
+        entry["cloneurl"] = app.config["TEMPLATE_REGISTRY"][pname]["url"]
+        entry["fetched"] = now
+        entry["last_error"] = None
+        # Whatever we fetched is at least as new as the last announcement.
+        entry["generation"] = announced.get(pname, heads.get(pname))
+        entry.setdefault("accessed", now)
+        app.config["PROJECTTYPE"][pname] = entry
+
+
+def _fetch_template(app, pname, ref=None):
+    """Hit the GitHub repository for a project type, retrieve the
+    cookiecutter.json file (from the branch head, or from commit ``ref``)
+    and make it into an OrderedDict.
+    """
+    reg = app.config["TEMPLATE_REGISTRY"][pname]
+    path = urlparse(reg["url"]).path
+    rawpath = app.config["TEMPLATE_RAW_BASE_URL"] + path
+    rawpath += "/" + (ref or reg["branch"]) + "/cookiecutter.json"
+    get_logger().info("Retrieving project template", path=rawpath)
+    resp = requests.get(rawpath)
+    if resp.status_code != 200:
+        raise BackendError(reason=resp.reason,
+                           status_code=resp.status_code,
+                           content=resp.text)
+    return json.loads(resp.text, object_pairs_hook=OrderedDict)
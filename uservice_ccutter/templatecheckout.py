@@ -0,0 +1,145 @@
+"""Maintain local checkouts of the cookiecutter template repositories.
+
+The template cache (see `uservice_ccutter.templatecache`) only holds each
+project type's cookiecutter.json.  Rendering a project also needs the
+template files, so we keep a shallow clone of each template repository and
+fetch into it when it is older than the cache timeout, or when a change to
+the template has been announced since it was last fetched.
+
+Every process on a host shares the checkouts, so the last announcement a
+checkout has caught up with is recorded in the checkout itself.
+"""
+
+__all__ = ['get_template_checkout', 'update_template_checkout',
+           'update_checkout']
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import git
+from git.exc import GitCommandError
+from apikit import BackendError
+from structlog import get_logger
+
+from .templatecache import announced_head
+
+_checkout_lock = threading.Lock()
+
+# Kept inside .git, where git ignores it.
+_GENERATION_FILE = "ccutter-generation"
+
+
+def get_template_checkout(app, ptype):
+    """Return the path of an up-to-date local checkout of a project type's
+    template repository.
+
+    The checkout lives under ``app.config["TEMPLATE_CHECKOUT_DIR"]``, and
+    is fetched into once it is older than the project type's TTL or behind
+    the last announced change.  Its path, commit, and fetch time are
+    recorded in ``app.config["TEMPLATECHECKOUT"][ptype]``.
+    """
+    registry = app.config["TEMPLATE_REGISTRY"]
+    if ptype not in registry:
+        raise BackendError(status_code=400,
+                           reason="Bad Request",
+                           content="Project type must be one of " +
+                           str(list(registry)))
+    checkouts = app.config.setdefault("TEMPLATECHECKOUT", {})
+    generation = announced_head(app, ptype)
+    with _checkout_lock:
+        entry = checkouts.get(ptype, {})
+        now = int(time.time())
+        if now - entry.get("time", 0) >= registry[ptype]["ttl"] or \
+                (generation is not None and
+                 _read_generation(entry.get("dir")) != generation):
+            entry = _update(app, ptype, generation)
+    return entry["dir"]
+
+
+def update_template_checkout(app, ptype, generation=None):
+    """Bring a project type's checkout up to date now, whatever its age.
+
+    ``generation`` is the announced head commit that prompted the update,
+    if any.
+    """
+    with _checkout_lock:
+        return _update(app, ptype, generation)["dir"]
+
+
+def _update(app, ptype, generation):
+    reg = app.config["TEMPLATE_REGISTRY"][ptype]
+    checkout_dir = os.path.join(app.config["TEMPLATE_CHECKOUT_DIR"], ptype)
+    sha = update_checkout(reg["url"], checkout_dir, branch=reg["branch"])
+    if generation is not None:
+        if sha == generation:
+            _write_generation(checkout_dir, generation)
+        else:
+            # The fetch failed (or the branch has moved on again); look
+            #  again next time.
+            get_logger().warning("Template checkout is not at the "
+                                 "announced commit", ptype=ptype, sha=sha,
+                                 announced=generation)
+    entry = {"dir": checkout_dir, "sha": sha, "time": int(time.time())}
+    app.config.setdefault("TEMPLATECHECKOUT", {})[ptype] = entry
+    return entry
+
+
+def _read_generation(checkout_dir):
+    if checkout_dir is None:
+        return None
+    try:
+        with open(os.path.join(checkout_dir, ".git", _GENERATION_FILE)) as fh:
+            return fh.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _write_generation(checkout_dir, generation):
+    with open(os.path.join(checkout_dir, ".git", _GENERATION_FILE),
+              "w") as fh:
+        fh.write(generation)
+
+
+def update_checkout(cloneurl, checkout_dir, branch="master"):
+    """Clone ``cloneurl`` into ``checkout_dir``, or bring an existing clone
+    up to date with the remote ``branch``.
+
+    Returns
+    -------
+    sha : `str`
+        The commit the checkout is at.
+    """
+    logger = get_logger()
+    if not os.path.isdir(os.path.join(checkout_dir, '.git')):
+        logger.info("Cloning template repository", url=cloneurl)
+        parent = os.path.dirname(checkout_dir)
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        # Clone beside the final location and rename it into place, so that
+        #  another process never sees a partial clone.
+        tmp_dir = tempfile.mkdtemp(dir=parent)
+        try:
+            git.Repo.clone_from(cloneurl, tmp_dir, depth=1, branch=branch)
+            os.rename(tmp_dir, checkout_dir)
+        except OSError:
+            # Somebody else got there first; use theirs.
+            pass
+        finally:
+            # Whatever is left (a lost race, or a failed clone) is ours.
+            if os.path.exists(tmp_dir):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        return git.Repo(checkout_dir).head.commit.hexsha
+    repo = git.Repo(checkout_dir)
+    logger.info("Updating template checkout", url=cloneurl)
+    try:
+        repo.git.fetch('--depth', '1', 'origin', branch)
+        repo.git.reset('--hard', 'FETCH_HEAD')
+    except GitCommandError as exc:
+        # A concurrent update holds the index lock, or GitHub is having a
+        #  bad day.  The checkout we have is still usable.
+        logger.warning("Could not update template checkout",
+                       url=cloneurl, error=str(exc))
+    return repo.head.commit.hexsha
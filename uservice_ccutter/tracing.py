@@ -0,0 +1,309 @@
+"""Traces of requests and the jobs they start, across the web service, the
+Celery workers and the upstream calls they make.
+
+Each HTTP request starts a trace, or continues the one in its W3C
+``traceparent`` header, and reports the trace ID in its
+``X-Ccutter-Trace-Id`` response header.  The trace goes on with any task
+it queues (in the task message's headers) and with jobs waiting in the
+fair queue (see `uservice_ccutter.fairqueue`), so that a job, its stages
+(see `uservice_ccutter.deadlines.stage`), its ``finalize_`` phases, and
+every HTTP call made with ``requests`` (GitHub, Keeper, Travis CI) appear
+as timed spans of the request that asked for it.  A job that is deferred
+and resumed stays in the same trace.
+
+The spans of each request or task are sent, once it is done, to a Zipkin
+compatible collector at ``TRACE_EXPORT_URL`` (for example
+``http://localhost:9411/api/v2/spans``).  Without one, trace IDs are still
+handed out, to tie logs and job records together, but spans are not
+kept.  One thread per process sends them, from a queue of at most
+``_EXPORT_QUEUE_SIZE`` traces; traces finished while it is full are
+dropped.
+"""
+
+__all__ = ['TRACE_HEADER', 'TRACE_ID_HEADER', 'Span', 'span',
+           'current_span', 'current_traceparent', 'current_trace_id',
+           'tag_span', 'instrument_requests', 'instrument_celery']
+
+import binascii
+import contextlib
+import os
+import queue
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from structlog import get_logger
+
+TRACE_HEADER = "traceparent"
+TRACE_ID_HEADER = "X-Ccutter-Trace-Id"
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+_local = threading.local()
+
+# Traces waiting to be exported, and the thread exporting them.
+_EXPORT_QUEUE_SIZE = 1000
+_export_queue = queue.Queue(maxsize=_EXPORT_QUEUE_SIZE)
+_exporter = [None]
+_exporter_lock = threading.Lock()
+
+
+class Span(object):
+    """One timed operation in a trace.
+
+    Parameters
+    ----------
+    name : `str`
+        What is being timed.
+    kind : `str`, optional
+        ``SERVER`` for handling a request, ``CLIENT`` for making one.
+    parent : `str`, optional
+        A ``traceparent`` to continue.  By default, the span is a child of
+        the current span, or starts a new trace if there is none.
+    app : `flask.Flask`, optional
+        Where to find ``TRACE_EXPORT_URL``.  Only used by a span with no
+        parent in this process (a *local root*), which exports itself and
+        its descendants when it finishes.
+    tags
+        Tags for the span; more can be added to ``tags``.
+    """
+
+    def __init__(self, name, kind=None, parent=None, app=None, **tags):
+        self.name = name
+        self.kind = kind
+        self.tags = dict((key, str(value)) for key, value in tags.items())
+        self.span_id = _random_id(8)
+        self.error = None
+        self._app = app
+        self._started = None
+        self._duration = None
+        remote = _parse_traceparent(parent)
+        local_parent = current_span()
+        if remote is not None:
+            self.trace_id, self.parent_id = remote
+        elif parent is None and local_parent is not None:
+            self.trace_id = local_parent.trace_id
+            self.parent_id = local_parent.span_id
+        else:
+            self.trace_id = _random_id(16)
+            self.parent_id = None
+        if parent is None and local_parent is not None:
+            self._app = local_parent._app
+            self._finished = local_parent._finished
+            self._is_root = False
+        else:
+            self._finished = []
+            self._is_root = True
+
+    @property
+    def traceparent(self):
+        return "00-%s-%s-01" % (self.trace_id, self.span_id)
+
+    def start(self):
+        """Start timing, and make this the current span.
+        """
+        self._started = time.time()
+        _stack().append(self)
+        return self
+
+    def finish(self, error=None):
+        """Stop timing; a local root also exports its trace.
+        """
+        self._duration = time.time() - self._started
+        if error is not None:
+            self.error = str(error) or type(error).__name__
+        stack = _stack()
+        if self in stack:
+            stack.remove(self)
+        if self._app is None or \
+                not self._app.config.get("TRACE_EXPORT_URL"):
+            return
+        self._finished.append(self)
+        if self._is_root:
+            _export(self._app, list(self._finished))
+
+    def to_zipkin(self, service_name):
+        """The span in Zipkin's v2 JSON format.
+        """
+        tags = dict(self.tags)
+        if self.error is not None:
+            tags["error"] = self.error
+        record = {"traceId": self.trace_id,
+                  "id": self.span_id,
+                  "name": self.name,
+                  "timestamp": int(self._started * 1e6),
+                  "duration": max(int(self._duration * 1e6), 1),
+                  "localEndpoint": {"serviceName": service_name},
+                  "tags": tags}
+        if self.parent_id is not None:
+            record["parentId"] = self.parent_id
+        if self.kind is not None:
+            record["kind"] = self.kind
+        return record
+
+
+@contextlib.contextmanager
+def span(name, kind=None, parent=None, app=None, **tags):
+    """Time the body of the ``with`` statement as a `Span`, which is
+    yielded.
+    """
+    current = Span(name, kind=kind, parent=parent, app=app, **tags)
+    current.start()
+    try:
+        yield current
+    except BaseException as exc:
+        current.finish(error=exc)
+        raise
+    current.finish()
+
+
+def current_span():
+    """The innermost unfinished span in this thread, or None.
+    """
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def current_traceparent():
+    """The ``traceparent`` to hand on to work done for the current span, or
+    None outside of a trace.
+    """
+    current = current_span()
+    return current.traceparent if current is not None else None
+
+
+def current_trace_id():
+    current = current_span()
+    return current.trace_id if current is not None else None
+
+
+def tag_span(**tags):
+    """Tag the current span, if any.
+    """
+    current = current_span()
+    if current is not None:
+        current.tags.update((key, str(value)) for key, value in tags.items())
+
+
+def instrument_requests():
+    """Record every HTTP call made with ``requests`` within a trace as a
+    ``CLIENT`` span.  Calls made outside of a trace are left alone.
+    """
+    send = requests.Session.send
+    if getattr(send, "_ccutter_traced", False):
+        return
+
+    def traced_send(session, request, **kwargs):
+        if current_span() is None:
+            return send(session, request, **kwargs)
+        url = urlsplit(request.url)
+        # No query string: it may hold a token.
+        with span("%s %s" % (request.method, url.netloc), kind="CLIENT",
+                  **{"http.method": request.method,
+                     "http.url": "%s://%s%s" % (url.scheme, url.netloc,
+                                                url.path)}) as client:
+            response = send(session, request, **kwargs)
+            client.tags["http.status_code"] = str(response.status_code)
+            return response
+
+    traced_send._ccutter_traced = True
+    requests.Session.send = traced_send
+
+
+def instrument_celery(flask_app):
+    """Hand the current trace on in the headers of every task queued, and
+    run every task in a span of the trace that queued it.
+    """
+    task_spans = {}
+
+    def add_trace_header(headers=None, **kwargs):
+        traceparent = current_traceparent()
+        if headers is not None and traceparent is not None:
+            headers[TRACE_HEADER] = traceparent
+
+    def start_task_span(task_id=None, task=None, **kwargs):
+        request = task.request
+        parent = getattr(request, TRACE_HEADER, None) or \
+            (getattr(request, "headers", None) or {}).get(TRACE_HEADER)
+        task_span = Span(task.name, parent=parent, app=flask_app,
+                         **{"celery.task_id": task_id})
+        task_spans[task_id] = task_span.start()
+
+    def finish_task_span(task_id=None, state=None, **kwargs):
+        task_span = task_spans.pop(task_id, None)
+        if task_span is None:
+            return
+        task_span.tags["celery.state"] = str(state)
+        task_span.finish(error=None if state in (None, "SUCCESS", "RETRY")
+                         else state)
+
+    # Like the Celery app itself, the handlers belong to the latest Flask
+    #  app.
+    for signal, handler in [(before_task_publish, add_trace_header),
+                            (task_prerun, start_task_span),
+                            (task_postrun, finish_task_span)]:
+        uid = "ccutter." + handler.__name__
+        signal.disconnect(dispatch_uid=uid)
+        signal.connect(handler, weak=False, dispatch_uid=uid)
+
+
+def _stack():
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+def _random_id(nbytes):
+    return binascii.hexlify(os.urandom(nbytes)).decode("ascii")
+
+
+def _parse_traceparent(value):
+    """``(trace_id, span_id)`` from a ``traceparent`` header, or None if it
+    is missing or malformed.
+    """
+    if not value:
+        return None
+    match = _TRACEPARENT.match(value.strip().lower())
+    if match is None or set(match.group(1)) == {"0"}:
+        return None
+    return match.group(1), match.group(2)
+
+
+def _export(app, spans):
+    """Queue finished spans to be sent to the collector, off the request or
+    job's path, or drop them if the queue is full.
+    """
+    url = app.config["TRACE_EXPORT_URL"]
+    service_name = app.config["TRACE_SERVICE_NAME"]
+    data = [finished.to_zipkin(service_name) for finished in spans]
+    with _exporter_lock:
+        # Started on first use, and again in a forked process.
+        if _exporter[0] is None or not _exporter[0].is_alive():
+            _exporter[0] = threading.Thread(target=_export_forever)
+            _exporter[0].daemon = True
+            _exporter[0].start()
+    try:
+        _export_queue.put_nowait((url, data))
+    except queue.Full:
+        get_logger().warning("Dropping trace: export queue full",
+                             trace=data[0]["traceId"])
+
+
+def _export_forever():
+    """Send the queued traces to the collector, one at a time.  Failing to
+    export is logged, never raised.
+    """
+    while True:
+        url, data = _export_queue.get()
+        try:
+            requests.post(url, json=data, timeout=5).raise_for_status()
+        except Exception as exc:
+            get_logger().warning("Could not export trace",
+                                 trace=data[0]["traceId"], error=str(exc))
+        finally:
+            _export_queue.task_done()
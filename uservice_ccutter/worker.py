@@ -0,0 +1,13 @@
+"""Entry point for Celery workers
+(``celery -A uservice_ccutter.worker.celery_app worker``).
+
+This builds only what the tasks need: no routes, and no template cache
+(workers clone the templates themselves).
+"""
+
+__all__ = ['flask_app', 'celery_app']
+
+from .celeryapp import celery_app
+from .createapp import create_worker_app
+
+flask_app = create_worker_app()
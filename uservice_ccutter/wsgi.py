@@ -0,0 +1,9 @@
+"""Entry point for the web service (uwsgi, ``flask run``).
+"""
+
+__all__ = ['flask_app', 'celery_app']
+
+from .celeryapp import celery_app
+from .createapp import create_flask_app
+
+flask_app = create_flask_app()